@@ -0,0 +1,24 @@
+"""add token_version to users
+
+Revision ID: c2d3e4f5g6h
+Revises: b1c2d3e4f5g
+Create Date: 2026-01-12 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c2d3e4f5g6h'
+down_revision = 'b1c2d3e4f5g'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Counter embedded in access tokens; bumping it revokes every issued token
+    op.add_column('users', sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,39 @@
+"""add listing and foreign key indexes
+
+Revision ID: d3e4f5g6h7i
+Revises: c2d3e4f5g6h
+Create Date: 2026-01-19 09:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd3e4f5g6h7i'
+down_revision = 'c2d3e4f5g6h'
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_media_owner_id_created_at', 'media', ['owner_id', 'created_at']),
+    ('ix_thumbnails_media_id_purpose_created_at', 'thumbnails', ['media_id', 'purpose', 'created_at']),
+    ('ix_media_tags_tag_id', 'media_tags', ['tag_id']),
+    ('ix_video_renditions_media_id', 'video_renditions', ['media_id']),
+    # ON DELETE SET NULL targets: without these every thumbnail delete scans the metadata tables
+    ('ix_image_metadata_main_thumbnail_id', 'image_metadata', ['main_thumbnail_id']),
+    ('ix_video_metadata_main_thumbnail_id', 'video_metadata', ['main_thumbnail_id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps large tables writable while the indexes build; it
+    # cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,27 @@
+"""add version and updated_at to media
+
+Revision ID: e4f5g6h7i8j
+Revises: d3e4f5g6h7i
+Create Date: 2026-01-26 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4f5g6h7i8j'
+down_revision = 'd3e4f5g6h7i'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Bumped on every change to a media, its tags or metadata; feeds the ETags
+    op.add_column('media', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('media', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE media SET updated_at = created_at')
+
+
+def downgrade() -> None:
+    op.drop_column('media', 'updated_at')
+    op.drop_column('media', 'version')
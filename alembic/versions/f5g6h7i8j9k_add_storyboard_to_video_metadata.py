@@ -0,0 +1,24 @@
+"""add storyboard to video_metadata
+
+Revision ID: f5g6h7i8j9k
+Revises: e4f5g6h7i8j
+Create Date: 2026-02-02 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f5g6h7i8j9k'
+down_revision = 'e4f5g6h7i8j'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Sprite-sheet keys and grid geometry of the scrubbing storyboard
+    op.add_column('video_metadata', sa.Column('storyboard', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('video_metadata', 'storyboard')
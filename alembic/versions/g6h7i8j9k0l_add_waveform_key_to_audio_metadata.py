@@ -0,0 +1,24 @@
+"""add waveform_key to audio_metadata
+
+Revision ID: g6h7i8j9k0l
+Revises: f5g6h7i8j9k
+Create Date: 2026-02-09 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'g6h7i8j9k0l'
+down_revision = 'f5g6h7i8j9k'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # S3 key of the precomputed waveform peaks
+    op.add_column('audio_metadata', sa.Column('waveform_key', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('audio_metadata', 'waveform_key')
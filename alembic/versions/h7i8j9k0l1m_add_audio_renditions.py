@@ -0,0 +1,36 @@
+"""add audio_renditions
+
+Revision ID: h7i8j9k0l1m
+Revises: g6h7i8j9k0l
+Create Date: 2026-02-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'h7i8j9k0l1m'
+down_revision = 'g6h7i8j9k0l'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Loudness-normalized streaming versions of an audio (Opus/AAC ladder)
+    op.create_table(
+        'audio_renditions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('media_id', sa.Integer(), sa.ForeignKey('media.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('codec', sa.Text(), nullable=False),
+        sa.Column('bitrate', sa.BigInteger(), nullable=True),
+        sa.Column('mimetype', sa.Text(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('s3_key', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    )
+    op.create_index('ix_audio_renditions_media_id', 'audio_renditions', ['media_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audio_renditions_media_id', table_name='audio_renditions')
+    op.drop_table('audio_renditions')
@@ -0,0 +1,34 @@
+"""add perceptual hash to image_metadata
+
+Revision ID: i8j9k0l1m2n
+Revises: h7i8j9k0l1m
+Create Date: 2026-02-23 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'i8j9k0l1m2n'
+down_revision = 'h7i8j9k0l1m'
+branch_labels = None
+depends_on = None
+
+BANDS = ('phash_b0', 'phash_b1', 'phash_b2', 'phash_b3')
+
+
+def upgrade() -> None:
+    # Perceptual hash plus its 16-bit bands for multi-index Hamming search
+    op.add_column('image_metadata', sa.Column('phash', sa.BigInteger(), nullable=True))
+    for band in BANDS:
+        op.add_column('image_metadata', sa.Column(band, sa.Integer(), nullable=True))
+    with op.get_context().autocommit_block():
+        for band in BANDS:
+            op.create_index(f'ix_image_metadata_{band}', 'image_metadata', [band], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    for band in BANDS:
+        op.drop_index(f'ix_image_metadata_{band}', table_name='image_metadata')
+        op.drop_column('image_metadata', band)
+    op.drop_column('image_metadata', 'phash')
@@ -0,0 +1,32 @@
+"""add audio_fingerprints
+
+Revision ID: j9k0l1m2n3o
+Revises: i8j9k0l1m2n
+Create Date: 2026-03-02 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'j9k0l1m2n3o'
+down_revision = 'i8j9k0l1m2n'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Inverted index of acoustic fingerprint hashes (peak-pair landmarks)
+    op.create_table(
+        'audio_fingerprints',
+        sa.Column('hash', sa.Integer(), nullable=False),
+        sa.Column('media_id', sa.Integer(), sa.ForeignKey('media.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('offset', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('hash', 'media_id', 'offset'),
+    )
+    op.create_index('ix_audio_fingerprints_media_id', 'audio_fingerprints', ['media_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audio_fingerprints_media_id', table_name='audio_fingerprints')
+    op.drop_table('audio_fingerprints')
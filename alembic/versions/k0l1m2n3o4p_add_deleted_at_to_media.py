@@ -0,0 +1,24 @@
+"""add deleted_at to media
+
+Revision ID: k0l1m2n3o4p
+Revises: j9k0l1m2n3o
+Create Date: 2026-03-09 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'k0l1m2n3o4p'
+down_revision = 'j9k0l1m2n3o'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Soft delete: rows wait here until their S3 objects are purged
+    op.add_column('media', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('media', 'deleted_at')
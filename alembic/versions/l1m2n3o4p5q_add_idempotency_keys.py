@@ -0,0 +1,34 @@
+"""add idempotency_keys
+
+Revision ID: l1m2n3o4p5q
+Revises: k0l1m2n3o4p
+Create Date: 2026-03-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'l1m2n3o4p5q'
+down_revision = 'k0l1m2n3o4p'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Idempotency-Key of uploads: in-flight lease, then the replayed response
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('response', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'key'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('idempotency_keys')
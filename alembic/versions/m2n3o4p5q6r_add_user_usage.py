@@ -0,0 +1,54 @@
+"""add user_usage, media.derived_size and users.storage_quota_bytes
+
+Revision ID: m2n3o4p5q6r
+Revises: l1m2n3o4p5q
+Create Date: 2026-03-23 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'm2n3o4p5q6r'
+down_revision = 'l1m2n3o4p5q'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('storage_quota_bytes', sa.BigInteger(), nullable=True))
+    op.add_column('media', sa.Column('derived_size', sa.BigInteger(), nullable=False, server_default='0'))
+    # Storage counters per user and media type (see app/usage.py)
+    op.create_table(
+        'user_usage',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('media_type', sa.String(length=16), nullable=False),
+        sa.Column('bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id', 'media_type'),
+    )
+    # Derived sizes of existing media: only thumbnails and audio renditions
+    # recorded theirs (video renditions, storyboards and waveforms did not)
+    op.execute("""
+        UPDATE media SET derived_size = d.bytes
+        FROM (
+            SELECT media_id, SUM(COALESCE(size, 0)) AS bytes
+            FROM (SELECT media_id, size FROM thumbnails UNION ALL SELECT media_id, size FROM audio_renditions) AS derived
+            GROUP BY media_id
+        ) AS d
+        WHERE d.media_id = media.id
+    """)
+    op.execute("""
+        INSERT INTO user_usage (user_id, media_type, bytes, count, updated_at)
+        SELECT owner_id, CAST(media_type AS VARCHAR), SUM(COALESCE(size, 0) + derived_size), COUNT(*), CURRENT_TIMESTAMP
+        FROM media
+        WHERE owner_id IS NOT NULL AND deleted_at IS NULL
+        GROUP BY owner_id, media_type
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_usage')
+    op.drop_column('media', 'derived_size')
+    op.drop_column('users', 'storage_quota_bytes')
@@ -0,0 +1,41 @@
+"""scope perceptual hash indexes by owner
+
+Revision ID: n3o4p5q6r7s
+Revises: m2n3o4p5q6r
+Create Date: 2026-03-30 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'n3o4p5q6r7s'
+down_revision = 'm2n3o4p5q6r'
+branch_labels = None
+depends_on = None
+
+BANDS = ('phash_b0', 'phash_b1', 'phash_b2', 'phash_b3')
+
+
+def upgrade() -> None:
+    # Copy of media.owner_id so similarity probes stay within one user's images
+    op.add_column('image_metadata', sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='SET NULL'), nullable=True))
+    op.execute("""
+        UPDATE image_metadata SET owner_id = media.owner_id
+        FROM media
+        WHERE media.id = image_metadata.media_id
+    """)
+    with op.get_context().autocommit_block():
+        for band in BANDS:
+            op.create_index(f'ix_image_metadata_owner_id_{band}', 'image_metadata', ['owner_id', band], postgresql_concurrently=True)
+        for band in BANDS:
+            op.drop_index(f'ix_image_metadata_{band}', table_name='image_metadata', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for band in BANDS:
+            op.create_index(f'ix_image_metadata_{band}', 'image_metadata', [band], postgresql_concurrently=True)
+        for band in BANDS:
+            op.drop_index(f'ix_image_metadata_owner_id_{band}', table_name='image_metadata', postgresql_concurrently=True)
+    op.drop_column('image_metadata', 'owner_id')
@@ -0,0 +1,38 @@
+"""lead audio_fingerprints primary key with the owner
+
+Revision ID: o4p5q6r7s8t
+Revises: n3o4p5q6r7s
+Create Date: 2026-03-30 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'o4p5q6r7s8t'
+down_revision = 'n3o4p5q6r7s'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Copy of media.owner_id leading the key, so lookups stay within one user's landmarks
+    op.add_column('audio_fingerprints', sa.Column('owner_id', sa.Integer(), nullable=True))
+    op.execute("""
+        UPDATE audio_fingerprints SET owner_id = media.owner_id
+        FROM media
+        WHERE media.id = audio_fingerprints.media_id
+    """)
+    # landmarks of media without an owner can never match a search
+    op.execute("DELETE FROM audio_fingerprints WHERE owner_id IS NULL")
+    op.alter_column('audio_fingerprints', 'owner_id', nullable=False)
+    op.create_foreign_key('audio_fingerprints_owner_id_fkey', 'audio_fingerprints', 'users', ['owner_id'], ['id'], ondelete='CASCADE')
+    op.drop_constraint('audio_fingerprints_pkey', 'audio_fingerprints', type_='primary')
+    op.create_primary_key('audio_fingerprints_pkey', 'audio_fingerprints', ['owner_id', 'hash', 'media_id', 'offset'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('audio_fingerprints_pkey', 'audio_fingerprints', type_='primary')
+    op.create_primary_key('audio_fingerprints_pkey', 'audio_fingerprints', ['hash', 'media_id', 'offset'])
+    op.drop_constraint('audio_fingerprints_owner_id_fkey', 'audio_fingerprints', type_='foreignkey')
+    op.drop_column('audio_fingerprints', 'owner_id')
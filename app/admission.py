@@ -0,0 +1,223 @@
+"""Admission control for the upload endpoints.
+
+Uploads are the only requests that run ffmpeg and hold a threadpool thread
+for seconds or minutes. This ASGI middleware admits them before the body is
+read, per media type:
+
+- Content-Length above UPLOAD_MAX_BYTES: 413 before the body is read; a
+  chunked body (no Content-Length) is admitted and cut off with 413 as soon as
+  it streams past the limit;
+- no valid bearer token: 401;
+- Content-Length beyond the user's remaining storage quota (see `usage`): 507,
+  except for a retry whose Idempotency-Key already has a stored response,
+  which must be replayed (the upload was counted the first time);
+- more than UPLOAD_USER_CONCURRENCY uploads of the user running or waiting: 429;
+- UPLOAD_CONCURRENCY uploads already running in this worker: wait in a queue
+  of at most UPLOAD_QUEUE_SIZE; 503 when it is full or the wait exceeds
+  UPLOAD_QUEUE_TIMEOUT_SECONDS.
+
+429 and 503 carry Retry-After. A waiting upload has not had its body read, so
+the client is held back by TCP flow control instead of filling memory or a
+temp file. Every other endpoint passes straight through; with the running
+totals below THREADPOOL_SIZE they always find a free thread.
+"""
+import asyncio
+import re
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from . import auth, crud_async, metrics
+from .config import (
+    UPLOAD_CONCURRENCY,
+    UPLOAD_QUEUE_SIZE,
+    UPLOAD_USER_CONCURRENCY,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_QUEUE_TIMEOUT_SECONDS,
+    UPLOAD_RETRY_AFTER,
+)
+from .database import AsyncSessionLocal
+
+# matched at the end of the path, whatever prefix a proxy or root_path adds
+_UPLOAD_PATH = re.compile(r"/media/upload/(image|video|audio)/?$")
+
+upload_admissions = metrics.Counter(
+    "upload_admissions_total",
+    "Upload admission decisions by media type and outcome (admitted, too_large, invalid_length, unauthenticated, quota, user_limit, queue_full, timeout).",
+    ["kind", "outcome"],
+)
+uploads_active = metrics.Gauge("uploads_active", "Uploads running in this worker, by media type.", ["kind"])
+uploads_waiting = metrics.Gauge("uploads_waiting", "Uploads queued for a slot in this worker, by media type.", ["kind"])
+
+
+class _Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, outcome: str, retry_after: Optional[int] = None):
+        self.status_code = status_code
+        self.detail = detail
+        self.outcome = outcome
+        self.retry_after = retry_after
+
+
+class Gate:
+    """Semaphore with a bounded number of waiters (event loop only, no locking)."""
+
+    def __init__(self, kind: str, limit: int, max_waiting: int):
+        self.kind = kind
+        self._semaphore = asyncio.Semaphore(max(1, limit))
+        self.max_waiting = max_waiting
+        self.waiting = 0
+
+    async def acquire(self, timeout: float) -> None:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                raise _Rejected(503, "Server busy with uploads, try again later", "queue_full", UPLOAD_RETRY_AFTER)
+            self.waiting += 1
+            uploads_waiting.inc(kind=self.kind)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise _Rejected(503, "Server busy with uploads, try again later", "timeout", UPLOAD_RETRY_AFTER)
+            finally:
+                self.waiting -= 1
+                uploads_waiting.dec(kind=self.kind)
+        else:
+            await self._semaphore.acquire()
+        uploads_active.inc(kind=self.kind)
+
+    def release(self) -> None:
+        uploads_active.dec(kind=self.kind)
+        self._semaphore.release()
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _user_key(scope):
+    # the token is only decoded here; the handler still authenticates against the database
+    authorization = _header(scope, b"authorization") or ""
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _Rejected(401, "Not authenticated", "unauthenticated")
+    try:
+        token_data = auth.decode_access_token(token.strip())
+    except HTTPException:
+        raise _Rejected(401, "Could not validate credentials", "unauthenticated")
+    return token_data.user_id if token_data.user_id is not None else token_data.email
+
+
+async def _check_quota(user, length: int, idempotency_key: Optional[str]) -> None:
+    # Content-Length slightly overstates the file (multipart framing); the
+    # handler checks again with the real size
+    if not isinstance(user, int):
+        return
+    async with AsyncSessionLocal() as db:
+        if idempotency_key and await crud_async.has_stored_response(db, user, idempotency_key):
+            return
+        used, quota = await crud_async.get_storage_quota(db, user)
+    if quota is not None and used + length > quota:
+        raise _Rejected(507, "Storage quota exceeded", "quota")
+
+
+def _limit_body(receive, kind: str, limit: int):
+    received = 0
+
+    async def limited():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                # raised while FastAPI reads the form, before any response,
+                # and rendered by its exception handler
+                upload_admissions.inc(kind=kind, outcome="too_large")
+                raise HTTPException(status_code=413, detail=f"Upload larger than {limit} bytes")
+        return message
+
+    return limited
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.gates = {
+            kind: Gate(kind, limit, UPLOAD_QUEUE_SIZE.get(kind, 0))
+            for kind, limit in UPLOAD_CONCURRENCY.items()
+        }
+        # uploads running or waiting per (kind, user)
+        self.per_user: Dict[tuple, int] = {}
+
+    async def __call__(self, scope, receive, send):
+        match = _UPLOAD_PATH.search(scope.get("path", "")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if match is None:
+            await self.app(scope, receive, send)
+            return
+        kind = match.group(1)
+        user_slot = None
+        gate = None
+        try:
+            length = self._check_length(scope, kind)
+            user = _user_key(scope)
+            if length is not None:
+                await _check_quota(user, length, _header(scope, b"idempotency-key"))
+            key = (kind, user)
+            user_limit = UPLOAD_USER_CONCURRENCY.get(kind)
+            if user_limit is not None and self.per_user.get(key, 0) >= user_limit:
+                raise _Rejected(429, f"Too many {kind} uploads in progress", "user_limit", UPLOAD_RETRY_AFTER)
+            self.per_user[key] = self.per_user.get(key, 0) + 1
+            user_slot = key
+            gate = self.gates.get(kind)
+            if gate is not None:
+                await gate.acquire(UPLOAD_QUEUE_TIMEOUT_SECONDS)
+        except _Rejected as rejected:
+            self._leave(user_slot)
+            upload_admissions.inc(kind=kind, outcome=rejected.outcome)
+            headers = {}
+            if rejected.retry_after:
+                headers["Retry-After"] = str(rejected.retry_after)
+            if rejected.status_code == 401:
+                headers["WWW-Authenticate"] = "Bearer"
+            response = JSONResponse({"detail": rejected.detail}, status_code=rejected.status_code, headers=headers)
+            await response(scope, receive, send)
+            return
+        except BaseException:
+            # cancelled while queued
+            self._leave(user_slot)
+            raise
+
+        upload_admissions.inc(kind=kind, outcome="admitted")
+        limit = UPLOAD_MAX_BYTES.get(kind)
+        if length is None and limit is not None:
+            receive = _limit_body(receive, kind, limit)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if gate is not None:
+                gate.release()
+            self._leave(user_slot)
+
+    @staticmethod
+    def _check_length(scope, kind: str) -> Optional[int]:
+        """Declared body size, or None for a chunked body (limited while it streams)."""
+        length = _header(scope, b"content-length")
+        if length is None:
+            return None
+        if not length.isdigit():
+            raise _Rejected(400, "Invalid Content-Length", "invalid_length")
+        limit = UPLOAD_MAX_BYTES.get(kind)
+        if limit is not None and int(length) > limit:
+            raise _Rejected(413, f"Upload larger than {limit} bytes", "too_large")
+        return int(length)
+
+    def _leave(self, user_slot) -> None:
+        if user_slot is None:
+            return
+        remaining = self.per_user.get(user_slot, 0) - 1
+        if remaining > 0:
+            self.per_user[user_slot] = remaining
+        else:
+            self.per_user.pop(user_slot, None)
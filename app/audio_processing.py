@@ -1,9 +1,23 @@
+import base64
 import ffmpeg
 import io
+import math
 import tempfile
 import os
-from typing import Dict, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
 import soundfile as sf
+from . import metrics
+from .config import WAVEFORM_MAX_PEAKS, WAVEFORM_LEVELS, AUDIO_RENDITIONS, AUDIO_LOUDNESS_TARGET, FINGERPRINT_SECONDS
+
+# Codec da escada de renditions -> (encoder do ffmpeg, extensão, mimetype, opções extras)
+_AUDIO_CODECS = {
+    'opus': ('libopus', 'webm', 'audio/webm', {}),
+    'aac': ('aac', 'm4a', 'audio/mp4', {'movflags': 'faststart'}),
+}
+
+# Amostras decodificadas por bloco ao calcular a forma de onda
+_BLOCK_FRAMES = 65536
 
 
 def extract_audio_metadata(audio_bytes: bytes) -> Dict:
@@ -32,7 +46,8 @@ def extract_audio_metadata(audio_bytes: bytes) -> Dict:
         try:
             # Tentar usar soundfile primeiro (excelente para WAV/FLAC)
             try:
-                info = sf.info(tmp_path)
+                with metrics.stage('audio_probe', nbytes=len(audio_bytes)):
+                    info = sf.info(tmp_path)
                 metadata['duration_seconds'] = float(info.duration)
                 metadata['sample_rate'] = int(info.samplerate)
                 metadata['channels'] = int(info.channels)
@@ -45,7 +60,8 @@ def extract_audio_metadata(audio_bytes: bytes) -> Dict:
             except Exception as sf_error:
                 # Fallback para ffmpeg se soundfile falhar (ex: alguns MP3s)
                 print(f"Soundfile falhou, usando ffmpeg como fallback: {sf_error}")
-                probe = ffmpeg.probe(tmp_path)
+                with metrics.stage('audio_probe_ffmpeg', nbytes=len(audio_bytes), ffmpeg=True):
+                    probe = ffmpeg.probe(tmp_path)
                 format_info = probe.get('format', {})
                 streams = probe.get('streams', [])
                 
@@ -86,3 +102,378 @@ def extract_audio_metadata(audio_bytes: bytes) -> Dict:
     
     return metadata
 
+
+
+def _ffmpeg_blocks(path: str, sample_rate: int) -> Iterator[np.ndarray]:
+    """Decodifica com ffmpeg para float32 mono via pipe, em blocos de `_BLOCK_FRAMES`."""
+    process = (
+        ffmpeg
+        .input(path)
+        .output('pipe:', format='f32le', ac=1, ar=sample_rate, loglevel='error')
+        .run_async(pipe_stdout=True)
+    )
+    try:
+        while True:
+            chunk = process.stdout.read(_BLOCK_FRAMES * 4)
+            if not chunk:
+                break
+            # pipes podem entregar um número de bytes que não é múltiplo de 4
+            while len(chunk) % 4:
+                more = process.stdout.read(4 - len(chunk) % 4)
+                if not more:
+                    chunk = chunk[:len(chunk) - len(chunk) % 4]
+                    break
+                chunk += more
+            yield np.frombuffer(chunk, dtype=np.float32)[:, None]
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def compute_waveform_peaks(
+    audio_bytes: bytes,
+    duration_seconds: Optional[float] = None,
+    sample_rate: Optional[int] = None,
+    max_peaks: int = WAVEFORM_MAX_PEAKS,
+    levels: int = WAVEFORM_LEVELS,
+) -> Optional[Dict]:
+    """Calcula os picos (mín/máx) da forma de onda em alguns níveis de zoom.
+
+    Decodifica o áudio em blocos (soundfile para WAV/FLAC/OGG, ffmpeg para os
+    demais formatos) e acumula mín/máx por intervalo, então a memória usada não
+    depende da duração do arquivo. O nível mais detalhado tem até `max_peaks`
+    pares; cada nível seguinte é 4x mais grosseiro.
+
+    Returns:
+        Dict serializável em JSON com as chaves:
+        - sample_rate: int
+        - duration_seconds: float
+        - bits: 8 (picos quantizados em int8, -128..127)
+        - levels: lista de {samples_per_peak, length, data}, do mais
+          detalhado ao mais grosseiro; `data` é base64 dos pares mín/máx
+          intercalados
+        ou None em caso de erro
+    """
+    tmp_path = None
+    try:
+        with metrics.stage('audio_waveform', nbytes=len(audio_bytes)):
+            try:
+                info = sf.info(io.BytesIO(audio_bytes))
+                sample_rate = int(info.samplerate)
+                total_frames = int(info.frames)
+                blocks = sf.blocks(io.BytesIO(audio_bytes), blocksize=_BLOCK_FRAMES, dtype='float32', always_2d=True)
+            except Exception:
+                # formatos que o libsndfile não lê (ex: MP3, AAC)
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as tmp_file:
+                    tmp_file.write(audio_bytes)
+                    tmp_path = tmp_file.name
+                if not duration_seconds or not sample_rate:
+                    probe = ffmpeg.probe(tmp_path)
+                    stream = next(s for s in probe['streams'] if s.get('codec_type') == 'audio')
+                    sample_rate = int(stream['sample_rate'])
+                    duration_seconds = float(probe['format']['duration'])
+                sample_rate = int(sample_rate)
+                total_frames = int(float(duration_seconds) * sample_rate)
+                blocks = _ffmpeg_blocks(tmp_path, sample_rate)
+
+            if total_frames <= 0:
+                return None
+            samples_per_peak = max(1, math.ceil(total_frames / max_peaks))
+            n = math.ceil(total_frames / samples_per_peak)
+            mins = np.full(n, np.inf, dtype=np.float32)
+            maxs = np.full(n, -np.inf, dtype=np.float32)
+
+            offset = 0
+            for block in blocks:
+                if not len(block):
+                    continue
+                lo = block.min(axis=1)
+                hi = block.max(axis=1)
+                # intervalo de cada amostra; a estimativa de total_frames do
+                # ffmpeg pode ficar curta, então o excedente vai para o último
+                idx = np.minimum((offset + np.arange(len(block))) // samples_per_peak, n - 1)
+                starts = np.flatnonzero(np.diff(idx, prepend=-1))
+                buckets = idx[starts]
+                mins[buckets] = np.minimum(mins[buckets], np.minimum.reduceat(lo, starts))
+                maxs[buckets] = np.maximum(maxs[buckets], np.maximum.reduceat(hi, starts))
+                offset += len(block)
+
+        filled = int(np.count_nonzero(np.isfinite(mins)))
+        if filled == 0:
+            return None
+        mins, maxs = mins[:filled], maxs[:filled]
+
+        out_levels = []
+        for level in range(max(levels, 1)):
+            if level:
+                # cada nível reduz o anterior por 4
+                pad = (-len(mins)) % 4
+                mins = np.pad(mins, (0, pad), constant_values=np.inf).reshape(-1, 4).min(axis=1)
+                maxs = np.pad(maxs, (0, pad), constant_values=-np.inf).reshape(-1, 4).max(axis=1)
+                samples_per_peak *= 4
+            pairs = np.empty(len(mins) * 2, dtype=np.int8)
+            pairs[0::2] = np.clip(np.round(mins * 127), -128, 127)
+            pairs[1::2] = np.clip(np.round(maxs * 127), -128, 127)
+            out_levels.append({
+                'samples_per_peak': samples_per_peak,
+                'length': len(mins),
+                'data': base64.b64encode(pairs.tobytes()).decode('ascii'),
+            })
+            if len(mins) == 1:
+                break
+
+        return {
+            'sample_rate': sample_rate,
+            'duration_seconds': offset / sample_rate,
+            'bits': 8,
+            'levels': out_levels,
+        }
+
+    except Exception as e:
+        print(f"Erro ao calcular forma de onda do áudio: {e}")
+        return None
+
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _parse_bitrate(value: str) -> int:
+    value = value.strip().lower()
+    return int(float(value[:-1]) * 1000) if value.endswith('k') else int(value)
+
+
+def generate_audio_renditions(
+    audio_bytes: bytes,
+    source_bitrate: Optional[int] = None,
+    ladder: str = AUDIO_RENDITIONS,
+    loudness: float = AUDIO_LOUDNESS_TARGET,
+) -> List[Dict]:
+    """Gera a escada de renditions de áudio numa única passada do ffmpeg.
+
+    O áudio é decodificado uma vez, normalizado para `loudness` LUFS
+    (EBU R128, filtro loudnorm), reamostrado para 48 kHz e dividido (asplit)
+    entre os encoders de cada degrau. Degraus com bitrate igual ou maior que o
+    do original (`source_bitrate`) são pulados: não reduziriam o tráfego.
+
+    Args:
+        audio_bytes: Bytes do áudio original
+        source_bitrate: Bitrate do original em bps, se conhecido
+        ladder: Degraus no formato "codec:bitrate", separados por vírgula
+            (ex: "opus:64k,opus:128k,aac:128k")
+        loudness: Loudness integrado alvo em LUFS
+
+    Returns:
+        Lista de dicts com as chaves codec, bitrate (bps), mimetype,
+        extension e data (BytesIO); lista vazia em caso de erro
+    """
+    rungs = []
+    for item in ladder.split(','):
+        if not item.strip():
+            continue
+        try:
+            codec, bitrate = item.strip().split(':')
+            bps = _parse_bitrate(bitrate)
+            if bps <= 0:
+                raise ValueError(bitrate)
+        except ValueError:
+            print(f"Degrau inválido na escada de renditions de áudio (esperado codec:bitrate): {item.strip()}")
+            continue
+        if codec not in _AUDIO_CODECS:
+            print(f"Codec de áudio desconhecido na escada de renditions: {codec}")
+            continue
+        if source_bitrate and bps >= source_bitrate:
+            continue
+        rungs.append((codec, bps))
+    if not rungs:
+        return []
+
+    tmp_dir = tempfile.mkdtemp(prefix='audio_renditions_')
+    tmp_input_path = os.path.join(tmp_dir, 'input')
+    try:
+        with open(tmp_input_path, 'wb') as f:
+            f.write(audio_bytes)
+
+        normalized = (
+            ffmpeg
+            .input(tmp_input_path)
+            .audio
+            .filter('loudnorm', I=loudness, TP=-1.5, LRA=11)
+            # loudnorm trabalha a 192 kHz; Opus só aceita até 48 kHz
+            .filter('aresample', 48000)
+        )
+        branches = normalized.filter_multi_output('asplit', len(rungs)) if len(rungs) > 1 else None
+
+        outputs = []
+        paths = []
+        for i, (codec, bps) in enumerate(rungs):
+            encoder, extension, _mimetype, extra = _AUDIO_CODECS[codec]
+            path = os.path.join(tmp_dir, f'{codec}_{bps}.{extension}')
+            paths.append(path)
+            stream = branches[i] if branches is not None else normalized
+            outputs.append(ffmpeg.output(stream, path, acodec=encoder, vn=None, **{'b:a': bps}, **extra))
+
+        with metrics.stage('audio_renditions', nbytes=len(audio_bytes), ffmpeg=True):
+            (
+                ffmpeg
+                .merge_outputs(*outputs)
+                .global_args('-loglevel', 'error')
+                .overwrite_output()
+                .run(capture_stdout=True, capture_stderr=True)
+            )
+
+        renditions = []
+        for (codec, bps), path in zip(rungs, paths):
+            _encoder, extension, mimetype, _extra = _AUDIO_CODECS[codec]
+            with open(path, 'rb') as f:
+                data = io.BytesIO(f.read())
+            renditions.append({
+                'codec': codec,
+                'bitrate': bps,
+                'mimetype': mimetype,
+                'extension': extension,
+                'data': data,
+            })
+        return renditions
+
+    except Exception as e:
+        print(f"Erro ao gerar renditions de áudio: {e}")
+        return []
+
+    finally:
+        # Remover arquivos temporários
+        for path in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, path))
+        os.rmdir(tmp_dir)
+
+
+# Impressão digital acústica: mono a 11025 Hz, STFT de 1024 pontos com salto
+# de 512 (~46 ms por quadro)
+_FP_RATE = 11025
+_FP_FFT = 1024
+_FP_HOP = 512
+# vizinhança (bins de frequência, quadros) em que um pico precisa ser o máximo
+_FP_PEAK_FREQ = 31
+_FP_PEAK_TIME = 21
+# pares formados por cada pico âncora e distância máxima entre eles (quadros)
+_FP_FAN_OUT = 5
+_FP_MAX_DT = 63
+
+
+def _fingerprint_samples(audio_bytes: bytes, seconds: float) -> np.ndarray:
+    """Decodifica até `seconds` segundos do áudio em mono float32 a `_FP_RATE` Hz."""
+    max_frames = int(seconds * _FP_RATE)
+    try:
+        info = sf.info(io.BytesIO(audio_bytes))
+        rate = int(info.samplerate)
+        data, _ = sf.read(io.BytesIO(audio_bytes), frames=int(seconds * rate), dtype='float32', always_2d=True)
+        mono = data.mean(axis=1)
+        if rate != _FP_RATE:
+            # passa-baixa simples (média móvel) antes de reamostrar por interpolação
+            width = max(1, int(round(rate / _FP_RATE)))
+            if width > 1:
+                mono = np.convolve(mono, np.full(width, 1.0 / width, dtype=np.float32), mode='same')
+            n = int(len(mono) * _FP_RATE / rate)
+            mono = np.interp(np.arange(n) * (rate / _FP_RATE), np.arange(len(mono)), mono).astype(np.float32)
+        return mono[:max_frames]
+    except Exception:
+        # formatos que o libsndfile não lê: ffmpeg já entrega mono a 11025 Hz
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as tmp_file:
+            tmp_file.write(audio_bytes)
+            tmp_path = tmp_file.name
+        try:
+            blocks = []
+            total = 0
+            for block in _ffmpeg_blocks(tmp_path, _FP_RATE):
+                blocks.append(block[:, 0])
+                total += len(block)
+                if total >= max_frames:
+                    break
+            return np.concatenate(blocks)[:max_frames] if blocks else np.zeros(0, dtype=np.float32)
+        finally:
+            os.unlink(tmp_path)
+
+
+def _max_filter(values: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """Máximo móvel centrado de largura `size` ao longo de `axis`."""
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size // 2, size // 2)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, size, axis=axis).max(axis=-1)
+
+
+def compute_fingerprint(audio_bytes: bytes, seconds: float = FINGERPRINT_SECONDS) -> Optional[List[Tuple[int, int]]]:
+    """Calcula a impressão digital acústica (landmarks de pares de picos).
+
+    Decodifica até `seconds` segundos em mono a 11025 Hz, calcula o
+    espectrograma (STFT vetorizada), encontra picos locais de energia e forma
+    pares entre cada pico e os seguintes. Cada par vira um hash de 25 bits
+    (frequência do pico, frequência do par, distância em quadros), que não
+    depende do codec, do bitrate nem do volume.
+
+    Returns:
+        Lista de (hash, quadro do pico âncora) sem repetições, ou None em caso
+        de erro ou áudio curto demais
+    """
+    try:
+        with metrics.stage('audio_fingerprint', nbytes=len(audio_bytes)):
+            samples = _fingerprint_samples(audio_bytes, seconds)
+            if len(samples) < _FP_FFT * 4:
+                return None
+
+            frames = np.lib.stride_tricks.sliding_window_view(samples, _FP_FFT)[::_FP_HOP]
+            spectrum = np.abs(np.fft.rfft(frames * np.hanning(_FP_FFT).astype(np.float32), axis=1))
+            # 512 bins (descarta Nyquist); log para comprimir a faixa dinâmica
+            spec = np.log(spectrum[:, :512] + 1e-6)
+
+            local_max = _max_filter(_max_filter(spec, _FP_PEAK_FREQ, axis=1), _FP_PEAK_TIME, axis=0)
+            # picos: máximos locais bem acima do nível típico do trecho
+            peaks = (spec == local_max) & (spec > np.median(spec) + 2.0)
+            times, freqs = np.nonzero(peaks)
+            if len(times) < 2:
+                return None
+
+            # np.nonzero já ordena por quadro; pares com os próximos picos no tempo
+            pairs = []
+            for k in range(1, _FP_FAN_OUT + 1):
+                t1, f1, t2, f2 = times[:-k], freqs[:-k], times[k:], freqs[k:]
+                dt = t2 - t1
+                ok = (dt > 0) & (dt <= _FP_MAX_DT)
+                hashes = (f1[ok].astype(np.int64) << 16) | (f2[ok].astype(np.int64) << 6) | dt[ok]
+                pairs.append(np.stack([hashes, t1[ok]], axis=1))
+            landmarks = np.unique(np.concatenate(pairs), axis=0)
+            return [(int(h), int(t)) for h, t in landmarks]
+
+    except Exception as e:
+        print(f"Erro ao calcular impressão digital do áudio: {e}")
+        return None
+
+
+def match_fingerprint(query: List[Tuple[int, int]], candidates: List[Tuple[int, int, int]]) -> Dict[int, int]:
+    """Pontua cada mídia candidata pelo maior número de hashes alinhados no tempo.
+
+    Args:
+        query: (hash, quadro) da impressão digital consultada
+        candidates: (media_id, hash, quadro) vindos do índice invertido
+
+    Returns:
+        {media_id: pontuação}; a pontuação é a contagem do deslocamento
+        (quadro no candidato - quadro na consulta) mais frequente, somada à do
+        vizinho
+    """
+    if not query or not candidates:
+        return {}
+    by_hash: Dict[int, List[int]] = {}
+    for h, t in query:
+        by_hash.setdefault(h, []).append(t)
+    offsets: Dict[int, List[int]] = {}
+    for media_id, h, t in candidates:
+        for qt in by_hash.get(h, ()):
+            offsets.setdefault(media_id, []).append(t - qt)
+    scores = {}
+    for media_id, deltas in offsets.items():
+        counts = np.bincount(np.asarray(deltas) - min(deltas))
+        # cortes que não caem num múltiplo do salto dividem o alinhamento entre
+        # dois deslocamentos vizinhos
+        scores[media_id] = int((counts[:-1] + counts[1:]).max() if len(counts) > 1 else counts[0])
+    return scores
@@ -1,11 +1,15 @@
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
 import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import crud, schemas
+from typing import Optional
+from . import crud, crud_async, schemas, models, passwords
+from .cache import user_cache
 from .config import JWT_SECRET, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from .database import get_db
+from .database import get_db, get_async_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
@@ -16,20 +20,81 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.UserOut:
-    credentials_exception = HTTPException(
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
+    """Check credentials, verifying the hash on the password pool.
+
+    Legacy or outdated-cost hashes are transparently upgraded on success.
+    """
+    user = await run_in_threadpool(crud.get_user_by_email, db, email)
+    if not user:
+        return None
+    matches, needs_rehash = await passwords.verify_password(password, user.hashed_password)
+    if not matches:
+        return None
+    if needs_rehash:
+        new_hash = await passwords.hash_password(password)
+        user = await run_in_threadpool(crud.rehash_user_password, db, user, new_hash)
+    return user
+
+def create_user_token(user: models.User) -> str:
+    """Issue an access token carrying the immutable user id and token version."""
+    return create_access_token({"sub": str(user.id), "email": user.email, "tv": user.token_version or 0})
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_access_token(token: str) -> schemas.TokenData:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except jwt.PyJWTError:
-        raise credentials_exception
-    user = crud.get_user_by_email(db, email=email)
-    if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    sub = payload.get("sub")
+    if sub is None:
+        raise _credentials_exception()
+    # Legacy tokens (issued before ids were embedded) carry the email as subject
+    if isinstance(sub, str) and sub.isdigit():
+        return schemas.TokenData(user_id=int(sub), email=payload.get("email"), token_version=payload.get("tv", 0))
+    return schemas.TokenData(email=sub, token_version=payload.get("tv", 0))
+
+def _load_user(db: Session, token_data: schemas.TokenData) -> models.User:
+    if token_data.user_id is not None:
+        user = crud.get_user(db, token_data.user_id)
+    else:
+        user = crud.get_user_by_email(db, email=token_data.email)
+    if user is None or (user.token_version or 0) != token_data.token_version:
+        raise _credentials_exception()
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+    """Return the token owner attached to the request session (for write endpoints)."""
+    token_data = decode_access_token(token)
+    user = _load_user(db, token_data)
+    user_cache.set(user.id, schemas.AuthenticatedUser.model_validate(user))
     return user
+
+async def get_current_user_cached(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.AuthenticatedUser:
+    """Return a cached snapshot of the token owner (for read-only endpoints).
+
+    On a cache hit no database query is issued; misses are served through the
+    async session. Snapshots are dropped on profile or password changes; other
+    workers pick up changes after the cache TTL.
+    """
+    token_data = decode_access_token(token)
+    if token_data.user_id is not None:
+        cached = user_cache.get(token_data.user_id)
+        # A version mismatch may just mean a stale snapshot; let the DB decide
+        if cached is not None and cached.token_version == token_data.token_version:
+            return cached
+    if token_data.user_id is not None:
+        user = await crud_async.get_user(db, token_data.user_id)
+    else:
+        user = await crud_async.get_user_by_email(db, token_data.email)
+    if user is None or (user.token_version or 0) != token_data.token_version:
+        raise _credentials_exception()
+    snapshot = schemas.AuthenticatedUser.model_validate(user)
+    user_cache.set(user.id, snapshot)
+    return snapshot
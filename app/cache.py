@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from .config import USER_CACHE_TTL_SECONDS, USER_CACHE_MAXSIZE
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small thread-safe in-process cache with per-entry TTL and LRU eviction.
+
+    Entries expire `ttl` seconds after being set. When `maxsize` entries (or,
+    with `sizeof`, `maxbytes` total) are exceeded the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024, maxbytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value, size = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.nbytes -= size
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        size = self._sizeof(value) if self._sizeof else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._data[key] = (expires_at, value, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes and self._data):
+                _key, (_exp, _value, evicted_size) = self._data.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+# Authenticated user snapshots keyed by user id (see auth.get_current_user_cached)
+user_cache = TTLCache(ttl=USER_CACHE_TTL_SECONDS, maxsize=USER_CACHE_MAXSIZE)
@@ -0,0 +1,206 @@
+"""Byte-range streaming of S3 objects through the API.
+
+For deployments whose clients cannot reach S3 (private buckets, on-prem
+firewalls). The API signs a GET URL itself and relays the object with ranged
+requests on a shared asyncio HTTP client, so a stream holds a socket and a
+small buffer, never a thread.
+
+Media keys are unique per upload and objects are never rewritten, so the key
+alone is a strong validator: ETag and If-Range are answered without asking S3.
+Each upstream request covers at most CONTENT_PROXY_CHUNK_BYTES; a client that
+goes away stops the transfer after that chunk at worst.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from . import etags, metrics, s3_utils
+from .config import CONTENT_PROXY_CHUNK_BYTES, CONTENT_PROXY_MAX_CONNECTIONS
+
+# Relay granularity inside one upstream chunk
+_READ_SIZE = 64 * 1024
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=CONTENT_PROXY_MAX_CONNECTIONS,
+                                max_keepalive_connections=CONTENT_PROXY_MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def content_etag(s3_key: str) -> str:
+    return '"' + hashlib.blake2b(s3_key.encode(), digest_size=16).hexdigest() + '"'
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(first, last) byte positions of a single-range ``Range`` header, or None to send everything.
+
+    Multiple ranges are answered with the whole body (RFC 9110 allows ignoring
+    Range). Raises 416 when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    try:
+        if not sep:
+            return None
+        if first == '':
+            # suffix range: the last N bytes
+            length = int(last)
+            if length < 0:
+                raise ValueError
+            if length == 0:
+                raise HTTPException(status_code=416, detail='Range not satisfiable', headers={'Content-Range': f'bytes */{size}'})
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, detail='Range not satisfiable', headers={'Content-Range': f'bytes */{size}'})
+    return start, min(end, size - 1)
+
+
+def _http_date(value: datetime) -> datetime:
+    # stored timestamps are naive UTC; HTTP dates have whole seconds
+    return value.replace(microsecond=0, tzinfo=value.tzinfo or timezone.utc).astimezone(timezone.utc)
+
+
+def _if_range_matches(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    value = request.headers.get('if-range')
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith('"') or value.startswith('W/'):
+        # weak tags never match If-Range
+        return value == etag
+    try:
+        return last_modified is not None and parsedate_to_datetime(value) == _http_date(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+async def _open(url: str, start: int, end: int) -> httpx.Response:
+    client = get_client()
+    try:
+        upstream = await client.send(client.build_request('GET', url, headers={'Range': f'bytes={start}-{end}'}), stream=True)
+    except httpx.HTTPError:
+        # connection refused, timeouts, broken responses
+        raise HTTPException(status_code=502, detail='Media content unavailable')
+    # every upstream request is ranged; a 200 would mean the range was ignored
+    if upstream.status_code != 206:
+        await upstream.aclose()
+        raise HTTPException(status_code=404 if upstream.status_code in (403, 404) else 502, detail='Media content unavailable')
+    return upstream
+
+
+async def _relay(url: str, first: httpx.Response, start: int, end: int) -> AsyncIterator[bytes]:
+    metrics.content_streams_active.inc()
+    upstream = first
+    position = start
+    try:
+        while True:
+            async for data in upstream.aiter_bytes(_READ_SIZE):
+                position += len(data)
+                metrics.content_bytes_sent.inc(len(data))
+                yield data
+            await upstream.aclose()
+            if position > end:
+                break
+            upstream = await _open(url, position, min(position + CONTENT_PROXY_CHUNK_BYTES, end + 1) - 1)
+    finally:
+        await upstream.aclose()
+        metrics.content_streams_active.dec()
+
+
+async def open_object(s3_key: str, size: int) -> AsyncIterator[bytes]:
+    """Chunks of the whole object, for callers that assemble their own response.
+
+    The first upstream request is made here, so a missing object raises
+    (HTTPException) before anything has been sent.
+    """
+    if size <= 0:
+        return _empty()
+    url = s3_utils.generate_presigned_url(s3_key)
+    if not url:
+        raise HTTPException(status_code=500, detail='Could not sign content URL')
+    first = await _open(url, 0, min(CONTENT_PROXY_CHUNK_BYTES, size) - 1)
+    return _relay(url, first, 0, size - 1)
+
+
+async def _empty() -> AsyncIterator[bytes]:
+    return
+    yield
+
+
+class _RelayResponse(StreamingResponse):
+    """StreamingResponse that releases the upstream connection however it ends.
+
+    `_relay` closes its responses itself once it runs; this covers a client
+    that goes away before the body starts, when the generator never runs.
+    """
+
+    def __init__(self, first: httpx.Response, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._first = first
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            await self._first.aclose()
+
+
+async def stream_object(request: Request, s3_key: str, size: int, content_type: Optional[str],
+                        last_modified: Optional[datetime] = None) -> Response:
+    """Response for GET of `s3_key` honoring Range, If-Range and If-None-Match."""
+    etag = content_etag(s3_key)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Cache-Control': etags.CACHE_CONTROL,
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(_http_date(last_modified), usegmt=True)
+    if etags.matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if size == 0:
+        return Response(content=b'', media_type=content_type, headers=headers)
+    byte_range = parse_range(request.headers.get('range'), size) if _if_range_matches(request, etag, last_modified) else None
+    start, end = byte_range if byte_range else (0, size - 1)
+
+    url = s3_utils.generate_presigned_url(s3_key)
+    if not url:
+        raise HTTPException(status_code=500, detail='Could not sign content URL')
+    # the first chunk is opened here so S3 errors still become a proper status
+    first = await _open(url, start, min(start + CONTENT_PROXY_CHUNK_BYTES, end + 1) - 1)
+
+    headers['Content-Length'] = str(end - start + 1)
+    status = 200
+    if byte_range:
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return _RelayResponse(first, _relay(url, first, start, end), status_code=status, media_type=content_type, headers=headers)
@@ -1,51 +1,34 @@
 from sqlalchemy.orm import Session
-from . import models, schemas
-from passlib.context import CryptContext
-from typing import Optional, List
-import hashlib
-import bcrypt
-from sqlalchemy import or_
-
-pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+from . import models, schemas, similarity, usage
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple
+from sqlalchemy import delete, func, insert, or_, select, true, union_all, update
+from datetime import datetime
+from .cache import user_cache
 
 # Users
 
+def get_user(db: Session, user_id: int) -> Optional[models.User]:
+    return db.get(models.User, user_id)
+
 def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
-    pw_bytes = user.password.encode("utf-8")
-    sha = hashlib.sha256(pw_bytes).digest()
-    hashed = bcrypt.hashpw(sha, bcrypt.gensalt()).decode("utf-8")
-    db_user = models.User(email=user.email, hashed_password=hashed, full_name=user.full_name)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str) -> models.User:
+    """Create a user; the password must already be hashed (see passwords.hash_password)."""
+    db_user = models.User(email=user.email, hashed_password=hashed_password, full_name=user.full_name)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
-    user = get_user_by_email(db, email)
-    if not user:
-        return None
-    pw_bytes = password.encode("utf-8")
-    sha = hashlib.sha256(pw_bytes).digest()
-    try:
-        if bcrypt.checkpw(sha, user.hashed_password.encode("utf-8")):
-            return user
-    except Exception:
-        # fallback to passlib verification for legacy hashes
-        try:
-            if pwd_context.verify(password, user.hashed_password):
-                # re-hash under the new scheme and store
-                new_hash = bcrypt.hashpw(sha, bcrypt.gensalt()).decode("utf-8")
-                user.hashed_password = new_hash
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-                return user
-        except Exception:
-            return None
-    return None
+def rehash_user_password(db: Session, db_user: models.User, hashed_password: str) -> models.User:
+    """Store an upgraded hash of the same password (issued tokens stay valid)."""
+    db_user.hashed_password = hashed_password
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
 
 def update_user(db: Session, db_user: models.User, updates: schemas.UserUpdate) -> models.User:
     if updates.full_name is not None:
@@ -60,25 +43,46 @@ def update_user(db: Session, db_user: models.User, updates: schemas.UserUpdate)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(db_user.id)
     return db_user
 
 
-def change_user_password(db: Session, db_user: models.User, new_password: str) -> models.User:
-    """Change the user's password (hashes with the same scheme as create_user)."""
-    if not new_password:
-        raise ValueError("new_password must not be empty")
-    pw_bytes = new_password.encode("utf-8")
-    sha = hashlib.sha256(pw_bytes).digest()
-    hashed = bcrypt.hashpw(sha, bcrypt.gensalt()).decode("utf-8")
-    db_user.hashed_password = hashed
+def change_user_password(db: Session, db_user: models.User, hashed_password: str) -> models.User:
+    """Change the user's password; `hashed_password` comes from passwords.hash_password.
+
+    Also bumps `token_version`, which invalidates previously issued tokens.
+    """
+    db_user.hashed_password = hashed_password
+    # Revoke every token issued before the password change
+    db_user.token_version = (db_user.token_version or 0) + 1
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(db_user.id)
+    return db_user
+
+
+def set_user_avatar(db: Session, db_user: models.User, avatar_s3_key: Optional[str]) -> models.User:
+    """Set the S3 key of the user's avatar."""
+    db_user.avatar_s3_key = avatar_s3_key
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    user_cache.invalidate(db_user.id)
     return db_user
 
 # Media
 
 def create_media(db: Session, owner: models.User, filename: str, s3_key: str, mimetype: str, size: int, meta: schemas.MediaCreate, media_type: str = 'other') -> models.Media:
+    """Insert a media row; raises usage.QuotaExceeded when `size` does not fit in the owner's quota.
+
+    The check and the insert (which counts the bytes, see `usage`) commit
+    together under a lock on the owner's row.
+    """
+    used, quota = get_storage_quota(db, owner.id, lock=True)
+    if quota is not None and used + (size or 0) > quota:
+        db.rollback()
+        raise usage.QuotaExceeded(used, quota)
     db_media = models.Media(
         description=meta.description,
         filename=filename,
@@ -110,23 +114,42 @@ def create_thumbnail(db: Session, media: models.Media, s3_key: str, width: int |
     return thumb
 
 
-def create_image_metadata(db: Session, media: models.Media, width: int | None, height: int | None, color_depth: int | None, dpi_x: int | None, dpi_y: int | None, exif: dict | None, main_thumbnail_id: int | None = None) -> models.ImageMetadata:
+def create_image_metadata(db: Session, media: models.Media, width: int | None, height: int | None, color_depth: int | None, dpi_x: int | None, dpi_y: int | None, exif: dict | None, main_thumbnail_id: int | None = None, phash: int | None = None) -> models.ImageMetadata:
     img_md = models.ImageMetadata(
         media_id=media.id,
+        owner_id=media.owner_id,
         width=width,
         height=height,
         color_depth=color_depth,
         dpi_x=dpi_x,
         dpi_y=dpi_y,
         exif=exif,
-        main_thumbnail_id=main_thumbnail_id
+        main_thumbnail_id=main_thumbnail_id,
+        **(similarity.hash_columns(phash) if phash is not None else {})
     )
     db.add(img_md)
     db.commit()
     db.refresh(img_md)
     return img_md
 
-def create_video_metadata(db: Session, media: models.Media, duration_seconds: float | None = None, width: int | None = None, height: int | None = None, frame_rate: float | None = None, video_codec: str | None = None, audio_codec: str | None = None, bitrate: int | None = None, genero: str | None = None, main_thumbnail_id: int | None = None, url_1080: str | None = None, url_720: str | None = None, url_480: str | None = None) -> models.VideoMetadata:
+def list_images_without_phash(db: Session, after_id: int, limit: int) -> List[Tuple[int, str, Optional[str]]]:
+    """(media_id, original key, listing thumbnail key) of live images with no pHash yet, by id after `after_id`."""
+    md = models.ImageMetadata
+    rows = db.execute(
+        select(models.Media.id, models.Media.s3_key, models.Thumbnail.s3_key)
+        .join(md, md.media_id == models.Media.id)
+        .outerjoin(models.Thumbnail, models.Thumbnail.id == md.main_thumbnail_id)
+        .where(md.phash.is_(None), models.Media.deleted_at.is_(None), models.Media.id > after_id)
+        .order_by(models.Media.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in rows]
+
+def set_image_phash(db: Session, media_id: int, phash: int) -> None:
+    table = models.ImageMetadata.__table__
+    db.execute(update(table).where(table.c.media_id == media_id).values(**similarity.hash_columns(phash)))
+
+def create_video_metadata(db: Session, media: models.Media, duration_seconds: float | None = None, width: int | None = None, height: int | None = None, frame_rate: float | None = None, video_codec: str | None = None, audio_codec: str | None = None, bitrate: int | None = None, genero: str | None = None, main_thumbnail_id: int | None = None, url_1080: str | None = None, url_720: str | None = None, url_480: str | None = None, storyboard: dict | None = None) -> models.VideoMetadata:
     vid_md = models.VideoMetadata(
         media_id=media.id,
         duration_seconds=duration_seconds,
@@ -140,29 +163,71 @@ def create_video_metadata(db: Session, media: models.Media, duration_seconds: fl
         main_thumbnail_id=main_thumbnail_id,
         url_1080=url_1080,
         url_720=url_720,
-        url_480=url_480
+        url_480=url_480,
+        storyboard=storyboard
     )
     db.add(vid_md)
     db.commit()
     db.refresh(vid_md)
     return vid_md
 
-def create_audio_metadata(db: Session, media: models.Media, duration_seconds: float | None = None, bitrate: int | None = None, sample_rate: int | None = None, channels: int | None = None, genero: str | None = None) -> models.AudioMetadata:
+def create_audio_metadata(db: Session, media: models.Media, duration_seconds: float | None = None, bitrate: int | None = None, sample_rate: int | None = None, channels: int | None = None, genero: str | None = None, waveform_key: str | None = None) -> models.AudioMetadata:
     aud_md = models.AudioMetadata(
         media_id=media.id,
         duration_seconds=duration_seconds,
         bitrate=bitrate,
         sample_rate=sample_rate,
         channels=channels,
-        genero=genero
+        genero=genero,
+        waveform_key=waveform_key
     )
     db.add(aud_md)
     db.commit()
     db.refresh(aud_md)
     return aud_md
 
+def create_audio_rendition(db: Session, media: models.Media, codec: str, bitrate: int | None, mimetype: str | None, size: int | None, s3_key: str) -> models.AudioRendition:
+    rendition = models.AudioRendition(
+        media_id=media.id,
+        codec=codec,
+        bitrate=bitrate,
+        mimetype=mimetype,
+        size=size,
+        s3_key=s3_key
+    )
+    db.add(rendition)
+    db.commit()
+    db.refresh(rendition)
+    return rendition
+
+def create_audio_fingerprints(db: Session, media: models.Media, landmarks: List[Tuple[int, int]]) -> None:
+    """Store (hash, offset) landmarks of `media` in the fingerprint index."""
+    if landmarks:
+        db.execute(insert(models.AudioFingerprint), [{'owner_id': media.owner_id, 'hash': h, 'media_id': media.id, 'offset': t} for h, t in landmarks])
+    db.commit()
+
+def get_fingerprint_candidates(db: Session, owner_id: int, hashes: Iterable[int], exclude_media_id: Optional[int] = None, chunk_size: int = 1000) -> List[Tuple[int, int, int]]:
+    """(media_id, hash, offset) index rows of the owner's audio sharing any of `hashes`.
+
+    Hashes are probed on the (owner_id, hash) primary key, in chunks to keep
+    each IN (...) list bounded.
+    """
+    fp = models.AudioFingerprint
+    hashes = sorted(set(hashes))
+    rows = []
+    for i in range(0, len(hashes), chunk_size):
+        query = (
+            db.query(fp.media_id, fp.hash, fp.offset)
+            .join(models.Media, models.Media.id == fp.media_id)
+            .filter(fp.owner_id == owner_id, fp.hash.in_(hashes[i:i + chunk_size]), models.Media.deleted_at.is_(None))
+        )
+        if exclude_media_id is not None:
+            query = query.filter(fp.media_id != exclude_media_id)
+        rows.extend(tuple(row) for row in query.all())
+    return rows
+
 def get_media(db: Session, media_id: int) -> Optional[models.Media]:
-    return db.query(models.Media).filter(models.Media.id == media_id).first()
+    return db.query(models.Media).filter(models.Media.id == media_id, models.Media.deleted_at.is_(None)).first()
 
 
 def get_listing_thumbnail_key(db: Session, media_id: int) -> Optional[str]:
@@ -184,16 +249,135 @@ def get_listing_thumbnail_key(db: Session, media_id: int) -> Optional[str]:
         )
     return thumb.s3_key if thumb else None
 
-def delete_media(db: Session, media: models.Media):
-    db.delete(media)
+def add_derived_size(db: Session, media: models.Media, nbytes: int) -> None:
+    """Count `nbytes` of derived files (thumbnails, renditions, ...) toward the media and its owner's usage."""
+    if not nbytes:
+        return
+    table = models.Media.__table__
+    db.execute(update(table).where(table.c.id == media.id).values(derived_size=table.c.derived_size + nbytes))
+    usage.apply(db.connection(), {(media.owner_id, media.media_type): [nbytes, 0]})
     db.commit()
 
+def get_storage_quota(db: Session, user_id: int, lock: bool = False) -> Tuple[int, Optional[int]]:
+    """(bytes used, quota or None when unlimited) of a user; reads one row per media type.
+
+    With `lock`, the user's row stays locked until the transaction ends.
+    """
+    if lock:
+        # its own statement, so that under READ COMMITTED the sum below is read
+        # after a concurrent upload holding the lock has committed
+        db.execute(select(models.User.id).where(models.User.id == user_id).with_for_update())
+    used = select(func.coalesce(func.sum(models.UserUsage.bytes), 0)).where(models.UserUsage.user_id == user_id).scalar_subquery()
+    row = db.execute(select(used, models.User.storage_quota_bytes).where(models.User.id == user_id)).first()
+    if row is None:
+        return 0, None
+    return int(row[0]), usage.effective_quota(row[1])
+
+def soft_delete_media(db: Session, owner_id: int, media_ids: List[int]) -> List[int]:
+    """Hide the owner's media in `media_ids` with a single UPDATE; returns the ids actually marked."""
+    if not media_ids:
+        return []
+    table = models.Media.__table__
+    result = db.execute(
+        update(table)
+        .where(table.c.id.in_(media_ids), table.c.owner_id == owner_id, table.c.deleted_at.is_(None))
+        .values(deleted_at=datetime.utcnow())
+        .returning(table.c.id, table.c.media_type, table.c.size, table.c.derived_size)
+    )
+    deleted = []
+    deltas = defaultdict(lambda: [0, 0])
+    for media_id, media_type, size, derived_size in result:
+        deleted.append(media_id)
+        deltas[(owner_id, media_type)][0] -= usage.footprint(size, derived_size)
+        deltas[(owner_id, media_type)][1] -= 1
+    if deleted:
+        # Core statements skip the flush hooks: free the quota and invalidate
+        # the owner's cached views here
+        usage.apply(db.connection(), deltas)
+        db.info.setdefault(models.CHANGED_OWNERS_KEY, set()).add(owner_id)
+    db.commit()
+    return sorted(deleted)
+
+def media_object_keys(db: Session, media_ids: List[int]) -> Dict[int, List[str]]:
+    """{media_id: S3 keys} of everything stored for the given media: original,
+    thumbnails, renditions, storyboard sheets and waveform."""
+    keys: Dict[int, List[str]] = {media_id: [] for media_id in media_ids}
+    if not media_ids:
+        return keys
+    rows = list(db.query(models.Media.id, models.Media.s3_key).filter(models.Media.id.in_(media_ids)))
+    for model in (models.Thumbnail, models.VideoRendition, models.AudioRendition):
+        rows.extend(db.query(model.media_id, model.s3_key).filter(model.media_id.in_(media_ids)))
+    vid = models.VideoMetadata
+    for media_id, url_480, url_720, url_1080, storyboard in db.query(vid.media_id, vid.url_480, vid.url_720, vid.url_1080, vid.storyboard).filter(vid.media_id.in_(media_ids)):
+        sheets = storyboard.get('sheets', []) if storyboard else []
+        rows.extend((media_id, key) for key in (url_480, url_720, url_1080, *sheets))
+    aud = models.AudioMetadata
+    rows.extend(db.query(aud.media_id, aud.waveform_key).filter(aud.media_id.in_(media_ids)))
+    for media_id, key in rows:
+        if key and key not in keys[media_id]:
+            keys[media_id].append(key)
+    return keys
+
+def clear_avatar_if_deleted(db: Session, db_user: models.User, deleted_keys: List[str]) -> None:
+    """Drop the user's avatar when it points at an object being deleted."""
+    if db_user.avatar_s3_key and db_user.avatar_s3_key in set(deleted_keys):
+        set_user_avatar(db, db_user, None)
+
+def hard_delete_media(db: Session, media_ids: List[int]) -> None:
+    """Remove the media rows and their children (children first, so this does not
+    rely on ON DELETE CASCADE being enforced)."""
+    if not media_ids:
+        return
+    for table in (models.ImageMetadata.__table__, models.VideoMetadata.__table__, models.AudioMetadata.__table__,
+                  models.Thumbnail.__table__, models.VideoRendition.__table__, models.AudioRendition.__table__,
+                  models.AudioFingerprint.__table__, models.media_tags):
+        db.execute(delete(table).where(table.c.media_id.in_(media_ids)))
+    db.execute(delete(models.Media.__table__).where(models.Media.__table__.c.id.in_(media_ids)))
+    db.commit()
+
+def list_deleted_media_ids(db: Session, deleted_before: datetime, limit: int = 1000) -> List[int]:
+    """Soft-deleted media still waiting for their purge, oldest first."""
+    return [media_id for (media_id,) in (
+        db.query(models.Media.id)
+        .filter(models.Media.deleted_at.isnot(None), models.Media.deleted_at < deleted_before)
+        .order_by(models.Media.deleted_at)
+        .limit(limit)
+    )]
+
+def iter_referenced_keys(db: Session, prefix: Optional[str] = None, batch_size: int = 10000) -> Iterator[str]:
+    """Stream every S3 key the database points at, in binary (S3 listing) order.
+
+    One UNION ALL over all key columns, sorted by the database and read through
+    a server-side cursor, so memory stays flat whatever the table sizes. Keys
+    referenced more than once are repeated.
+    """
+    vid = models.VideoMetadata
+    columns = [
+        models.Media.s3_key, models.Thumbnail.s3_key, models.VideoRendition.s3_key, models.AudioRendition.s3_key,
+        vid.url_480, vid.url_720, vid.url_1080, models.AudioMetadata.waveform_key, models.User.avatar_s3_key,
+    ]
+    selects = [select(column.label('key')) for column in columns]
+    if db.get_bind().dialect.name == 'postgresql':
+        sheets = func.json_array_elements_text(vid.storyboard['sheets']).table_valued('value').lateral()
+    else:
+        sheets = func.json_each(vid.storyboard, '$.sheets').table_valued('value')
+    selects.append(select(sheets.c.value.label('key')).select_from(vid).join(sheets, true()).where(vid.storyboard.isnot(None)))
+    keys = union_all(*selects).subquery()
+    stmt = select(keys.c.key).where(keys.c.key.isnot(None))
+    if prefix:
+        stmt = stmt.where(keys.c.key.startswith(prefix, autoescape=True))
+    # S3 lists keys by UTF-8 bytes; "C" collation sorts Postgres text the same way
+    order = keys.c.key.collate('C') if db.get_bind().dialect.name == 'postgresql' else keys.c.key
+    result = db.execute(stmt.order_by(order).execution_options(stream_results=True, yield_per=batch_size))
+    for (key,) in result:
+        yield key
+
 def list_media(db: Session, owner_id: int, q: Optional[str]=None, limit: int=50, offset: int=0) -> List[models.Media]:
     """List media belonging to a specific owner. Only returns items owned by `owner_id`.
 
     This enforces per-user visibility at the DB level.
     """
-    query = db.query(models.Media).filter(models.Media.owner_id == owner_id)
+    query = db.query(models.Media).filter(models.Media.owner_id == owner_id, models.Media.deleted_at.is_(None))
     if q:
         term = f"%{q}%"
         query = query.filter(or_(models.Media.filename.ilike(term), models.Media.description.ilike(term)))
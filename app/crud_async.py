@@ -0,0 +1,180 @@
+"""Read-only queries for the async (asyncpg) request path.
+
+Mirrors the read helpers in `crud` for use with an `AsyncSession`. Lazy loading
+is not available under asyncio, so every relationship a handler needs is
+eager-loaded here.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import models, similarity, usage
+
+# Users
+
+async def get_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def get_storage_quota(db: AsyncSession, user_id: int) -> Tuple[int, Optional[int]]:
+    """(bytes used, quota or None when unlimited); see crud.get_storage_quota."""
+    used = select(func.coalesce(func.sum(models.UserUsage.bytes), 0)).where(models.UserUsage.user_id == user_id).scalar_subquery()
+    row = (await db.execute(select(used, models.User.storage_quota_bytes).where(models.User.id == user_id))).first()
+    if row is None:
+        return 0, None
+    return int(row[0]), usage.effective_quota(row[1])
+
+async def has_stored_response(db: AsyncSession, user_id: int, key: str) -> bool:
+    """Whether a completed upload with this Idempotency-Key would be replayed (see idempotency)."""
+    ik = models.IdempotencyKey
+    result = await db.execute(
+        select(ik.key).where(ik.user_id == user_id, ik.key == key, ik.response.isnot(None), ik.expires_at > datetime.utcnow())
+    )
+    return result.first() is not None
+
+async def get_storage_usage(db: AsyncSession, user_id: int) -> List[models.UserUsage]:
+    result = await db.execute(select(models.UserUsage).where(models.UserUsage.user_id == user_id).order_by(models.UserUsage.media_type))
+    return list(result.scalars().all())
+
+# Media
+
+async def get_media(db: AsyncSession, media_id: int, with_details: bool = False) -> Optional[models.Media]:
+    """Return a media row; `with_details` also loads tags and type-specific metadata."""
+    stmt = select(models.Media).where(models.Media.id == media_id, models.Media.deleted_at.is_(None))
+    if with_details:
+        stmt = stmt.options(
+            selectinload(models.Media.tags),
+            selectinload(models.Media.image_metadata),
+            selectinload(models.Media.video_metadata),
+            selectinload(models.Media.audio_metadata),
+        )
+    result = await db.execute(stmt)
+    return result.scalars().first()
+
+async def load_media_details(db: AsyncSession, media: models.Media, *relationships: str) -> None:
+    """Load tags and the given relationships ('image_metadata', ...) onto an already loaded media.
+
+    Lets handlers check ETags against the bare row before paying for relationships.
+    """
+    await db.refresh(media, attribute_names=['tags', *relationships])
+
+async def list_media(db: AsyncSession, owner_id: int, q: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[models.Media]:
+    """List media belonging to a specific owner (see crud.list_media)."""
+    stmt = select(models.Media).where(models.Media.owner_id == owner_id, models.Media.deleted_at.is_(None))
+    if q:
+        term = f"%{q}%"
+        stmt = stmt.where(or_(models.Media.filename.ilike(term), models.Media.description.ilike(term)))
+    stmt = stmt.order_by(models.Media.created_at.desc()).limit(limit).offset(offset)
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+async def list_media_for_export(db: AsyncSession, owner_id: int, after: Optional[Tuple[datetime, int]] = None, limit: int = 500,
+                                q: Optional[str] = None, media_type: Optional[str] = None, tag: Optional[str] = None,
+                                created_after: Optional[datetime] = None, created_before: Optional[datetime] = None) -> List[models.Media]:
+    """One page of the owner's media, oldest first; pass the last row's (created_at, id) as `after` for the next."""
+    m = models.Media
+    stmt = select(m).where(m.owner_id == owner_id, m.deleted_at.is_(None))
+    if q:
+        term = f"%{q}%"
+        stmt = stmt.where(or_(m.filename.ilike(term), m.description.ilike(term)))
+    if media_type:
+        stmt = stmt.where(m.media_type == media_type)
+    if tag:
+        stmt = stmt.where(m.tags.any(models.Tag.name == tag))
+    if created_after:
+        stmt = stmt.where(m.created_at >= created_after)
+    if created_before:
+        stmt = stmt.where(m.created_at < created_before)
+    if after is not None:
+        stmt = stmt.where(tuple_(m.created_at, m.id) > after)
+    result = await db.execute(stmt.order_by(m.created_at, m.id).limit(limit))
+    return list(result.scalars().all())
+
+async def get_image_phash(db: AsyncSession, media_id: int) -> Optional[int]:
+    result = await db.execute(select(models.ImageMetadata.phash).where(models.ImageMetadata.media_id == media_id))
+    return result.scalar_one_or_none()
+
+async def find_similar_images(db: AsyncSession, owner_id: int, phash: int, max_distance: int, exclude_media_id: Optional[int] = None, limit: int = 20) -> List[Tuple[models.Media, int]]:
+    """Owner's images within `max_distance` bits of `phash`, closest first, as (media, distance).
+
+    Candidates come from the (owner_id, band) indexes (see `similarity`), so
+    only the owner's images are probed; exact distances are checked here.
+    """
+    md = models.ImageMetadata
+    radius = max_distance // similarity.BANDS
+    probes = [
+        and_(md.owner_id == owner_id, getattr(md, f'phash_b{i}').in_(similarity.band_variants(band, radius)))
+        for i, band in enumerate(similarity.bands(similarity.to_unsigned(phash)))
+    ]
+    stmt = (
+        select(models.Media, md.phash)
+        .join(md, md.media_id == models.Media.id)
+        .where(or_(*probes), models.Media.owner_id == owner_id, models.Media.deleted_at.is_(None))
+    )
+    if exclude_media_id is not None:
+        stmt = stmt.where(models.Media.id != exclude_media_id)
+    result = await db.execute(stmt)
+    matches = []
+    for media, candidate in result.all():
+        distance = similarity.hamming(phash, candidate)
+        if distance <= max_distance:
+            matches.append((media, distance))
+    matches.sort(key=lambda m: (m[1], -m[0].id))
+    return matches[:limit]
+
+async def get_audio_fingerprint(db: AsyncSession, media_id: int) -> List[Tuple[int, int]]:
+    fp = models.AudioFingerprint
+    result = await db.execute(select(fp.hash, fp.offset).where(fp.media_id == media_id))
+    return [tuple(row) for row in result.all()]
+
+async def get_fingerprint_candidates(db: AsyncSession, owner_id: int, hashes: Iterable[int], exclude_media_id: Optional[int] = None, chunk_size: int = 1000) -> List[Tuple[int, int, int]]:
+    """(media_id, hash, offset) index rows of the owner's audio sharing any of `hashes` (see crud.get_fingerprint_candidates)."""
+    fp = models.AudioFingerprint
+    hashes = sorted(set(hashes))
+    rows = []
+    for i in range(0, len(hashes), chunk_size):
+        stmt = (
+            select(fp.media_id, fp.hash, fp.offset)
+            .join(models.Media, models.Media.id == fp.media_id)
+            .where(fp.owner_id == owner_id, fp.hash.in_(hashes[i:i + chunk_size]), models.Media.deleted_at.is_(None))
+        )
+        if exclude_media_id is not None:
+            stmt = stmt.where(fp.media_id != exclude_media_id)
+        result = await db.execute(stmt)
+        rows.extend(tuple(row) for row in result.all())
+    return rows
+
+async def get_media_by_ids(db: AsyncSession, media_ids: Sequence[int]) -> Dict[int, models.Media]:
+    if not media_ids:
+        return {}
+    result = await db.execute(select(models.Media).where(models.Media.id.in_(media_ids), models.Media.deleted_at.is_(None)))
+    return {m.id: m for m in result.scalars().all()}
+
+async def get_listing_thumbnail_keys(db: AsyncSession, media_ids: Sequence[int]) -> Dict[int, str]:
+    """Return {media_id: s3_key} of the listing thumbnail for each media, in one query.
+
+    Same preference as crud.get_listing_thumbnail_key: newest 'listing' thumbnail,
+    falling back to the newest thumbnail of any purpose.
+    """
+    if not media_ids:
+        return {}
+    stmt = (
+        select(models.Thumbnail.media_id, models.Thumbnail.s3_key)
+        .where(models.Thumbnail.media_id.in_(media_ids))
+        .order_by(
+            models.Thumbnail.media_id,
+            case((models.Thumbnail.purpose == 'listing', 0), else_=1),
+            models.Thumbnail.created_at.desc(),
+        )
+    )
+    result = await db.execute(stmt)
+    keys: Dict[int, str] = {}
+    for media_id, s3_key in result.all():
+        keys.setdefault(media_id, s3_key)
+    return keys
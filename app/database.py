@@ -1,11 +1,23 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from .config import DATABASE_URL
+from .config import DATABASE_URL, ASYNC_DATABASE_URL, ASYNC_DB_POOL_SIZE, ASYNC_DB_MAX_OVERFLOW
 
 engine = create_engine(DATABASE_URL, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
+# Async engine for the read path (asyncpg). Handlers using it never hold a
+# threadpool slot while waiting on Postgres.
+_async_pool_kwargs = {} if ASYNC_DATABASE_URL.startswith("sqlite") else {
+    "pool_size": ASYNC_DB_POOL_SIZE,
+    "max_overflow": ASYNC_DB_MAX_OVERFLOW,
+}
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_async_pool_kwargs)
+# expire_on_commit=False: responses are serialized after the session work is done,
+# and attribute refreshes cannot lazy-load under asyncio
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -13,3 +25,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
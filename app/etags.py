@@ -0,0 +1,64 @@
+"""Strong ETags and If-None-Match handling for the media read endpoints.
+
+Tags are computed from row versions (see `models.Media.version`), never from
+the serialized body, so a matching ``If-None-Match`` is answered with 304
+before relationships are loaded, URLs are signed or anything is serialized.
+
+Response bodies embed presigned URLs that expire, so the current
+ETAG_URL_WINDOW_SECONDS window is part of every tag: a client revalidating in a
+later window gets a full response with fresh URLs.
+"""
+import hashlib
+import time
+from typing import Iterable, Tuple
+
+from fastapi import Request, Response
+
+from .config import ETAG_URL_WINDOW_SECONDS
+
+# per-user content: shared caches must not store it, clients must revalidate
+CACHE_CONTROL = "private, no-cache"
+
+
+def _etag(*parts) -> str:
+    raw = ":".join(str(p) for p in parts + (int(time.time() // ETAG_URL_WINDOW_SECONDS),))
+    return '"' + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest() + '"'
+
+
+def media_etag(representation: str, media_id: int, version: int) -> str:
+    """ETag of one media rendered as `representation` ('summary', 'image', 'video', 'audio')."""
+    return _etag(representation, media_id, version)
+
+
+def listing_etag(owner_id: int, params: Tuple, rows: Iterable[Tuple[int, int]]) -> str:
+    """ETag of a listing page from its query parameters and (id, version) rows."""
+    digest = hashlib.blake2b(digest_size=16)
+    for media_id, version in rows:
+        digest.update(f"{media_id}.{version},".encode())
+    return _etag("list", owner_id, params, digest.hexdigest())
+
+
+def matches(request: Request, etag: str) -> bool:
+    """True when the request's If-None-Match covers `etag` (weak comparison, RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def tagged(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
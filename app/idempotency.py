@@ -0,0 +1,149 @@
+"""Idempotency-Key support for the upload endpoints.
+
+The first request with a given key (per user) inserts a pending row that
+holds the key for IDEMPOTENCY_LOCK_SECONDS, runs, and stores its response for
+IDEMPOTENCY_TTL_SECONDS. A retry with the same key then:
+
+- gets the stored response back (``Idempotent-Replayed: true``) without
+  uploading or transcoding anything again;
+- while the original is still running, gets 409 with Retry-After at once.
+  A duplicate neither waits for nor attaches to the original (waiting would
+  hold a threadpool thread, and a burst of retries could take them all); the
+  client retries after Retry-After and then gets the stored response;
+- gets 422 when the key was used for a different request: other form fields,
+  or a different file (its content is hashed, not just its name and size).
+
+Failed requests release their key so that a retry runs again. A pending row
+left behind by a crashed worker is taken over once its lease expires.
+Bookkeeping uses its own short sessions, independent of the handler's.
+"""
+import hashlib
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+# the class request parsing actually creates (fastapi.UploadFile subclasses it)
+from starlette.datastructures import UploadFile
+
+from . import metrics, models
+from .config import IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_RETRY_AFTER, IDEMPOTENCY_TTL_SECONDS
+from .database import SessionLocal
+
+MAX_KEY_LENGTH = 255
+_HASH_CHUNK_BYTES = 1024 * 1024
+# returned by _claim while another request holds the key
+_PENDING = object()
+
+idempotency_requests = metrics.Counter(
+    "idempotency_requests_total",
+    "Uploads carrying an Idempotency-Key by outcome (new, replayed, conflict, mismatch).",
+    ["outcome"],
+)
+
+
+def _file_digest(upload: UploadFile) -> str:
+    digest = hashlib.sha256()
+    upload.file.seek(0)
+    for chunk in iter(lambda: upload.file.read(_HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    upload.file.seek(0)
+    return digest.hexdigest()
+
+
+def fingerprint(*fields) -> str:
+    """Hash of the endpoint and request fields identifying one logical request.
+
+    Uploaded files count with their name, size and a hash of their content.
+    """
+    values = tuple((f.filename, f.size, _file_digest(f)) if isinstance(f, UploadFile) else f for f in fields)
+    return hashlib.sha256(repr(values).encode()).hexdigest()
+
+
+def _replay(row: models.IdempotencyKey) -> Response:
+    return Response(content=row.response, status_code=row.status_code, media_type="application/json",
+                    headers={"Idempotent-Replayed": "true"})
+
+
+def _claim(user_id: int, key: str, request_fingerprint: str):
+    """None once the key is ours, the stored response of a completed request, or _PENDING."""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        row = db.get(models.IdempotencyKey, (user_id, key))
+        if row is None:
+            # the user's expired keys go first; the primary key covers this delete
+            table = models.IdempotencyKey.__table__
+            db.execute(delete(table).where(table.c.user_id == user_id, table.c.expires_at < now))
+            db.add(models.IdempotencyKey(user_id=user_id, key=key, fingerprint=request_fingerprint, created_at=now, expires_at=lease))
+            try:
+                db.commit()
+            except IntegrityError:
+                # a concurrent request inserted it first
+                db.rollback()
+                return _PENDING
+            return None
+        if row.expires_at <= now:
+            # expired replay or a lease left by a crashed worker: take it over,
+            # unless another request did so since we read it
+            table = models.IdempotencyKey.__table__
+            taken = db.execute(
+                update(table)
+                .where(table.c.user_id == user_id, table.c.key == key, table.c.expires_at == row.expires_at)
+                .values(fingerprint=request_fingerprint, status_code=None, response=None, created_at=now, expires_at=lease)
+            ).rowcount
+            db.commit()
+            return None if taken else _PENDING
+        if row.fingerprint != request_fingerprint:
+            idempotency_requests.inc(outcome="mismatch")
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if row.response is not None:
+            return _replay(row)
+        return _PENDING
+    finally:
+        db.close()
+
+
+def _finish(user_id: int, key: str, response: Optional[Response]) -> None:
+    """Store the response for replay, or release the key when `response` is None."""
+    db = SessionLocal()
+    try:
+        table = models.IdempotencyKey.__table__
+        where = (table.c.user_id == user_id, table.c.key == key)
+        if response is None:
+            db.execute(delete(table).where(*where))
+        else:
+            expires = datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            db.execute(update(table).where(*where).values(status_code=response.status_code, response=bytes(response.body), expires_at=expires))
+        db.commit()
+    finally:
+        db.close()
+
+
+def run(user_id: int, key: Optional[str], request_fingerprint: Optional[str], handler: Callable[[], Response]) -> Response:
+    """Call `handler` once per (user, key); without a key it simply runs."""
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    outcome = _claim(user_id, key, request_fingerprint)
+    if outcome is _PENDING:
+        idempotency_requests.inc(outcome="conflict")
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed",
+                            headers={"Retry-After": str(IDEMPOTENCY_RETRY_AFTER)})
+    if outcome is not None:
+        idempotency_requests.inc(outcome="replayed")
+        return outcome
+
+    idempotency_requests.inc(outcome="new")
+    response = None
+    try:
+        response = handler()
+        return response
+    finally:
+        # only successful responses are replayed; anything else may be retried
+        ok = response is not None and 200 <= response.status_code < 300
+        _finish(user_id, key, response if ok else None)
@@ -0,0 +1,161 @@
+import io
+import math
+from typing import Dict, Optional, Tuple
+import numpy as np
+from PIL import Image, ExifTags
+from . import metrics
+
+# Estimativa de profundidade de cor a partir do modo do Pillow
+MODE_TO_DEPTH = {
+    '1': 1, 'L': 8, 'P': 8, 'RGB': 24, 'RGBA': 32, 'CMYK': 32, 'YCbCr': 24, 'I': 32, 'F': 32
+}
+
+
+def open_image(image_bytes: bytes) -> Image.Image:
+    """Abre a imagem com Pillow (a decodificação dos pixels é feita sob demanda)."""
+    with metrics.stage('image_decode', nbytes=len(image_bytes)):
+        return Image.open(io.BytesIO(image_bytes))
+
+
+def extract_image_metadata(img: Image.Image) -> Dict:
+    """Extrai metadados de uma imagem já aberta.
+
+    Returns:
+        Dict com as seguintes chaves:
+        - width: int
+        - height: int
+        - color_depth: int (bits por pixel, estimado pelo modo)
+        - dpi_x: int
+        - dpi_y: int
+        - exif: dict (ou None se o EXIF não puder ser lido)
+    """
+    try:
+        width, height = img.size
+    except Exception:
+        width = None
+        height = None
+
+    # DPI
+    dpi = img.info.get('dpi')
+    dpi_x = int(dpi[0]) if dpi and len(dpi) > 0 else None
+    dpi_y = int(dpi[1]) if dpi and len(dpi) > 1 else None
+
+    # EXIF
+    exif_data = {}
+    try:
+        raw_exif = img._getexif() or {}
+        if raw_exif:
+            for tag, value in raw_exif.items():
+                decoded = ExifTags.TAGS.get(tag, tag)
+                exif_data[str(decoded)] = str(value)
+    except Exception:
+        exif_data = None
+
+    return {
+        'width': width,
+        'height': height,
+        'color_depth': MODE_TO_DEPTH.get(img.mode),
+        'dpi_x': dpi_x,
+        'dpi_y': dpi_y,
+        'exif': exif_data,
+    }
+
+
+def generate_image_thumbnail(img: Image.Image, target_width: int = 320, nbytes: Optional[int] = None) -> Optional[Tuple[io.BytesIO, str, int, int]]:
+    """Gera a thumbnail de listagem de uma imagem.
+
+    Imagens com transparência ou paleta viram PNG (preservando alpha); as demais, JPEG.
+
+    Args:
+        img: Imagem aberta com Pillow
+        target_width: Largura máxima da thumbnail (padrão: 320)
+        nbytes: Tamanho do original, apenas para as métricas
+
+    Returns:
+        Tuple (BytesIO, content_type, width, height), ou None em caso de erro
+    """
+    try:
+        with metrics.stage('image_thumbnail', nbytes=nbytes):
+            width, height = img.size
+            thumb = img.copy()
+            if width and width > target_width:
+                # altura proporcional
+                ratio = target_width / float(width)
+                target_h = math.floor(height * ratio) if height else None
+                thumb.thumbnail((target_width, target_h or target_width))
+            else:
+                # mantém o tamanho original se for menor
+                thumb.thumbnail((target_width, target_width))
+
+            # Transparência ou paleta: PNG para preservar alpha
+            need_png = thumb.mode in ("RGBA", "LA") or thumb.mode == "P" or img.info.get('transparency') is not None
+
+            thumb_io = io.BytesIO()
+            if need_png:
+                if thumb.mode == 'P':
+                    try:
+                        thumb = thumb.convert('RGBA')
+                    except Exception:
+                        thumb = thumb.convert('RGB')
+                thumb.save(thumb_io, format='PNG', compress_level=6)
+                content_type = 'image/png'
+            else:
+                # JPEG gera thumbnails menores
+                if thumb.mode not in ('RGB',):
+                    thumb = thumb.convert('RGB')
+                thumb.save(thumb_io, format='JPEG', quality=85)
+                content_type = 'image/jpeg'
+
+            thumb_io.seek(0)
+            thumb_width, thumb_height = thumb.size
+            return thumb_io, content_type, thumb_width, thumb_height
+    except Exception as e:
+        print(f"Erro ao gerar thumbnail da imagem: {e}")
+        return None
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Matriz da DCT-II ortonormal n x n."""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def perceptual_hash(img: Image.Image) -> Optional[int]:
+    """pHash de 64 bits: robusto a redimensionamento, recompressão e pequenas edições.
+
+    Reduz a imagem para 32x32 em escala de cinza, aplica a DCT 2D e compara os
+    8x8 coeficientes de baixa frequência com a mediana deles.
+
+    Returns:
+        Hash como inteiro sem sinal de 64 bits, ou None em caso de erro
+    """
+    try:
+        with metrics.stage('image_phash'):
+            small = img.convert('L').resize((32, 32), Image.Resampling.LANCZOS)
+            pixels = np.asarray(small, dtype=np.float64)
+            low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8].ravel()
+            # o coeficiente DC (brilho médio) não entra na mediana
+            bits = low > np.median(low[1:])
+            return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    except Exception as e:
+        print(f"Erro ao calcular hash perceptual da imagem: {e}")
+        return None
+
+
+def thumbnail_hash(thumb_io: io.BytesIO) -> Optional[int]:
+    """pHash a partir da thumbnail já gerada (decodificar 320px é barato)."""
+    try:
+        thumb_io.seek(0)
+        with Image.open(thumb_io) as thumb:
+            return perceptual_hash(thumb)
+    except Exception as e:
+        print(f"Erro ao abrir thumbnail para o hash perceptual: {e}")
+        return None
+    finally:
+        thumb_io.seek(0)
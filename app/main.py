@@ -1,20 +1,28 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from .routes import router
-from .database import engine
-from . import models
+from .database import engine, async_engine
+from .config import THREADPOOL_SIZE
+from . import models, metrics, passwords, profiling, content_proxy, admission
+import anyio.to_thread
 import os
 
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Multimedia CRUD API",
-    root_path="/api"    
+    root_path="/api",
+    default_response_class=ORJSONResponse,
 )
 # Read allowed frontend origins from env var FRONTEND_ORIGINS (comma-separated).
 # When the client uses `fetch(..., { credentials: 'include' })`, the Access-Control-Allow-Origin
 # header must NOT be '*' — it must echo a specific origin. Default to localhost:3000 for dev.
 allowed_origins = [o.strip() for o in os.getenv("FRONTEND_ORIGINS", "http://localhost:3000").split(",") if o.strip()]
+metrics.instrument_sessions()
+# innermost: upload rejections still get CORS headers and request metrics
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -24,6 +32,44 @@ app.add_middleware(
 )
 
 app.include_router(router)
+# No-op unless PROFILING_TOKEN or PROFILE_SAMPLE_RATE is configured
+profiling.install(app)
+
+
+@app.exception_handler(passwords.PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: passwords.PasswordHasherBusy):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many authentication requests, try again later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    passwords.shutdown()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_engine.dispose()
+
+
+@app.on_event("shutdown")
+async def close_content_proxy():
+    await content_proxy.close_client()
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics_endpoint():
+    # async so the limiter is read on the event loop (and a full threadpool cannot hide it)
+    metrics.record_threadpool(anyio.to_thread.current_default_thread_limiter())
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get('/')
 def root():
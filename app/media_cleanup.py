@@ -0,0 +1,55 @@
+"""Background removal of deleted media.
+
+Deleting is two-phase. The request marks rows with `Media.deleted_at` in one
+UPDATE, so they vanish from every read path immediately, and schedules
+`purge_media`. The purge removes every S3 object of those media (original,
+thumbnails, renditions, storyboards, waveforms) with batched DeleteObjects
+calls, then deletes the rows. Media whose objects could not all be removed stay
+soft-deleted, so their keys are still known and a later purge can retry them.
+"""
+import logging
+from datetime import datetime
+from typing import List
+
+from . import crud, s3_utils
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def purge_media(media_ids: List[int]) -> List[int]:
+    """Delete the S3 objects and rows of soft-deleted `media_ids`; returns the ids fully purged."""
+    if not media_ids:
+        return []
+    db = SessionLocal()
+    try:
+        keys_by_media = crud.media_object_keys(db, media_ids)
+        failed = set(s3_utils.delete_objects(k for keys in keys_by_media.values() for k in keys))
+        purged = [media_id for media_id, keys in keys_by_media.items() if not failed.intersection(keys)]
+        crud.hard_delete_media(db, purged)
+        if failed:
+            logger.warning("media purge: %d S3 objects of %d media could not be deleted",
+                           len(failed), len(media_ids) - len(purged))
+        return purged
+    finally:
+        db.close()
+
+
+def purge_deleted(deleted_before: datetime, batch_size: int = 1000) -> int:
+    """Retry the purge of media soft-deleted before `deleted_before`; returns how many were purged.
+
+    Stops at the first batch where nothing could be purged (S3 still failing).
+    """
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            media_ids = crud.list_deleted_media_ids(db, deleted_before, limit=batch_size)
+        finally:
+            db.close()
+        if not media_ids:
+            return total
+        purged = purge_media(media_ids)
+        total += len(purged)
+        if not purged:
+            return total
@@ -0,0 +1,82 @@
+"""ZIP export of a user's library, built while it is sent.
+
+Media rows are read in keyset pages with a short-lived session per page and
+each object is pulled from S3 in ranged chunks (see `content_proxy`), so an
+export holds one chunk, one page of rows and the central directory entries,
+never the files themselves, and runs on the event loop without a thread.
+Already-compressed formats are stored as-is; only the few raw formats we
+accept (WAV, BMP, TIFF, text) are deflated.
+
+Objects that are missing from S3 or cannot be fetched (S3 errors, connection
+failures) are skipped and listed in MISSING.txt at the end of the archive. An
+S3 failure in the middle of an object aborts the response, since bytes
+already sent cannot be taken back.
+"""
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from fastapi import HTTPException
+
+from . import content_proxy, crud_async, models, zip_stream
+from .database import AsyncSessionLocal
+
+PAGE_SIZE = 500
+
+_COMPRESSIBLE = {'audio/wav', 'audio/x-wav', 'audio/wave', 'image/bmp', 'image/x-ms-bmp', 'image/tiff', 'application/json'}
+# keeps deflated entries far from the 4 GiB ZIP64 decision made before compressing
+_MAX_DEFLATE_SIZE = 1024 * 1024 * 1024
+
+
+def entry_name(media: models.Media) -> str:
+    """`<type>/<id>_<filename>`: the id keeps names unique, the folder groups by type."""
+    filename = (media.filename or 'file').replace('\\', '_').replace('/', '_').lstrip('.') or 'file'
+    return f"{media.media_type or 'other'}/{media.id}_{filename}"
+
+
+def _method(media: models.Media) -> int:
+    mimetype = (media.mimetype or '').lower()
+    compressible = mimetype in _COMPRESSIBLE or mimetype.startswith('text/')
+    return zip_stream.DEFLATED if compressible and (media.size or 0) < _MAX_DEFLATE_SIZE else zip_stream.STORED
+
+
+async def _iter_media(owner_id: int, **filters) -> AsyncIterator[models.Media]:
+    after = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            page = await crud_async.list_media_for_export(db, owner_id, after=after, limit=PAGE_SIZE, **filters)
+        for media in page:
+            yield media
+        if len(page) < PAGE_SIZE:
+            return
+        after = (page[-1].created_at, page[-1].id)
+
+
+async def export_archive(owner_id: int, q: Optional[str] = None, media_type: Optional[str] = None, tag: Optional[str] = None,
+                         created_after: Optional[datetime] = None, created_before: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    """Bytes of a ZIP with the owner's media matching the filters."""
+    zs = zip_stream.ZipStream()
+    missing: List[str] = []
+    async for media in _iter_media(owner_id, q=q, media_type=media_type, tag=tag,
+                                   created_after=created_after, created_before=created_before):
+        name = entry_name(media)
+        try:
+            chunks = await content_proxy.open_object(media.s3_key, media.size or 0)
+        except HTTPException:
+            missing.append(name)
+            continue
+        try:
+            yield zs.start_entry(name, media.size or 0, media.upload_at or media.created_at, _method(media))
+            async for chunk in chunks:
+                data = zs.write(chunk)
+                if data:
+                    yield data
+        finally:
+            # release the upstream connection at once if the client went away
+            await chunks.aclose()
+        yield zs.end_entry()
+    if missing:
+        listing = ("\n".join(missing) + "\n").encode()
+        yield zs.start_entry("MISSING.txt", len(listing), datetime.utcnow(), zip_stream.DEFLATED)
+        yield zs.write(listing)
+        yield zs.end_entry()
+    yield zs.finish()
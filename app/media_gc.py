@@ -0,0 +1,124 @@
+"""Find and delete S3 objects that no database row points at.
+
+Orphans come from uploads whose S3 writes succeeded before the database commit
+failed, and from deletes made before derived objects were purged with their
+media. Usage::
+
+    python -m app.media_gc                      # report orphans older than 24h
+    python -m app.media_gc --delete --list      # delete them, printing each key
+    python -m app.media_gc --prefix 42/ --purge-deleted
+
+The bucket listing (paginated ListObjectsV2) and the referenced keys (one
+sorted query over a server-side cursor, see `crud.iter_referenced_keys`) are
+both in binary key order and are joined with a sorted merge, so memory stays
+flat at tens of millions of objects. Objects younger than the grace period are
+never touched: they may belong to an upload that has not committed yet.
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from . import crud, media_cleanup, s3_utils
+from .database import SessionLocal
+
+
+def _ascending(keys: Iterable, what: str, key=lambda k: k) -> Iterator:
+    # A merge over out-of-order input would report live objects as orphans
+    previous = None
+    for item in keys:
+        current = key(item)
+        if previous is not None and current < previous:
+            raise RuntimeError(f"{what} is not sorted by key ({previous!r} before {current!r})")
+        previous = current
+        yield item
+
+
+def find_orphans(objects: Iterable[dict], referenced: Iterable[str], stats: Optional[Dict[str, int]] = None) -> Iterator[dict]:
+    """Objects (sorted listing entries) whose Key is not in `referenced` (sorted keys)."""
+    stats = stats if stats is not None else {}
+    stats.setdefault('objects', 0)
+    stats.setdefault('missing', 0)
+    refs = iter(_ascending(referenced, 'database key stream'))
+    ref = next(refs, None)
+    for obj in _ascending(objects, 'bucket listing', key=lambda o: o['Key']):
+        stats['objects'] += 1
+        while ref is not None and ref < obj['Key']:
+            # referenced by a row but absent from the bucket
+            stats['missing'] += 1
+            ref = _next_distinct(refs, ref)
+        if ref == obj['Key']:
+            ref = _next_distinct(refs, ref)
+            continue
+        yield obj
+    while ref is not None:
+        stats['missing'] += 1
+        ref = _next_distinct(refs, ref)
+
+
+def _next_distinct(refs: Iterator[str], current: str) -> Optional[str]:
+    for ref in refs:
+        if ref != current:
+            return ref
+    return None
+
+
+def collect_garbage(grace: timedelta, prefix: str = '', delete: bool = False, on_orphan=None) -> Dict[str, int]:
+    """Report (and with `delete`, remove) orphans older than `grace` under `prefix`."""
+    cutoff = datetime.now(timezone.utc) - grace
+    stats = {'objects': 0, 'missing': 0, 'orphans': 0, 'orphan_bytes': 0, 'recent': 0, 'deleted': 0, 'failed': 0}
+    batch: List[str] = []
+
+    def flush():
+        failed = s3_utils.delete_objects(batch)
+        stats['failed'] += len(failed)
+        stats['deleted'] += len(batch) - len(failed)
+        batch.clear()
+
+    db = SessionLocal()
+    try:
+        referenced = crud.iter_referenced_keys(db, prefix=prefix or None)
+        for obj in find_orphans(s3_utils.iter_objects(prefix), referenced, stats):
+            if obj['LastModified'] > cutoff:
+                stats['recent'] += 1
+                continue
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += obj.get('Size', 0)
+            if on_orphan:
+                on_orphan(obj)
+            if delete:
+                batch.append(obj['Key'])
+                if len(batch) >= s3_utils.DELETE_BATCH_SIZE:
+                    flush()
+        if batch:
+            flush()
+    finally:
+        db.close()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delete", action="store_true", help="delete orphans (default: report only)")
+    parser.add_argument("--grace-hours", type=float, default=24.0, help="ignore objects and deletions younger than this")
+    parser.add_argument("--prefix", default="", help="only reconcile keys under this prefix (e.g. '42/' for one user)")
+    parser.add_argument("--purge-deleted", action="store_true", help="first retry the purge of soft-deleted media")
+    parser.add_argument("--list", action="store_true", help="print each orphan key")
+    args = parser.parse_args(argv)
+    grace = timedelta(hours=args.grace_hours)
+
+    if args.purge_deleted:
+        purged = media_cleanup.purge_deleted(datetime.utcnow() - grace)
+        print(f"purged {purged} soft-deleted media")
+
+    on_orphan = (lambda obj: print(f"{obj['Key']}\t{obj.get('Size', 0)}\t{obj['LastModified'].isoformat()}")) if args.list else None
+    stats = collect_garbage(grace, prefix=args.prefix, delete=args.delete, on_orphan=on_orphan)
+    print(f"{stats['objects']} objects listed, {stats['orphans']} orphans ({stats['orphan_bytes']} bytes), "
+          f"{stats['recent']} unreferenced within the grace period, {stats['missing']} referenced keys missing from the bucket")
+    if args.delete:
+        print(f"deleted {stats['deleted']} orphans, {stats['failed']} failed")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
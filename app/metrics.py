@@ -0,0 +1,276 @@
+"""Minimal in-process metrics registry rendered in the Prometheus text format.
+
+Only what the API needs: counters, gauges and histograms with string labels.
+Every metric registers itself on creation and `render()` serializes them all.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[idx] += 1
+            total[0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), t[0])) for k, (c, t) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            base = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base} {_format_value(total)}")
+            lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """Serialize every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# HTTP and media pipeline instrumentation
+
+request_latency = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route template.",
+    ["method", "route"],
+)
+request_count = Counter("http_requests_total", "Requests by route template and status code.", ["method", "route", "status"])
+
+stage_latency = Histogram("pipeline_stage_seconds", "Latency of a media pipeline stage (probe, thumbnail, renditions, S3, commits).", ["stage"])
+stage_errors = Counter("pipeline_stage_errors_total", "Failed media pipeline stages.", ["stage"])
+stage_bytes = Counter("pipeline_bytes_processed_total", "Bytes handed to a media pipeline stage.", ["stage"])
+ffmpeg_active = Gauge("ffmpeg_processes_active", "ffmpeg/ffprobe subprocesses currently running.")
+requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served by this worker.")
+threadpool_size = Gauge("threadpool_threads_total", "Threads available to sync endpoints and dependencies.")
+threadpool_busy = Gauge("threadpool_threads_busy", "Threadpool threads currently borrowed.")
+threadpool_waiting = Gauge("threadpool_tasks_waiting", "Sync calls queued for a free threadpool thread.")
+content_streams_active = Gauge("content_streams_active", "Media downloads currently relayed from S3 (/media/{id}/content and exports).")
+content_bytes_sent = Counter("content_bytes_sent_total", "Bytes relayed from S3 to clients (/media/{id}/content and exports).")
+response_cache_requests = Counter("response_cache_requests_total", "Response cache lookups by endpoint and result (hit, miss).", ["endpoint", "result"])
+response_cache_evictions = Counter("response_cache_evictions_total", "Entries evicted from the in-process response cache to stay within its bounds.")
+response_cache_entries = Gauge("response_cache_entries", "Entries held by the in-process response cache.")
+response_cache_bytes = Gauge("response_cache_bytes", "Body bytes held by the in-process response cache.")
+
+
+def record_threadpool(limiter) -> None:
+    """Snapshot an anyio CapacityLimiter (must be called on the event loop)."""
+    stats = limiter.statistics()
+    threadpool_size.set(stats.total_tokens)
+    threadpool_busy.set(stats.borrowed_tokens)
+    threadpool_waiting.set(stats.tasks_waiting)
+
+
+@contextmanager
+def stage(name: str, nbytes: Optional[int] = None, ffmpeg: bool = False):
+    """Time a pipeline stage: ``with metrics.stage("probe", nbytes=len(data), ffmpeg=True): ...``
+
+    Exceptions are counted in `pipeline_stage_errors_total` and re-raised.
+    `ffmpeg=True` tracks the block in the active ffmpeg process gauge.
+    """
+    if ffmpeg:
+        ffmpeg_active.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=name)
+        raise
+    else:
+        if nbytes:
+            stage_bytes.inc(nbytes, stage=name)
+    finally:
+        stage_latency.observe(time.perf_counter() - started, stage=name)
+        if ffmpeg:
+            ffmpeg_active.dec()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and status per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests_in_flight.dec()
+            # the router stores the matched route in the (shared) scope; use its
+            # template so /media/1 and /media/2 share a series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope.get("method", "")
+            request_latency.observe(time.perf_counter() - started, method=method, route=route)
+            request_count.inc(method=method, route=route, status=str(status_code))
+
+
+def _before_commit(session):
+    session.info["_commit_started"] = time.perf_counter()
+
+
+def _after_commit(session):
+    started = session.info.pop("_commit_started", None)
+    if started is not None:
+        stage_latency.observe(time.perf_counter() - started, stage="db_commit")
+
+
+def _after_rollback(session):
+    if session.info.pop("_commit_started", None) is not None:
+        stage_errors.inc(stage="db_commit")
+
+
+def instrument_sessions() -> None:
+    """Time every ORM commit (flush included) as the `db_commit` stage."""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    if not event.contains(Session, "before_commit", _before_commit):
+        event.listen(Session, "before_commit", _before_commit)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
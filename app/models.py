@@ -8,11 +8,16 @@ from sqlalchemy import (
     BigInteger,
     Text,
     JSON,
+    LargeBinary,
     Enum,
     Numeric,
     Table,
+    Index,
+    event,
+    select,
+    update,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship
 from datetime import datetime
 from .database import Base
 
@@ -22,6 +27,8 @@ media_tags = Table(
     Base.metadata,
     Column("media_id", Integer, ForeignKey("media.id", ondelete="CASCADE"), primary_key=True),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    # the primary key covers lookups by media; this one covers lookups by tag
+    Index("ix_media_tags_tag_id", "tag_id"),
 )
 
 
@@ -39,20 +46,38 @@ class User(Base):
     media = relationship("Media", back_populates="owner", cascade="all, delete-orphan")
     # S3 key for user's avatar (thumbnail or original)
     avatar_s3_key = Column(String, nullable=True)
+    # Embedded in access tokens as the 'tv' claim; bump to revoke issued tokens
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Storage quota in bytes; NULL uses STORAGE_QUOTA_BYTES, 0 means unlimited
+    storage_quota_bytes = Column(BigInteger, nullable=True)
 
 
 class Media(Base):
     __tablename__ = "media"
+    __table_args__ = (
+        # per-owner listing ordered by created_at (scanned backwards for DESC)
+        Index("ix_media_owner_id_created_at", "owner_id", "created_at"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     description = Column(Text)
     filename = Column(String, nullable=False)
     s3_key = Column(String, nullable=False, unique=True)
     mimetype = Column(String)
     size = Column(BigInteger)
+    # Bytes of everything derived from the original (thumbnails, renditions,
+    # storyboards, waveform); size + derived_size is what counts toward the quota
+    derived_size = Column(BigInteger, nullable=False, default=0, server_default="0")
     is_public = Column(Boolean, default=False)
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
     created_at = Column(DateTime, default=datetime.utcnow)
     upload_at = Column(DateTime, default=datetime.utcnow)
+    # Bumped on any change to the media, its tags or its metadata (see
+    # _bump_media_versions); used to build ETags
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    # Set by bulk deletes; the row is hidden from every query and removed once
+    # its S3 objects are purged (see media_cleanup)
+    deleted_at = Column(DateTime, nullable=True)
 
     # media_type enum: image, video, audio, other
     media_type = Column(Enum("image", "video", "audio", "other", name="media_type_enum"), nullable=False, default="other")
@@ -66,12 +91,17 @@ class Media(Base):
 
     thumbnails = relationship("Thumbnail", back_populates="media", cascade="all, delete-orphan")
     renditions = relationship("VideoRendition", back_populates="media", cascade="all, delete-orphan")
+    audio_renditions = relationship("AudioRendition", back_populates="media", cascade="all, delete-orphan")
 
     tags = relationship("Tag", secondary=media_tags, back_populates="media")
 
 
 class Thumbnail(Base):
     __tablename__ = "thumbnails"
+    __table_args__ = (
+        # listing thumbnail lookup: by media, preferring a purpose, newest first
+        Index("ix_thumbnails_media_id_purpose_created_at", "media_id", "purpose", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     media_id = Column(Integer, ForeignKey("media.id", ondelete="CASCADE"), nullable=False)
     s3_key = Column(String, nullable=False)
@@ -86,6 +116,13 @@ class Thumbnail(Base):
 
 class ImageMetadata(Base):
     __tablename__ = "image_metadata"
+    __table_args__ = (
+        # similarity search probes the bands of one user's images
+        Index("ix_image_metadata_owner_id_phash_b0", "owner_id", "phash_b0"),
+        Index("ix_image_metadata_owner_id_phash_b1", "owner_id", "phash_b1"),
+        Index("ix_image_metadata_owner_id_phash_b2", "owner_id", "phash_b2"),
+        Index("ix_image_metadata_owner_id_phash_b3", "owner_id", "phash_b3"),
+    )
     media_id = Column(Integer, ForeignKey("media.id", ondelete="CASCADE"), primary_key=True)
     width = Column(Integer)
     height = Column(Integer)
@@ -93,7 +130,17 @@ class ImageMetadata(Base):
     dpi_x = Column(Integer)
     dpi_y = Column(Integer)
     exif = Column(JSON)
-    main_thumbnail_id = Column(Integer, ForeignKey("thumbnails.id", ondelete="SET NULL"))
+    main_thumbnail_id = Column(Integer, ForeignKey("thumbnails.id", ondelete="SET NULL"), index=True)
+    # copy of media.owner_id, leading the band indexes so a search only walks
+    # the caller's images
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    # 64-bit perceptual hash (signed) and its four 16-bit bands, indexed for
+    # multi-index Hamming search (see similarity)
+    phash = Column(BigInteger)
+    phash_b0 = Column(Integer)
+    phash_b1 = Column(Integer)
+    phash_b2 = Column(Integer)
+    phash_b3 = Column(Integer)
 
     media = relationship("Media", back_populates="image_metadata")
     main_thumbnail = relationship("Thumbnail", foreign_keys=[main_thumbnail_id])
@@ -109,11 +156,14 @@ class VideoMetadata(Base):
     video_codec = Column(String)
     audio_codec = Column(String)
     bitrate = Column(BigInteger)
-    main_thumbnail_id = Column(Integer, ForeignKey("thumbnails.id", ondelete="SET NULL"))
+    main_thumbnail_id = Column(Integer, ForeignKey("thumbnails.id", ondelete="SET NULL"), index=True)
     url_1080 = Column(String)
     url_720 = Column(String)
     url_480 = Column(String)
     genero = Column(String)
+    # Sprite sheets for scrubbing: {"sheets": [s3 keys], "interval", "frames",
+    # "columns", "rows", "tile_width", "tile_height"}
+    storyboard = Column(JSON)
 
     media = relationship("Media", back_populates="video_metadata")
     main_thumbnail = relationship("Thumbnail", foreign_keys=[main_thumbnail_id])
@@ -127,6 +177,8 @@ class AudioMetadata(Base):
     sample_rate = Column(Integer)
     channels = Column(Integer)
     genero = Column(String)
+    # S3 key of the precomputed waveform peaks (JSON, see audio_processing.compute_waveform_peaks)
+    waveform_key = Column(String)
 
     media = relationship("Media", back_populates="audio_metadata")
 
@@ -134,7 +186,7 @@ class AudioMetadata(Base):
 class VideoRendition(Base):
     __tablename__ = "video_renditions"
     id = Column(Integer, primary_key=True)
-    media_id = Column(Integer, ForeignKey("media.id", ondelete="CASCADE"), nullable=False)
+    media_id = Column(Integer, ForeignKey("media.id", ondelete="CASCADE"), nullable=False, index=True)
     resolution = Column(String, nullable=False)  # e.g. '1080p'
     width = Column(Integer)
     height = Column(Integer)
@@ -146,6 +198,57 @@ class VideoRendition(Base):
     media = relationship("Media", back_populates="renditions")
 
 
+class AudioRendition(Base):
+    __tablename__ = "audio_renditions"
+    id = Column(Integer, primary_key=True)
+    media_id = Column(Integer, ForeignKey("media.id", ondelete="CASCADE"), nullable=False, index=True)
+    codec = Column(String, nullable=False)  # e.g. 'opus', 'aac'
+    bitrate = Column(BigInteger)
+    mimetype = Column(String)
+    size = Column(BigInteger)
+    s3_key = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    media = relationship("Media", back_populates="audio_renditions")
+
+
+class AudioFingerprint(Base):
+    """Inverted index of acoustic fingerprints: one row per (owner, hash, media, anchor frame)."""
+    __tablename__ = "audio_fingerprints"
+    # owner (a copy of media.owner_id) and hash lead the primary key, so a
+    # lookup only walks the caller's landmarks
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    hash = Column(Integer, primary_key=True, autoincrement=False)
+    media_id = Column(Integer, ForeignKey("media.id", ondelete="CASCADE"), primary_key=True, index=True)
+    offset = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class UserUsage(Base):
+    """Storage used per user and media type, kept in step with media rows (see `usage`)."""
+    __tablename__ = "user_usage"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    media_type = Column(String(16), primary_key=True)
+    bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
+    count = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    """Idempotency-Key of an upload (see `idempotency`): pending while the first
+    request runs, then the response replayed to retries until `expires_at`."""
+    __tablename__ = "idempotency_keys"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # hash of the endpoint and request fields; a key reused for another request is rejected
+    fingerprint = Column(String(64), nullable=False)
+    # both NULL while the original request is in flight
+    status_code = Column(Integer, nullable=True)
+    response = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # lease of the in-flight request, then the replay TTL once completed
+    expires_at = Column(DateTime, nullable=False)
+
+
 class Tag(Base):
     __tablename__ = "tags"
     id = Column(Integer, primary_key=True)
@@ -153,3 +256,48 @@ class Tag(Base):
 
     media = relationship("Media", secondary=media_tags, back_populates="tags")
 
+
+
+# Rows whose changes count as a change of their media
+_MEDIA_CHILDREN = (Thumbnail, ImageMetadata, VideoMetadata, AudioMetadata, VideoRendition, AudioRendition)
+# session.info key: owners whose media changed in the current transaction
+# (consumed after commit, e.g. by the response cache)
+CHANGED_OWNERS_KEY = "changed_media_owner_ids"
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_media(session, flush_context, instances):
+    changed = session.info.setdefault("_changed_media_ids", set())
+    owners = session.info.setdefault(CHANGED_OWNERS_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Media):
+            if obj in session.new or obj in session.deleted:
+                # new rows start at version 1; only the owner's views change
+                owner_id = obj.owner_id if obj.owner_id is not None else getattr(obj.owner, "id", None)
+                if owner_id is not None:
+                    owners.add(owner_id)
+            elif session.is_modified(obj):
+                # tag changes make the media itself dirty
+                changed.add(obj.id)
+        elif isinstance(obj, _MEDIA_CHILDREN) and obj.media_id is not None:
+            changed.add(obj.media_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_media_versions(session, flush_context):
+    ids = session.info.pop("_changed_media_ids", None)
+    if not ids:
+        return
+    table = Media.__table__
+    conn = session.connection()
+    # in SQL so concurrent writers cannot lose a bump
+    conn.execute(
+        update(table)
+        .where(table.c.id.in_(ids))
+        .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+    )
+    owners = conn.execute(select(table.c.owner_id).where(table.c.id.in_(ids))).scalars()
+    session.info.setdefault(CHANGED_OWNERS_KEY, set()).update(o for o in owners if o is not None)
+    for obj in session.identity_map.values():
+        if isinstance(obj, Media) and obj.id in ids:
+            session.expire(obj, ["version", "updated_at"])
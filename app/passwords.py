@@ -0,0 +1,131 @@
+"""Password hashing on a dedicated, size-bounded process pool.
+
+bcrypt is CPU bound; running it on the request threadpool lets a burst of logins
+starve every other endpoint. Hashes are computed in separate processes (outside
+the GIL) and callers await the result without holding a threadpool slot. When
+more than PASSWORD_HASH_MAX_PENDING operations are queued, new ones are rejected
+with `PasswordHasherBusy` (mapped to HTTP 429 in main.py).
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+
+from . import metrics
+from .config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_RETRY_AFTER
+
+hash_latency = metrics.Histogram(
+    "password_hash_seconds",
+    "Time to hash or verify a password, including queueing on the hasher pool.",
+    ["op"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+hash_pending = metrics.Gauge("password_hash_pending", "Password hash operations queued or running.")
+hash_rejected = metrics.Counter("password_hash_rejected_total", "Password hash operations rejected because the queue was full.", ["op"])
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hasher queue is full; `retry_after` is in seconds."""
+
+    def __init__(self, retry_after: int = PASSWORD_HASH_RETRY_AFTER):
+        super().__init__("Password hasher is busy")
+        self.retry_after = retry_after
+
+
+# Worker functions (run inside the pool processes)
+
+def _prehash(password: str) -> bytes:
+    # bcrypt truncates at 72 bytes; hash first so long passwords keep their entropy
+    return hashlib.sha256(password.encode("utf-8")).digest()
+
+
+def hash_password_sync(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(_prehash(password), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def verify_password_sync(password: str, hashed_password: str) -> Tuple[bool, bool]:
+    """Return (matches, needs_rehash).
+
+    `needs_rehash` is set for legacy passlib hashes and for hashes made with a
+    different cost factor than BCRYPT_ROUNDS.
+    """
+    try:
+        if bcrypt.checkpw(_prehash(password), hashed_password.encode("utf-8")):
+            try:
+                rounds = int(hashed_password.split("$")[2])
+            except (IndexError, ValueError):
+                rounds = BCRYPT_ROUNDS
+            return True, rounds != BCRYPT_ROUNDS
+        return False, False
+    except Exception:
+        # fallback to passlib verification for legacy hashes
+        try:
+            from passlib.context import CryptContext
+            pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+            if pwd_context.verify(password, hashed_password):
+                return True, True
+        except Exception:
+            pass
+        return False, False
+
+
+# Pool management
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking a process that already runs threads is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def _run(op: str, fn, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            hash_rejected.inc(op=op)
+            raise PasswordHasherBusy()
+        _pending += 1
+    hash_pending.inc()
+    started = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        hash_latency.observe(time.perf_counter() - started, op=op)
+        hash_pending.dec()
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    if not password:
+        raise ValueError("password must not be empty")
+    return await _run("hash", hash_password_sync, password, BCRYPT_ROUNDS)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, bool]:
+    return await _run("verify", verify_password_sync, password, hashed_password)
@@ -0,0 +1,80 @@
+"""Compute perceptual hashes of images uploaded before similarity search.
+
+Images whose metadata has no pHash never show up in similar-image searches.
+This hashes them the way uploads do, from the listing thumbnail (the same
+320px input, so hashes are comparable) or from the original when there is no
+thumbnail. Usage::
+
+    python -m app.phash_backfill                  # hash every pending image
+    python -m app.phash_backfill --limit 1000 --workers 16
+
+Images are taken in id order, a batch per transaction; S3 downloads and
+hashing run on a small thread pool. Images that cannot be read are skipped and
+reported, so the command can be rerun safely at any time.
+"""
+import argparse
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from . import crud, image_processing, s3_utils
+from .database import SessionLocal
+
+
+def _hash(s3_key: str, thumbnail_key: Optional[str]) -> Optional[int]:
+    # any failure (S3 errors, truncated or corrupt images) skips this image only
+    try:
+        if thumbnail_key:
+            data = s3_utils.download_bytes(thumbnail_key)
+            if data is not None:
+                return image_processing.thumbnail_hash(io.BytesIO(data))
+        data = s3_utils.download_bytes(s3_key)
+        if data is None:
+            return None
+        return image_processing.perceptual_hash(image_processing.open_image(data))
+    except Exception as e:
+        print(f"cannot hash {s3_key}: {e}")
+        return None
+
+
+def backfill(batch_size: int = 200, limit: Optional[int] = None, workers: int = 8) -> Dict[str, int]:
+    """Hash pending images; returns counts of hashed and skipped images."""
+    stats = {'hashed': 0, 'skipped': 0}
+    after = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while limit is None or stats['hashed'] + stats['skipped'] < limit:
+            db = SessionLocal()
+            try:
+                size = batch_size if limit is None else min(batch_size, limit - stats['hashed'] - stats['skipped'])
+                rows: List[Tuple[int, str, Optional[str]]] = crud.list_images_without_phash(db, after, size)
+                if not rows:
+                    break
+                after = rows[-1][0]
+                hashes = pool.map(lambda row: _hash(row[1], row[2]), rows)
+                for (media_id, s3_key, _thumb), phash in zip(rows, hashes):
+                    if phash is None:
+                        stats['skipped'] += 1
+                        print(f"media {media_id}: no hash ({s3_key})")
+                        continue
+                    crud.set_image_phash(db, media_id, phash)
+                    stats['hashed'] += 1
+                db.commit()
+            finally:
+                db.close()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200, help="images per transaction")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many images")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent S3 downloads")
+    args = parser.parse_args(argv)
+    stats = backfill(batch_size=args.batch_size, limit=args.limit, workers=args.workers)
+    print(f"{stats['hashed']} images hashed, {stats['skipped']} skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Opt-in per-request profiling with cProfile.
+
+A request is profiled when it carries ``X-Profile-Request: <PROFILING_TOKEN>`` or
+is picked by PROFILE_SAMPLE_RATE. The profile covers the event-loop thread and
+the threadpool work run for the route (sync endpoint, dependencies, response
+validation, explicit `run_in_threadpool` calls), so time spent in Pillow,
+SQLAlchemy and ffmpeg subprocess waits shows up.
+
+Worker-thread calls are caught at `anyio.to_thread.run_sync`, anyio's public
+entry point, which Starlette's and FastAPI's threadpool helpers look up on
+the module at call time (checked against anyio 4.12, Starlette 0.45 and
+FastAPI 0.115). FastAPI's own imports are left alone, so this does not depend
+on which of its modules bind `run_in_threadpool`. Results are written to PROFILE_OUTPUT_DIR as a
+`.pstats` file and a collapsed-stack `.collapsed` file (for flamegraph.pl /
+speedscope), and summarized in the ``X-Profile-Summary`` response header.
+
+Before Python 3.12 cProfile hooks one thread at a time, so each threadpool
+call gets its own profiler, merged at the end. From 3.12 on cProfile sits on
+`sys.monitoring`, whose single profiler slot is interpreter-wide: the request
+gets one profiler, which already sees every thread, and starting a second one
+would fail.
+
+The profile is not isolated from other traffic: the event-loop profiler (and,
+on 3.12+, the whole-interpreter one) also records any other request that runs
+while the profiled one is in flight, and attributes it to that request. Only
+one request is profiled at a time; profile under light traffic, or read the
+numbers as an upper bound.
+
+Nothing here is installed unless profiling is enabled (see `install`), so a
+disabled profiler costs nothing per request.
+"""
+import contextvars
+import cProfile
+import functools
+import hmac
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import anyio.to_thread
+
+from .config import PROFILING_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_OUTPUT_DIR
+
+PROFILE_HEADER = "x-profile-request"
+_SUMMARY_TOP_N = 5
+_COLLAPSED_MAX_DEPTH = 96
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+# cProfile hooks are exclusive (per thread, or per interpreter from 3.12); profile one request at a time
+_active_lock = threading.Lock()
+# from 3.12 cProfile uses sys.monitoring: one profiler per interpreter, covering all threads
+_PROFILER_IS_GLOBAL = sys.version_info >= (3, 12)
+
+
+def is_enabled() -> bool:
+    return bool(PROFILING_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+class RequestProfile:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def new_profiler(self) -> cProfile.Profile:
+        prof = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(prof)
+        return prof
+
+    def stats(self) -> Optional[pstats.Stats]:
+        stats = None
+        with self._lock:
+            profiles = list(self._profiles)
+        for prof in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(prof)
+                else:
+                    stats.add(prof)
+            except TypeError:
+                # profiler that never recorded a call
+                continue
+        return stats
+
+
+def _profiled_sync(fn: Callable, request_profile: RequestProfile) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        prof = request_profile.new_profiler()
+        prof.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.disable()
+    return wrapper
+
+
+def _profiling_run_sync(run_sync: Callable) -> Callable:
+    """Wrap anyio's worker-thread entry point, so whatever callable reaches it
+    (including `app.dependency_overrides`) is profiled in the worker thread."""
+    @functools.wraps(run_sync)
+    async def wrapper(func, *args, **kwargs):
+        request_profile = _current.get()
+        if request_profile is not None and not _PROFILER_IS_GLOBAL:
+            func = _profiled_sync(func, request_profile)
+        return await run_sync(func, *args, **kwargs)
+    wrapper._request_profiling = True  # type: ignore[attr-defined]
+    return wrapper
+
+
+def _collapsed_stacks(stats: pstats.Stats) -> List[str]:
+    """Approximate collapsed stacks from the pstats caller graph.
+
+    pstats keeps caller->callee edges rather than full stacks, so time is
+    split across paths in proportion to each caller's share of the callee.
+    """
+    raw = stats.stats  # type: ignore[attr-defined]
+    children = defaultdict(list)
+    for func, (_cc, _nc, _tt, _ct, callers) in raw.items():
+        for caller, caller_stat in callers.items():
+            children[caller].append((func, caller_stat[3]))
+
+    def label(func) -> str:
+        filename, line, name = func
+        return f"{os.path.basename(filename)}:{line}({name})".replace(";", ":")
+
+    weights: Dict[str, int] = defaultdict(int)
+
+    def walk(func, stack, share):
+        _cc, _nc, tt, ct, _callers = raw[func]
+        if ct * share * 1_000_000 < 1:
+            # nothing below here can add a whole microsecond; without this cut
+            # the number of paths grows exponentially on large call graphs
+            return
+        stack = stack + [label(func)]
+        own = int(tt * share * 1_000_000)
+        if own > 0:
+            weights[";".join(stack)] += own
+        if len(stack) >= _COLLAPSED_MAX_DEPTH:
+            return
+        for child, ct_from_caller in children.get(func, ()):
+            child_ct = raw[child][3]
+            if child_ct <= 0 or label(child) in stack:
+                continue
+            walk(child, stack, share * min(1.0, ct_from_caller / child_ct))
+
+    for func, (_cc, _nc, _tt, _ct, callers) in raw.items():
+        if not callers:
+            walk(func, [], 1.0)
+    return [f"{stack} {weight}" for stack, weight in sorted(weights.items())]
+
+
+def _summary(stats: pstats.Stats, wall: float) -> str:
+    raw = stats.stats  # type: ignore[attr-defined]
+    top = sorted(raw.items(), key=lambda item: item[1][2], reverse=True)[:_SUMMARY_TOP_N]
+    parts = [f"wall={wall:.4f}s", f"cpu={stats.total_tt:.4f}s", f"calls={stats.total_calls}"]  # type: ignore[attr-defined]
+    for (filename, line, name), (_cc, _nc, tt, _ct, _callers) in top:
+        parts.append(f"{os.path.basename(filename)}:{line}({name})={tt:.4f}s")
+    # header values must stay ASCII
+    return "; ".join(parts).encode("ascii", "replace").decode("ascii")
+
+
+def _write_outputs(request_profile: RequestProfile, stats: pstats.Stats, method: str, route: str) -> str:
+    os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+    slug = "".join(c if c.isalnum() else "_" for c in route).strip("_") or "root"
+    base = os.path.join(PROFILE_OUTPUT_DIR, f"{time.strftime('%Y%m%d%H%M%S')}_{method}_{slug}_{request_profile.id}")
+    stats.dump_stats(base + ".pstats")
+    with open(base + ".collapsed", "w") as f:
+        f.write("\n".join(_collapsed_stacks(stats)) + "\n")
+    return os.path.basename(base)
+
+
+class ProfilingMiddleware:
+    """Profile requests selected by the admin header or the sampling rate."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wants_profile(self, scope) -> bool:
+        if PROFILING_TOKEN:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER.encode() and hmac.compare_digest(value.decode("latin-1"), PROFILING_TOKEN):
+                    return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _active_lock.acquire(blocking=False):
+            # another request is being profiled; serve this one normally
+            await self.app(scope, receive, send)
+            return
+
+        request_profile = RequestProfile()
+        token = _current.set(request_profile)
+        loop_profiler = request_profile.new_profiler()
+        started = time.perf_counter()
+        finished = False
+
+        def finish() -> List[tuple]:
+            nonlocal finished
+            finished = True
+            loop_profiler.disable()
+            stats = request_profile.stats()
+            if stats is None:
+                return []
+            route = getattr(scope.get("route"), "path", scope.get("path", ""))
+            name = _write_outputs(request_profile, stats, scope.get("method", ""), route)
+            return [
+                (b"x-profile-id", name.encode("latin-1")),
+                (b"x-profile-summary", _summary(stats, time.perf_counter() - started).encode("latin-1")),
+            ]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and not finished:
+                # the endpoint has run by now; stop profiling and report in headers
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + finish()
+            await send(message)
+
+        try:
+            loop_profiler.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not finished:
+                loop_profiler.disable()
+            _current.reset(token)
+            _active_lock.release()
+
+
+def install(app) -> None:
+    """Add the middleware, and hook anyio's worker-thread calls, when profiling is enabled."""
+    if not is_enabled():
+        return
+    run_sync = getattr(anyio.to_thread, "run_sync", None)
+    if run_sync is None:
+        raise RuntimeError("anyio.to_thread.run_sync not found; request profiling needs anyio 4")
+    if not getattr(run_sync, "_request_profiling", False):
+        anyio.to_thread.run_sync = _profiling_run_sync(run_sync)
+    app.add_middleware(ProfilingMiddleware)
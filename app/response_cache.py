@@ -0,0 +1,191 @@
+"""Per-user cache of rendered listing and detail responses.
+
+Entries are keyed by user, endpoint, query parameters and the user's cache
+version. Any committed transaction that adds, changes or deletes one of the
+user's media (including tags, metadata, thumbnails and renditions; see
+`models.CHANGED_OWNERS_KEY`) bumps that version, so older entries are never
+read again and simply age out through the TTL and the LRU bounds.
+
+The version is read *before* the handler queries the database: a response
+built from rows that a concurrent write then changes is stored under the old
+version and is unreachable once the write commits.
+
+Without RESPONSE_CACHE_REDIS_URL every worker keeps its own cache and its own
+versions, so a write served by one worker is only seen by the others once
+their entries expire (at most RESPONSE_CACHE_TTL_SECONDS). Configure Redis to
+share entries and versions between workers.
+"""
+import hashlib
+import threading
+from typing import Hashable, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import etags, metrics
+from .cache import TTLCache
+from .config import (
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    RESPONSE_CACHE_REDIS_URL,
+)
+from .models import CHANGED_OWNERS_KEY
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+
+
+class MemoryStore:
+    """Entries in a bounded `TTLCache`, versions in a plain dict (one int per user)."""
+
+    def __init__(self, ttl: float, maxsize: int, maxbytes: int):
+        self.entries = TTLCache(ttl=ttl, maxsize=maxsize, maxbytes=maxbytes, sizeof=lambda e: len(e.body))
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    async def version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    async def get(self, key: Hashable) -> Optional[CachedResponse]:
+        return self.entries.get(key)
+
+    async def set(self, key: Hashable, entry: CachedResponse) -> None:
+        evictions = self.entries.evictions
+        self.entries.set(key, entry)
+        if self.entries.evictions > evictions:
+            metrics.response_cache_evictions.inc(self.entries.evictions - evictions)
+        metrics.response_cache_entries.set(len(self.entries))
+        metrics.response_cache_bytes.set(self.entries.nbytes)
+
+    def bump(self, user_id: int) -> None:
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+
+class RedisStore:
+    """Entries and versions in Redis, shared by every worker.
+
+    Memory bounds are Redis' own (``maxmemory`` with an LRU policy); entries
+    carry the TTL as their expiry. Reads and writes use the asyncio client;
+    bumps run from the synchronous commit hook and use a blocking client.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        import redis
+        import redis.asyncio
+
+        self.ttl = max(1, int(ttl))
+        self._async = redis.asyncio.from_url(url)
+        self._sync = redis.from_url(url)
+
+    @staticmethod
+    def _key(key: Tuple) -> str:
+        user_id, version, endpoint, params = key
+        digest = hashlib.blake2b(repr(params).encode(), digest_size=12).hexdigest()
+        return f"rc:e:{user_id}:{version}:{endpoint}:{digest}"
+
+    async def version(self, user_id: int) -> int:
+        value = await self._async.get(f"rc:v:{user_id}")
+        return int(value) if value is not None else 0
+
+    async def get(self, key: Tuple) -> Optional[CachedResponse]:
+        raw = await self._async.get(self._key(key))
+        if raw is None:
+            return None
+        etag, _, body = raw.partition(b"\n")
+        return CachedResponse(etag.decode(), body)
+
+    async def set(self, key: Tuple, entry: CachedResponse) -> None:
+        await self._async.set(self._key(key), entry.etag.encode() + b"\n" + entry.body, ex=self.ttl)
+
+    def bump(self, user_id: int) -> None:
+        self._sync.incr(f"rc:v:{user_id}")
+
+
+class Slot:
+    """One lookup: the key the response is stored under and the entry found, if any."""
+
+    def __init__(self, cache: "ResponseCache", endpoint: str, key: Optional[Tuple], entry: Optional[CachedResponse]):
+        self.cache = cache
+        self.endpoint = endpoint
+        self.key = key
+        self.entry = entry
+
+    def respond(self, request: Request) -> Response:
+        """Serve the cached entry (or a 304 when the client already has it)."""
+        if etags.matches(request, self.entry.etag):
+            return etags.not_modified(self.entry.etag)
+        return etags.tagged(Response(content=self.entry.body, media_type="application/json"), self.entry.etag)
+
+    async def store(self, response: Response) -> Response:
+        """Cache a successful, tagged response under this slot's key and return it."""
+        etag = response.headers.get("etag")
+        if self.key is None or etag is None or response.status_code != 200:
+            return response
+        if len(response.body) > self.cache.max_entry_bytes:
+            return response
+        try:
+            await self.cache.store.set(self.key, CachedResponse(etag, response.body))
+        except Exception:
+            metrics.response_cache_requests.inc(endpoint=self.endpoint, result="error")
+        return response
+
+
+class ResponseCache:
+    def __init__(self, store, max_entry_bytes: int, enabled: bool = True):
+        self.store = store
+        self.max_entry_bytes = max_entry_bytes
+        self.enabled = enabled
+
+    async def lookup(self, endpoint: str, user_id: int, params: Tuple) -> Slot:
+        """Read the user's version and look the response up; call before querying."""
+        if not self.enabled:
+            return Slot(self, endpoint, None, None)
+        try:
+            version = await self.store.version(user_id)
+            key = (user_id, version, endpoint, params)
+            entry = await self.store.get(key)
+        except Exception:
+            # a cache outage degrades to uncached responses
+            metrics.response_cache_requests.inc(endpoint=endpoint, result="error")
+            return Slot(self, endpoint, None, None)
+        metrics.response_cache_requests.inc(endpoint=endpoint, result="hit" if entry is not None else "miss")
+        return Slot(self, endpoint, key, entry)
+
+    def bump(self, user_id: int) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.store.bump(user_id)
+        except Exception:
+            # entries may be served stale until they expire
+            metrics.response_cache_requests.inc(endpoint="bump", result="error")
+
+
+def _make_store():
+    if RESPONSE_CACHE_REDIS_URL:
+        return RedisStore(RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_TTL_SECONDS)
+    return MemoryStore(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+
+
+response_cache = ResponseCache(
+    _make_store() if RESPONSE_CACHE_TTL_SECONDS > 0 else None,
+    RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    enabled=RESPONSE_CACHE_TTL_SECONDS > 0,
+)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_owners(session):
+    for owner_id in session.info.pop(CHANGED_OWNERS_KEY, ()):
+        response_cache.bump(owner_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_owners(session):
+    session.info.pop(CHANGED_OWNERS_KEY, None)
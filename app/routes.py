@@ -1,105 +1,126 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form, Query, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import List, Literal
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import crud, schemas, auth, s3_utils, models
+from . import crud, crud_async, schemas, serializers, etags, auth, s3_utils, models, similarity
+from .response_cache import response_cache
 from . import utils
+from . import image_processing
 from . import video_processing
 from . import audio_processing
-from .database import get_db
+from . import passwords
+from . import idempotency
+from . import usage
+from . import content_proxy
+from . import media_cleanup
+from . import media_export
+from .database import get_db, get_async_db
+from .config import AUDIO_REJECT_DUPLICATES, FINGERPRINT_MIN_MATCHES
 from datetime import timedelta
 import uuid
 import io
+import orjson
 from datetime import datetime
-from PIL import Image, ExifTags
-import math
 
 router = APIRouter()
 
 # Auth endpoints
+# These handlers are async so that waiting on the password hasher pool does not
+# hold a threadpool slot; DB calls are pushed to the threadpool explicitly.
 @router.post('/auth/register', response_model=schemas.UserOut)
-def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    if crud.get_user_by_email(db, user_in.email):
+async def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+    if await run_in_threadpool(crud.get_user_by_email, db, user_in.email):
         raise HTTPException(status_code=400, detail='Email already registered')
-    user = crud.create_user(db, user_in)
+    try:
+        hashed = await passwords.hash_password(user_in.password)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    user = await run_in_threadpool(crud.create_user, db, user_in, hashed)
     return user
 
 @router.post('/auth/login', response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     # OAuth2 form uses 'username' field — treat it as the user's email
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail='Incorrect username or password')
-    access_token = auth.create_access_token({"sub": user.email})
+    access_token = auth.create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User profile
 @router.get('/users/me', response_model=schemas.UserOut)
-def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
-    # Build response and include presigned avatar URL if available
-    avatar_url = None
-    try:
-        if getattr(current_user, 'avatar_s3_key', None):
-            avatar_url = s3_utils.generate_presigned_url(current_user.avatar_s3_key)
-    except Exception:
-        avatar_url = None
-
-    return {
-        'id': current_user.id,
-        'email': current_user.email,
-        'full_name': current_user.full_name,
-        'username': getattr(current_user, 'username', None),
-        'bio': current_user.bio,
-        'is_active': current_user.is_active,
-        'created_at': current_user.created_at,
-        'avatar_url': avatar_url,
-    }
+async def read_users_me(current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    return ORJSONResponse(serializers.user_profile(current_user))
+
+@router.get('/users/me/usage', response_model=schemas.StorageUsage)
+async def read_storage_usage(db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    """Storage used (originals plus derived files) by media type, and the quota."""
+    used, quota = await crud_async.get_storage_quota(db, current_user.id)
+    rows = await crud_async.get_storage_usage(db, current_user.id)
+    return ORJSONResponse(serializers.storage_usage(rows, used, quota))
 
 @router.put('/users/me', response_model=schemas.UserOut)
 def update_users_me(updates: schemas.UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     updated = crud.update_user(db, current_user, updates)
-    avatar_url = None
-    try:
-        if getattr(updated, 'avatar_s3_key', None):
-            avatar_url = s3_utils.generate_presigned_url(updated.avatar_s3_key)
-    except Exception:
-        avatar_url = None
-    return {
-        'id': updated.id,
-        'email': updated.email,
-        'full_name': updated.full_name,
-        'username': getattr(updated, 'username', None),
-        'bio': updated.bio,
-        'is_active': updated.is_active,
-        'created_at': updated.created_at,
-        'avatar_url': avatar_url,
-    }
+    return ORJSONResponse(serializers.user_profile(updated))
 
 
 @router.put('/users/me/password')
-def change_password(payload: schemas.PasswordChange, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def change_password(payload: schemas.PasswordChange, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     # Verify current password is correct
-    verified = crud.authenticate_user(db, current_user.email, payload.old_password)
+    verified = await auth.authenticate_user(db, current_user.email, payload.old_password)
     if not verified:
         raise HTTPException(status_code=400, detail='Senha atual incorreta')
 
     try:
-        crud.change_user_password(db, current_user, payload.new_password)
+        hashed = await passwords.hash_password(payload.new_password)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    await run_in_threadpool(crud.change_user_password, db, current_user, hashed)
 
-    return {"message": "Senha atualizada com sucesso"}
+    # Previous tokens were revoked by the password change; hand out a fresh one
+    access_token = auth.create_user_token(current_user)
+    return {"message": "Senha atualizada com sucesso", "access_token": access_token, "token_type": "bearer"}
 
 # Media endpoints
+def _quota_exceeded(used: int, quota: int) -> HTTPException:
+    return HTTPException(status_code=507, detail={'message': 'Storage quota exceeded', 'used': used, 'quota': quota})
+
+def _ensure_quota(db: Session, user: models.User, nbytes: int) -> None:
+    # early check with the real size, before anything is stored; the binding
+    # one is made atomically with the insert in crud.create_media
+    used, quota = crud.get_storage_quota(db, user.id)
+    if quota is not None and used + nbytes > quota:
+        raise _quota_exceeded(used, quota)
+
+def _create_media(db: Session, user: models.User, safe_name: str, orig_key: str, mimetype: str, size_bytes: int, meta: schemas.MediaCreate, media_type: str) -> models.Media:
+    try:
+        return crud.create_media(db, user, safe_name, orig_key, mimetype, size_bytes, meta, media_type=media_type)
+    except usage.QuotaExceeded as exc:
+        # a concurrent upload took the remaining space meanwhile
+        s3_utils.delete_object(orig_key)
+        raise _quota_exceeded(exc.used, exc.quota)
+
 @router.post('/media/upload/image', response_model=schemas.MediaOut)
 def upload_image(
     description: str = Form(None),
     is_profile: bool = Form(False),
     tags: str = Form(None),  # Comma-separated tags
     file: UploadFile = File(...),
+    idempotency_key: str | None = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    # retries carrying the same Idempotency-Key get the first response back;
+    # the fingerprint (which hashes the file) is only needed with a key
+    request_fingerprint = idempotency.fingerprint('image', description, is_profile, tags, file) if idempotency_key else None
+    return idempotency.run(current_user.id, idempotency_key, request_fingerprint,
+                           lambda: _upload_image(description, is_profile, tags, file, db, current_user))
+
+def _upload_image(description, is_profile, tags, file: UploadFile, db: Session, current_user: models.User):
     # Validate file type
     mimetype = file.content_type or 'application/octet-stream'
     if not mimetype.startswith('image/'):
@@ -111,6 +132,7 @@ def upload_image(
     file.file.seek(0)
     file_bytes = file.file.read()
     size_bytes = len(file_bytes)
+    _ensure_quota(db, current_user, size_bytes)
 
     # Use user id only as prefix and map by type: {id}/imagens, {id}/profile
     ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -132,7 +154,7 @@ def upload_image(
 
     # Create media DB record (without is_public)
     meta = schemas.MediaCreate(description=description, is_public=False)
-    media = crud.create_media(db, current_user, safe_name, orig_key, mimetype, size_bytes, meta, media_type='image')
+    media = _create_media(db, current_user, safe_name, orig_key, mimetype, size_bytes, meta, 'image')
 
     # Associate tags if provided
     if tags:
@@ -141,80 +163,18 @@ def upload_image(
             crud.associate_tags_to_media(db, media, tag_list)
 
     # Analyze image using Pillow
-    img = Image.open(io.BytesIO(file_bytes))
-    try:
-        width, height = img.size
-    except Exception:
-        width = None
-        height = None
-
-    # Color depth estimation from mode
-    mode_to_depth = {
-        '1': 1, 'L': 8, 'P': 8, 'RGB': 24, 'RGBA': 32, 'CMYK': 32, 'YCbCr': 24, 'I': 32, 'F': 32
-    }
-    color_depth = mode_to_depth.get(img.mode)
-
-    # DPI
-    dpi = img.info.get('dpi')
-    dpi_x = int(dpi[0]) if dpi and len(dpi) > 0 else None
-    dpi_y = int(dpi[1]) if dpi and len(dpi) > 1 else None
-
-    # EXIF extraction
-    exif_data = {}
-    try:
-        raw_exif = img._getexif() or {}
-        if raw_exif:
-            for tag, value in raw_exif.items():
-                decoded = ExifTags.TAGS.get(tag, tag)
-                exif_data[str(decoded)] = str(value)
-    except Exception:
-        exif_data = None
+    img = image_processing.open_image(file_bytes)
+    image_metadata = image_processing.extract_image_metadata(img)
 
     # Generate thumbnail (listing size, e.g., width=320)
-    thumb_io = io.BytesIO()
-    try:
-        thumb = img.copy()
-        target_w = 320
-        if width and width > target_w:
-            # calculate proportional height
-            ratio = target_w / float(width)
-            target_h = math.floor(height * ratio) if height else None
-            thumb.thumbnail((target_w, target_h or target_w))
-        else:
-            # keep original size if smaller
-            thumb.thumbnail((320, 320))
-
-        # Decide thumbnail format: preserve alpha/palette by saving PNG, otherwise JPEG
-        need_png = False
-        # If original image has alpha channel or is palette-based, prefer PNG
-        if thumb.mode in ("RGBA", "LA") or thumb.mode == "P" or img.info.get('transparency') is not None:
-            need_png = True
-
-        if need_png:
-            # Ensure mode supports alpha if originally had it; convert palette to RGBA to preserve transparency
-            if thumb.mode == 'P':
-                try:
-                    thumb = thumb.convert('RGBA')
-                except Exception:
-                    thumb = thumb.convert('RGB')
-            # Save as PNG to preserve alpha
-            thumb.save(thumb_io, format='PNG', compress_level=6)
-            thumb_content_type = 'image/png'
-        else:
-            # Convert to RGB and save as JPEG for smaller thumbnails
-            if thumb.mode not in ('RGB',):
-                thumb = thumb.convert('RGB')
-            thumb.save(thumb_io, format='JPEG', quality=85)
-            thumb_content_type = 'image/jpeg'
-
-        thumb_io.seek(0)
+    thumb_io = None
+    thumb = image_processing.generate_image_thumbnail(img, target_width=320, nbytes=size_bytes)
+    if thumb:
+        thumb_io, thumb_content_type, thumb_width, thumb_height = thumb
         thumb_size = thumb_io.getbuffer().nbytes
-        thumb_width, thumb_height = thumb.size
-    except Exception:
-        thumb_io = None
-        thumb_size = None
-        thumb_width = None
-        thumb_height = None
+
+    # Perceptual hash for near-duplicate search, computed on the small thumbnail
+    phash = image_processing.thumbnail_hash(thumb_io) if thumb_io else image_processing.perceptual_hash(img)
 
     # Upload thumbnail to S3
     thumb_key = None
@@ -229,24 +189,50 @@ def upload_image(
     thumb_obj = None
     if thumb_key:
         thumb_obj = crud.create_thumbnail(db, media, thumb_key, thumb_width, thumb_height, thumb_size, purpose='listing')
+        crud.add_derived_size(db, media, thumb_size)
 
     # If this upload is meant to be a profile image, set the user's avatar S3 key
     if is_profile:
         try:
             # prefer thumbnail key when available
             avatar_key = thumb_key if thumb_key else orig_key
-            current_user.avatar_s3_key = avatar_key
-            db.add(current_user)
-            db.commit()
-            db.refresh(current_user)
+            crud.set_user_avatar(db, current_user, avatar_key)
         except Exception:
             # don't fail the upload if avatar update fails
             pass
 
-    crud.create_image_metadata(db, media, width, height, color_depth, dpi_x, dpi_y, exif_data, main_thumbnail_id=(thumb_obj.id if thumb_obj else None))
+    crud.create_image_metadata(
+        db,
+        media,
+        image_metadata['width'],
+        image_metadata['height'],
+        image_metadata['color_depth'],
+        image_metadata['dpi_x'],
+        image_metadata['dpi_y'],
+        image_metadata['exif'],
+        main_thumbnail_id=(thumb_obj.id if thumb_obj else None),
+        phash=phash
+    )
 
     # Return the media object
-    return media
+    return ORJSONResponse(serializers.media_summary(media))
+
+
+@router.get('/media/image/{media_id}/similar', response_model=List[schemas.SimilarImage])
+async def similar_images(media_id: int, max_distance: int = Query(8, ge=0, le=similarity.MAX_DISTANCE), limit: int = Query(20, ge=1, le=100), db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    """The current user's images that look like this one (resized, recompressed or
+    lightly edited copies), closest first."""
+    media = await crud_async.get_media(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail='Media not found')
+    if media.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail='Not authorized')
+    phash = await crud_async.get_image_phash(db, media_id)
+    if phash is None:
+        raise HTTPException(status_code=404, detail='Image has no perceptual hash')
+    matches = await crud_async.find_similar_images(db, current_user.id, phash, max_distance, exclude_media_id=media_id, limit=limit)
+    thumb_keys = await crud_async.get_listing_thumbnail_keys(db, [m.id for m, _ in matches])
+    return ORJSONResponse(serializers.similar_images(matches, thumb_keys))
 
 
 @router.put('/media/image/{media_id}', response_model=schemas.ImageOut)
@@ -276,32 +262,7 @@ def update_image(
     # Refresh media to get updated relationships
     db.refresh(media)
 
-    # Build response similar to get_image
-    img_md = getattr(media, 'image_metadata', None)
-    try:
-        url = s3_utils.generate_presigned_url(media.s3_key)
-    except Exception:
-        url = None
-
-    tags = [t.name for t in (media.tags or [])]
-
-    resp = {
-        'id': media.id,
-        'description': media.description,
-        'filename': media.filename,
-        'mimetype': media.mimetype,
-        'size': media.size,
-        'created_at': media.created_at.isoformat() if media.created_at else None,
-        'width': getattr(img_md, 'width', None) if img_md else None,
-        'height': getattr(img_md, 'height', None) if img_md else None,
-        'color_depth': getattr(img_md, 'color_depth', None) if img_md else None,
-        'dpi_x': getattr(img_md, 'dpi_x', None) if img_md else None,
-        'dpi_y': getattr(img_md, 'dpi_y', None) if img_md else None,
-        'exif': getattr(img_md, 'exif', None) if img_md else None,
-        'url': url,
-        'tags': tags,
-    }
-    return resp
+    return etags.tagged(ORJSONResponse(serializers.image_detail(media)), etags.media_etag('image', media.id, media.version))
 
 
 @router.post('/media/upload/video', response_model=schemas.MediaOut)
@@ -310,9 +271,17 @@ def upload_video(
     genero: str = Form(None),
     tags: str = Form(None),  # Comma-separated tags
     file: UploadFile = File(...),
+    idempotency_key: str | None = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    # retries carrying the same Idempotency-Key get the first response back;
+    # the fingerprint (which hashes the file) is only needed with a key
+    request_fingerprint = idempotency.fingerprint('video', description, genero, tags, file) if idempotency_key else None
+    return idempotency.run(current_user.id, idempotency_key, request_fingerprint,
+                           lambda: _upload_video(description, genero, tags, file, db, current_user))
+
+def _upload_video(description, genero, tags, file: UploadFile, db: Session, current_user: models.User):
     # Validate file type
     mimetype = file.content_type or 'application/octet-stream'
     if not mimetype.startswith('video/'):
@@ -324,6 +293,7 @@ def upload_video(
     file.file.seek(0)
     file_bytes = file.file.read()
     size_bytes = len(file_bytes)
+    _ensure_quota(db, current_user, size_bytes)
 
     # Use user id only as prefix: {id}/videos
     ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -340,7 +310,7 @@ def upload_video(
 
     # Create media DB record
     meta = schemas.MediaCreate(description=description, is_public=False)
-    media = crud.create_media(db, current_user, safe_name, orig_key, mimetype, size_bytes, meta, media_type='video')
+    media = _create_media(db, current_user, safe_name, orig_key, mimetype, size_bytes, meta, 'video')
 
     # Associate tags if provided
     if tags:
@@ -351,14 +321,18 @@ def upload_video(
     # Extract video metadata using ffmpeg
     video_metadata = video_processing.extract_video_metadata(file_bytes)
 
-    # Generate thumbnail
-    thumb_io = video_processing.generate_video_thumbnail(file_bytes, timestamp=1.0)
+    # Bytes of derived files, counted toward the user's storage quota
+    derived_bytes = 0
+
+    # Pick the best-scoring keyframe as the thumbnail
+    thumb_io = video_processing.generate_video_thumbnail(file_bytes, duration_seconds=video_metadata.get('duration_seconds'))
     thumb_obj = None
     thumb_key = None
     
     if thumb_io:
         thumb_width, thumb_height = video_processing.get_thumbnail_dimensions(thumb_io)
         thumb_size = thumb_io.getbuffer().nbytes
+        derived_bytes += thumb_size
         
         # Upload thumbnail to S3
         thumb_key = f"{uid}/videos/thumbnails/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}.jpg"
@@ -376,6 +350,18 @@ def upload_video(
             purpose='listing'
         )
 
+    # Generate the scrubbing storyboard (sprite sheets, one ffmpeg pass)
+    storyboard = video_processing.generate_storyboard(file_bytes, video_metadata.get('duration_seconds'))
+    storyboard_index = None
+    if storyboard:
+        sheet_keys = []
+        for n, sheet_io in enumerate(storyboard.pop('sheets')):
+            sheet_key = f"{uid}/videos/storyboards/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}_{n:03d}.jpg"
+            derived_bytes += sheet_io.getbuffer().nbytes
+            s3_utils.upload_fileobj(sheet_io, sheet_key, 'image/jpeg')
+            sheet_keys.append(sheet_key)
+        storyboard_index = {'sheets': sheet_keys, **storyboard}
+
     # Generate video renditions (480p, 720p, 1080p)
     url_480 = None
     url_720 = None
@@ -386,6 +372,7 @@ def upload_video(
     if rendition_480:
         rendition_480_key = f"{uid}/videos/renditions/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}_480p.mp4"
         rendition_480.seek(0)
+        derived_bytes += rendition_480.getbuffer().nbytes
         s3_utils.upload_fileobj(rendition_480, rendition_480_key, 'video/mp4')
         url_480 = rendition_480_key
     
@@ -394,6 +381,7 @@ def upload_video(
     if rendition_720:
         rendition_720_key = f"{uid}/videos/renditions/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}_720p.mp4"
         rendition_720.seek(0)
+        derived_bytes += rendition_720.getbuffer().nbytes
         s3_utils.upload_fileobj(rendition_720, rendition_720_key, 'video/mp4')
         url_720 = rendition_720_key
     
@@ -402,6 +390,7 @@ def upload_video(
     if rendition_1080:
         rendition_1080_key = f"{uid}/videos/renditions/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}_1080p.mp4"
         rendition_1080.seek(0)
+        derived_bytes += rendition_1080.getbuffer().nbytes
         s3_utils.upload_fileobj(rendition_1080, rendition_1080_key, 'video/mp4')
         url_1080 = rendition_1080_key
 
@@ -420,10 +409,18 @@ def upload_video(
         main_thumbnail_id=thumb_obj.id if thumb_obj else None,
         url_1080=url_1080,
         url_720=url_720,
-        url_480=url_480
+        url_480=url_480,
+        storyboard=storyboard_index
     )
+    crud.add_derived_size(db, media, derived_bytes)
+
+    return ORJSONResponse(serializers.media_summary(media))
 
-    return media
+
+def _audio_matches(candidates, landmarks):
+    """[(media_id, score)] of candidates aligned with `landmarks` well enough to be the same track, best first."""
+    scores = audio_processing.match_fingerprint(landmarks, candidates)
+    return sorted(((m, sc) for m, sc in scores.items() if sc >= FINGERPRINT_MIN_MATCHES), key=lambda x: -x[1])
 
 
 @router.post('/media/upload/audio', response_model=schemas.MediaOut)
@@ -432,9 +429,17 @@ def upload_audio(
     genero: str = Form(None),
     tags: str = Form(None),  # Comma-separated tags
     file: UploadFile = File(...),
+    idempotency_key: str | None = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    # retries carrying the same Idempotency-Key get the first response back;
+    # the fingerprint (which hashes the file) is only needed with a key
+    request_fingerprint = idempotency.fingerprint('audio', description, genero, tags, file) if idempotency_key else None
+    return idempotency.run(current_user.id, idempotency_key, request_fingerprint,
+                           lambda: _upload_audio(description, genero, tags, file, db, current_user))
+
+def _upload_audio(description, genero, tags, file: UploadFile, db: Session, current_user: models.User):
     # Validate file type
     mimetype = file.content_type or 'application/octet-stream'
     if not mimetype.startswith('audio/'):
@@ -446,6 +451,16 @@ def upload_audio(
     file.file.seek(0)
     file_bytes = file.file.read()
     size_bytes = len(file_bytes)
+    _ensure_quota(db, current_user, size_bytes)
+
+    # Acoustic fingerprint; with duplicate rejection on, refuse a track the user
+    # already has (any encode) before anything is stored
+    landmarks = audio_processing.compute_fingerprint(file_bytes)
+    if landmarks and AUDIO_REJECT_DUPLICATES:
+        matches = _audio_matches(crud.get_fingerprint_candidates(db, current_user.id, [h for h, _ in landmarks]), landmarks)
+        if matches:
+            media_id, score = matches[0]
+            raise HTTPException(status_code=409, detail={'message': 'Duplicate audio', 'media_id': media_id, 'score': score})
 
     # Use user id only as prefix: {id}/audios
     ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -462,7 +477,7 @@ def upload_audio(
 
     # Create media DB record
     meta = schemas.MediaCreate(description=description, is_public=False)
-    media = crud.create_media(db, current_user, safe_name, orig_key, mimetype, size_bytes, meta, media_type='audio')
+    media = _create_media(db, current_user, safe_name, orig_key, mimetype, size_bytes, meta, 'audio')
 
     # Associate tags if provided
     if tags:
@@ -470,9 +485,26 @@ def upload_audio(
         if tag_list:
             crud.associate_tags_to_media(db, media, tag_list)
 
+    if landmarks:
+        crud.create_audio_fingerprints(db, media, landmarks)
+
     # Extract audio metadata using audio_processing
     audio_metadata = audio_processing.extract_audio_metadata(file_bytes)
 
+    # Precompute waveform peaks so players can draw without downloading the audio
+    waveform_key = None
+    peaks = audio_processing.compute_waveform_peaks(
+        file_bytes,
+        duration_seconds=audio_metadata.get('duration_seconds'),
+        sample_rate=audio_metadata.get('sample_rate'),
+    )
+    derived_bytes = 0
+    if peaks:
+        waveform_key = f"{uid}/audios/waveforms/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}.json"
+        waveform_json = orjson.dumps(peaks)
+        derived_bytes += len(waveform_json)
+        s3_utils.upload_fileobj(io.BytesIO(waveform_json), waveform_key, 'application/json')
+
     # Create audio metadata with extracted information
     crud.create_audio_metadata(
         db, 
@@ -481,13 +513,24 @@ def upload_audio(
         bitrate=audio_metadata.get('bitrate'),
         sample_rate=audio_metadata.get('sample_rate'),
         channels=audio_metadata.get('channels'),
-        genero=genero
+        genero=genero,
+        waveform_key=waveform_key
     )
 
-    return media
+    # Streaming renditions (Opus/AAC ladder, loudness-normalized, one ffmpeg pass)
+    for rendition in audio_processing.generate_audio_renditions(file_bytes, source_bitrate=audio_metadata.get('bitrate')):
+        rendition_key = f"{uid}/audios/renditions/{ts}_{uuid.uuid4().hex}_{safe_name.rsplit('.',1)[0]}_{rendition['codec']}_{rendition['bitrate'] // 1000}k.{rendition['extension']}"
+        rendition_size = rendition['data'].getbuffer().nbytes
+        s3_utils.upload_fileobj(rendition['data'], rendition_key, rendition['mimetype'])
+        crud.create_audio_rendition(db, media, rendition['codec'], rendition['bitrate'], rendition['mimetype'], rendition_size, rendition_key)
+        derived_bytes += rendition_size
+    # counted toward the user's storage quota
+    crud.add_derived_size(db, media, derived_bytes)
 
-@router.get('/media/')
-def list_media(q: str | None = Query(None), limit: int = 50, offset: int = 0, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+    return ORJSONResponse(serializers.media_summary(media))
+
+@router.get('/media/', response_model=List[schemas.MediaListItem])
+async def list_media(request: Request, q: str | None = Query(None), limit: int = 50, offset: int = 0, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
     """Return the current user's media in a simplified JSON format with thumbnail URLs.
 
     Format per item:
@@ -499,42 +542,57 @@ def list_media(q: str | None = Query(None), limit: int = 50, offset: int = 0, db
       "created_at": "YYYY-MM-DDTHH:MM:SS"
     }
     """
-    medias = crud.list_media(db, current_user.id, q=q, limit=limit, offset=offset)
-    result = []
-    for m in medias:
-        # get thumbnail key if any
-        thumb_key = crud.get_listing_thumbnail_key(db, m.id)
-        thumb_url = None
-        if thumb_key:
-            thumb_url = s3_utils.generate_presigned_url(thumb_key)
-
-        item = {
-            "id": m.id,
-            "filename": m.filename,
-            "size": m.size,
-            "mimetype": m.mimetype,
-            "thumbnail": thumb_url,
-            "created_at": m.created_at.isoformat() if m.created_at else None,
-        }
-        result.append(item)
-    return result
+    # cached pages are served without touching the database
+    slot = await response_cache.lookup('list', current_user.id, (q, limit, offset))
+    if slot.entry:
+        return slot.respond(request)
+    medias = await crud_async.list_media(db, current_user.id, q=q, limit=limit, offset=offset)
+    # the page's (id, version) pairs decide the ETag; skip thumbnails and signing on a match
+    etag = etags.listing_etag(current_user.id, (q, limit, offset), [(m.id, m.version) for m in medias])
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    # listing thumbnails for the whole page in a single query
+    thumb_keys = await crud_async.get_listing_thumbnail_keys(db, [m.id for m in medias])
+    return await slot.store(etags.tagged(ORJSONResponse(serializers.media_list(medias, thumb_keys)), etag))
+
+@router.get('/media/export.zip')
+async def export_media(q: str | None = Query(None), type: Literal['image', 'video', 'audio', 'other'] | None = Query(None),
+                       tag: str | None = Query(None), created_after: datetime | None = Query(None), created_before: datetime | None = Query(None),
+                       current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    """Download the user's media (optionally filtered) as one ZIP, streamed as it is built."""
+    archive = media_export.export_archive(current_user.id, q=q, media_type=type, tag=tag,
+                                          created_after=created_after, created_before=created_before)
+    filename = f"media-export-{datetime.utcnow():%Y%m%d}.zip"
+    return StreamingResponse(archive, media_type='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'private, no-store',
+    })
 
 @router.get('/media/{media_id}', response_model=schemas.MediaOut)
-def get_media(media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    media = crud.get_media(db, media_id)
+async def get_media(media_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    slot = await response_cache.lookup('summary', current_user.id, (media_id,))
+    if slot.entry:
+        return slot.respond(request)
+    media = await crud_async.get_media(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail='Media not found')
     # ensure the current user owns this media
     if media.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail='Not authorized')
-    return media
+    etag = etags.media_etag('summary', media.id, media.version)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    return await slot.store(etags.tagged(ORJSONResponse(serializers.media_summary(media)), etag))
 
 
 
 
 @router.get('/media/image/{media_id}', response_model=schemas.ImageOut)
-def get_image(media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    media = crud.get_media(db, media_id)
+async def get_image(media_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    slot = await response_cache.lookup('image', current_user.id, (media_id,))
+    if slot.entry:
+        return slot.respond(request)
+    media = await crud_async.get_media(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail='Media not found')
     if media.owner_id != current_user.id:
@@ -543,36 +601,20 @@ def get_image(media_id: int, db: Session = Depends(get_db), current_user: models
     if not (media.mimetype and media.mimetype.startswith('image/')) and media.media_type != 'image':
         raise HTTPException(status_code=400, detail='Media is not an image')
 
-    img_md = getattr(media, 'image_metadata', None)
-    try:
-        url = s3_utils.generate_presigned_url(media.s3_key)
-    except Exception:
-        url = None
-
-    tags = [t.name for t in (media.tags or [])]
-
-    resp = {
-        'id': media.id,
-        'description': media.description,
-        'filename': media.filename,
-        'mimetype': media.mimetype,
-        'size': media.size,
-        'created_at': media.created_at.isoformat() if media.created_at else None,
-        'width': getattr(img_md, 'width', None) if img_md else None,
-        'height': getattr(img_md, 'height', None) if img_md else None,
-        'color_depth': getattr(img_md, 'color_depth', None) if img_md else None,
-        'dpi_x': getattr(img_md, 'dpi_x', None) if img_md else None,
-        'dpi_y': getattr(img_md, 'dpi_y', None) if img_md else None,
-        'exif': getattr(img_md, 'exif', None) if img_md else None,
-        'url': url,
-        'tags': tags,
-    }
-    return resp
+    # answer revalidations from the bare row, before loading relationships
+    etag = etags.media_etag('image', media.id, media.version)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    await crud_async.load_media_details(db, media, 'image_metadata')
+    return await slot.store(etags.tagged(ORJSONResponse(serializers.image_detail(media)), etag))
 
 
 @router.get('/media/video/{media_id}', response_model=schemas.VideoOut)
-def get_video(media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    media = crud.get_media(db, media_id)
+async def get_video(media_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    slot = await response_cache.lookup('video', current_user.id, (media_id,))
+    if slot.entry:
+        return slot.respond(request)
+    media = await crud_async.get_media(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail='Media not found')
     if media.owner_id != current_user.id:
@@ -580,59 +622,32 @@ def get_video(media_id: int, db: Session = Depends(get_db), current_user: models
     if not (media.mimetype and media.mimetype.startswith('video/')) and media.media_type != 'video':
         raise HTTPException(status_code=400, detail='Media is not a video')
 
-    vid_md = getattr(media, 'video_metadata', None)
-    tags = [t.name for t in (media.tags or [])]
-    genero = getattr(vid_md, 'genero', None) if vid_md else None
+    # answer revalidations from the bare row, before loading relationships
+    etag = etags.media_etag('video', media.id, media.version)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    await crud_async.load_media_details(db, media, 'video_metadata')
+    return await slot.store(etags.tagged(ORJSONResponse(serializers.video_detail(media)), etag))
 
-    # Get S3 keys from video_metadata columns and generate presigned URLs
-    s3_key_1080 = getattr(vid_md, 'url_1080', None) if vid_md else None
-    s3_key_720 = getattr(vid_md, 'url_720', None) if vid_md else None
-    s3_key_480 = getattr(vid_md, 'url_480', None) if vid_md else None
 
-    # Generate presigned URLs for each rendition
-    url_1080 = None
-    url_720 = None
-    url_480 = None
-    
-    if s3_key_1080:
-        try:
-            url_1080 = s3_utils.generate_presigned_url(s3_key_1080)
-        except Exception:
-            url_1080 = None
-    
-    if s3_key_720:
-        try:
-            url_720 = s3_utils.generate_presigned_url(s3_key_720)
-        except Exception:
-            url_720 = None
-    
-    if s3_key_480:
-        try:
-            url_480 = s3_utils.generate_presigned_url(s3_key_480)
-        except Exception:
-            url_480 = None
-
-    resp = {
-        'id': media.id,
-        'description': media.description,
-        'filename': media.filename,
-        'mimetype': media.mimetype,
-        'size': media.size,
-        'created_at': media.created_at.isoformat() if media.created_at else None,
-        'duration_seconds': float(getattr(vid_md, 'duration_seconds')) if vid_md and getattr(vid_md, 'duration_seconds') is not None else None,
-        'width': getattr(vid_md, 'width', None) if vid_md else None,
-        'height': getattr(vid_md, 'height', None) if vid_md else None,
-        'frame_rate': float(getattr(vid_md, 'frame_rate')) if vid_md and getattr(vid_md, 'frame_rate') is not None else None,
-        'video_codec': getattr(vid_md, 'video_codec', None) if vid_md else None,
-        'audio_codec': getattr(vid_md, 'audio_codec', None) if vid_md else None,
-        'bitrate': getattr(vid_md, 'bitrate', None) if vid_md else None,
-        'tags': tags,
-        'genero': genero,
-        'url_1080': url_1080,
-        'url_720': url_720,
-        'url_480': url_480,
-    }
-    return resp
+@router.get('/media/video/{media_id}/storyboard.vtt')
+async def get_video_storyboard(media_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    """WebVTT thumbnail track for players: one cue per storyboard frame, pointing at
+    a presigned sprite sheet with a `#xywh=` fragment."""
+    media = await crud_async.get_media(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail='Media not found')
+    if media.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail='Not authorized')
+
+    etag = etags.media_etag('storyboard', media.id, media.version)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    await db.refresh(media, attribute_names=['video_metadata'])
+    md = media.video_metadata
+    if md is None or not md.storyboard:
+        raise HTTPException(status_code=404, detail='Storyboard not available')
+    return etags.tagged(Response(serializers.storyboard_vtt(md.storyboard), media_type='text/vtt'), etag)
 
 
 @router.put('/media/video/{media_id}', response_model=schemas.VideoOut)
@@ -665,65 +680,15 @@ def update_video(
     # Refresh media to get updated relationships
     db.refresh(media)
 
-    # Build response similar to get_video
-    vid_md = getattr(media, 'video_metadata', None)
-    tags = [t.name for t in (media.tags or [])]
-    genero = getattr(vid_md, 'genero', None) if vid_md else None
-
-    # Get S3 keys from video_metadata columns and generate presigned URLs
-    s3_key_1080 = getattr(vid_md, 'url_1080', None) if vid_md else None
-    s3_key_720 = getattr(vid_md, 'url_720', None) if vid_md else None
-    s3_key_480 = getattr(vid_md, 'url_480', None) if vid_md else None
-
-    # Generate presigned URLs for each rendition
-    url_1080 = None
-    url_720 = None
-    url_480 = None
-    
-    if s3_key_1080:
-        try:
-            url_1080 = s3_utils.generate_presigned_url(s3_key_1080)
-        except Exception:
-            url_1080 = None
-    
-    if s3_key_720:
-        try:
-            url_720 = s3_utils.generate_presigned_url(s3_key_720)
-        except Exception:
-            url_720 = None
-    
-    if s3_key_480:
-        try:
-            url_480 = s3_utils.generate_presigned_url(s3_key_480)
-        except Exception:
-            url_480 = None
-
-    resp = {
-        'id': media.id,
-        'description': media.description,
-        'filename': media.filename,
-        'mimetype': media.mimetype,
-        'size': media.size,
-        'created_at': media.created_at.isoformat() if media.created_at else None,
-        'duration_seconds': float(getattr(vid_md, 'duration_seconds')) if vid_md and getattr(vid_md, 'duration_seconds') is not None else None,
-        'width': getattr(vid_md, 'width', None) if vid_md else None,
-        'height': getattr(vid_md, 'height', None) if vid_md else None,
-        'frame_rate': float(getattr(vid_md, 'frame_rate')) if vid_md and getattr(vid_md, 'frame_rate') is not None else None,
-        'video_codec': getattr(vid_md, 'video_codec', None) if vid_md else None,
-        'audio_codec': getattr(vid_md, 'audio_codec', None) if vid_md else None,
-        'bitrate': getattr(vid_md, 'bitrate', None) if vid_md else None,
-        'tags': tags,
-        'genero': genero,
-        'url_1080': url_1080,
-        'url_720': url_720,
-        'url_480': url_480,
-    }
-    return resp
+    return etags.tagged(ORJSONResponse(serializers.video_detail(media)), etags.media_etag('video', media.id, media.version))
 
 
 @router.get('/media/audio/{media_id}', response_model=schemas.AudioOut)
-def get_audio(media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    media = crud.get_media(db, media_id)
+async def get_audio(media_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    slot = await response_cache.lookup('audio', current_user.id, (media_id,))
+    if slot.entry:
+        return slot.respond(request)
+    media = await crud_async.get_media(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail='Media not found')
     if media.owner_id != current_user.id:
@@ -731,30 +696,29 @@ def get_audio(media_id: int, db: Session = Depends(get_db), current_user: models
     if not (media.mimetype and media.mimetype.startswith('audio/')) and media.media_type != 'audio':
         raise HTTPException(status_code=400, detail='Media is not an audio')
 
-    aud_md = getattr(media, 'audio_metadata', None)
-    tags = [t.name for t in (media.tags or [])]
-    genero = getattr(aud_md, 'genero', None) if aud_md else None
-    try:
-        url = s3_utils.generate_presigned_url(media.s3_key)
-    except Exception:
-        url = None
-
-    resp = {
-        'id': media.id,
-        'description': media.description,
-        'filename': media.filename,
-        'mimetype': media.mimetype,
-        'size': media.size,
-        'created_at': media.created_at.isoformat() if media.created_at else None,
-        'duration_seconds': float(getattr(aud_md, 'duration_seconds')) if aud_md and getattr(aud_md, 'duration_seconds') is not None else None,
-        'bitrate': getattr(aud_md, 'bitrate', None) if aud_md else None,
-        'sample_rate': getattr(aud_md, 'sample_rate', None) if aud_md else None,
-        'channels': getattr(aud_md, 'channels', None) if aud_md else None,
-        'tags': tags,
-        'genero': genero,
-        'url': url,
-    }
-    return resp
+    # answer revalidations from the bare row, before loading relationships
+    etag = etags.media_etag('audio', media.id, media.version)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    await crud_async.load_media_details(db, media, 'audio_metadata', 'audio_renditions')
+    return await slot.store(etags.tagged(ORJSONResponse(serializers.audio_detail(media)), etag))
+
+
+@router.get('/media/audio/{media_id}/matches', response_model=List[schemas.AudioMatch])
+async def audio_matches(media_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    """The current user's other uploads of the same recording (any codec or bitrate), best match first."""
+    media = await crud_async.get_media(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail='Media not found')
+    if media.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail='Not authorized')
+    landmarks = await crud_async.get_audio_fingerprint(db, media_id)
+    if not landmarks:
+        raise HTTPException(status_code=404, detail='Audio has no fingerprint')
+    candidates = await crud_async.get_fingerprint_candidates(db, current_user.id, [h for h, _ in landmarks], exclude_media_id=media_id)
+    matches = _audio_matches(candidates, landmarks)
+    medias = await crud_async.get_media_by_ids(db, [m for m, _ in matches])
+    return ORJSONResponse(serializers.audio_matches(matches, medias))
 
 
 @router.put('/media/audio/{media_id}', response_model=schemas.AudioOut)
@@ -787,35 +751,11 @@ def update_audio(
     # Refresh media to get updated relationships
     db.refresh(media)
 
-    # Build response similar to get_audio
-    aud_md = getattr(media, 'audio_metadata', None)
-    tags = [t.name for t in (media.tags or [])]
-    genero = getattr(aud_md, 'genero', None) if aud_md else None
-    try:
-        url = s3_utils.generate_presigned_url(media.s3_key)
-    except Exception:
-        url = None
-
-    resp = {
-        'id': media.id,
-        'description': media.description,
-        'filename': media.filename,
-        'mimetype': media.mimetype,
-        'size': media.size,
-        'created_at': media.created_at.isoformat() if media.created_at else None,
-        'duration_seconds': float(getattr(aud_md, 'duration_seconds')) if aud_md and getattr(aud_md, 'duration_seconds') is not None else None,
-        'bitrate': getattr(aud_md, 'bitrate', None) if aud_md else None,
-        'sample_rate': getattr(aud_md, 'sample_rate', None) if aud_md else None,
-        'channels': getattr(aud_md, 'channels', None) if aud_md else None,
-        'tags': tags,
-        'genero': genero,
-        'url': url,
-    }
-    return resp
+    return etags.tagged(ORJSONResponse(serializers.audio_detail(media)), etags.media_etag('audio', media.id, media.version))
 
 @router.get('/media/{media_id}/url')
-def media_presigned_url(media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    media = crud.get_media(db, media_id)
+async def media_presigned_url(media_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    media = await crud_async.get_media(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail='Media not found')
     # ensure only the owner can get a presigned URL
@@ -826,13 +766,41 @@ def media_presigned_url(media_id: int, db: Session = Depends(get_db), current_us
         raise HTTPException(status_code=500, detail='Could not generate URL')
     return {"url": url}
 
+@router.get('/media/{media_id}/content')
+async def media_content(media_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user_cached)):
+    """Stream the original file through the API (Range/If-Range aware), for clients
+    that cannot use presigned S3 URLs."""
+    media = await crud_async.get_media(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail='Media not found')
+    if media.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail='Not authorized')
+    return await content_proxy.stream_object(request, media.s3_key, media.size or 0, media.mimetype, media.upload_at)
+
+def _delete_media(db: Session, current_user: models.User, media_ids: List[int], background_tasks: BackgroundTasks) -> List[int]:
+    # Hide the rows now; S3 objects and rows are purged after the response is sent
+    deleted = crud.soft_delete_media(db, current_user.id, media_ids)
+    if deleted and current_user.avatar_s3_key:
+        keys = crud.media_object_keys(db, deleted)
+        crud.clear_avatar_if_deleted(db, current_user, [k for ks in keys.values() for k in ks])
+    if deleted:
+        background_tasks.add_task(media_cleanup.purge_media, deleted)
+    return deleted
+
+@router.post('/media/delete', response_model=schemas.MediaBulkDeleteOut, status_code=202)
+def delete_media_bulk(payload: schemas.MediaBulkDelete, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+    """Delete up to 1000 of the user's media at once; ids that are not theirs are reported as not found."""
+    requested = list(dict.fromkeys(payload.ids))
+    deleted = _delete_media(db, current_user, requested, background_tasks)
+    gone = set(deleted)
+    return {"deleted": deleted, "not_found": [i for i in requested if i not in gone]}
+
 @router.delete('/media/{media_id}')
-def delete_media(media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+def delete_media(media_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     media = crud.get_media(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail='Media not found')
     if media.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail='Not authorized')
-    s3_utils.delete_object(media.s3_key)
-    crud.delete_media(db, media)
+    _delete_media(db, current_user, [media_id], background_tasks)
     return {"ok": True}
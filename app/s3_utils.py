@@ -1,27 +1,87 @@
+import time
 import boto3
-from .config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME
-from botocore.exceptions import ClientError
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional
+from .config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME, S3_ENDPOINT_URL
+from botocore.exceptions import BotoCoreError, ClientError
+from . import metrics
 
+@lru_cache(maxsize=1)
 def get_s3_client():
+    # boto3 clients are thread-safe and costly to build; share one per process
     return boto3.client(
         "s3",
         aws_access_key_id=AWS_ACCESS_KEY_ID,
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
+        region_name=AWS_REGION,
+        endpoint_url=S3_ENDPOINT_URL,
     )
 
 def upload_fileobj(fileobj, key, content_type):
     s3 = get_s3_client()
-    s3.upload_fileobj(fileobj, S3_BUCKET_NAME, key, ExtraArgs={"ContentType": content_type})
+    with metrics.stage('s3_upload'):
+        s3.upload_fileobj(fileobj, S3_BUCKET_NAME, key, ExtraArgs={"ContentType": content_type})
 
 def generate_presigned_url(key, expires_in=3600):
     s3 = get_s3_client()
     try:
-        url = s3.generate_presigned_url('get_object', Params={'Bucket': S3_BUCKET_NAME, 'Key': key}, ExpiresIn=expires_in)
+        with metrics.stage('s3_presign'):
+            url = s3.generate_presigned_url('get_object', Params={'Bucket': S3_BUCKET_NAME, 'Key': key}, ExpiresIn=expires_in)
         return url
     except ClientError:
         return None
 
+def download_bytes(key) -> Optional[bytes]:
+    """Whole object as bytes, or None when it does not exist."""
+    s3 = get_s3_client()
+    try:
+        with metrics.stage('s3_download'):
+            return s3.get_object(Bucket=S3_BUCKET_NAME, Key=key)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+
 def delete_object(key):
     s3 = get_s3_client()
-    s3.delete_object(Bucket=S3_BUCKET_NAME, Key=key)
+    with metrics.stage('s3_delete'):
+        s3.delete_object(Bucket=S3_BUCKET_NAME, Key=key)
+
+def iter_objects(prefix: str = '', page_size: int = 1000) -> Iterator[dict]:
+    """Stream the bucket listing (dicts with Key, Size, LastModified), one page in memory at a time.
+
+    General purpose buckets list keys in ascending UTF-8 binary order.
+    """
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix, PaginationConfig={'PageSize': page_size}):
+        yield from page.get('Contents', [])
+
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+def delete_objects(keys: Iterable[str], retries: int = 3, backoff: float = 0.5) -> List[str]:
+    """Delete `keys` with batched DeleteObjects calls, retrying failed keys.
+
+    Returns the keys that could not be deleted after `retries` attempts.
+    Missing keys count as deleted.
+    """
+    s3 = get_s3_client()
+    keys = list(dict.fromkeys(k for k in keys if k))
+    failed: List[str] = []
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        pending = keys[i:i + DELETE_BATCH_SIZE]
+        for attempt in range(retries):
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                with metrics.stage('s3_delete_batch'):
+                    resp = s3.delete_objects(
+                        Bucket=S3_BUCKET_NAME,
+                        Delete={'Objects': [{'Key': k} for k in pending], 'Quiet': True},
+                    )
+            except (ClientError, BotoCoreError):
+                continue
+            # Quiet mode only reports failures
+            pending = [e['Key'] for e in resp.get('Errors', [])]
+            if not pending:
+                break
+        failed.extend(pending)
+    return failed
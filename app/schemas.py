@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional
 from datetime import datetime
 
@@ -7,7 +7,9 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 class TokenData(BaseModel):
+    user_id: Optional[int] = None
     email: Optional[str] = None
+    token_version: int = 0
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -24,8 +26,30 @@ class UserOut(BaseModel):
     created_at: datetime
     avatar_url: Optional[str] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class AuthenticatedUser(BaseModel):
+    """Detached snapshot of the token owner, safe to keep in the user cache."""
+    id: int
+    email: EmailStr
+    full_name: Optional[str]
+    username: Optional[str]
+    bio: Optional[str]
+    is_active: bool
+    created_at: datetime
+    avatar_s3_key: Optional[str] = None
+    token_version: int = 0
+
+    model_config = ConfigDict(from_attributes=True)
+
+class TypeUsage(BaseModel):
+    bytes: int
+    count: int
+
+class StorageUsage(BaseModel):
+    used_bytes: int
+    quota_bytes: Optional[int]  # None when unlimited
+    by_type: dict[str, TypeUsage]
 
 class UserUpdate(BaseModel):
     full_name: Optional[str] = None
@@ -70,6 +94,13 @@ class AudioUpdate(BaseModel):
     genero: Optional[str] = None
     tags: Optional[list[str]] = None
 
+class MediaBulkDelete(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=1000)
+
+class MediaBulkDeleteOut(BaseModel):
+    deleted: list[int]
+    not_found: list[int]  # missing, already deleted or owned by someone else
+
 class MediaOut(BaseModel):
     id: int
     description: Optional[str]
@@ -80,8 +111,24 @@ class MediaOut(BaseModel):
     owner_id: Optional[int]
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class MediaListItem(BaseModel):
+    id: int
+    filename: str
+    size: Optional[int]
+    mimetype: Optional[str]
+    thumbnail: Optional[str]
+    created_at: Optional[datetime]
+
+
+class SimilarImage(BaseModel):
+    id: int
+    filename: str
+    distance: int  # Hamming distance between perceptual hashes (0-64)
+    thumbnail: Optional[str]
+    created_at: Optional[datetime]
 
 
 class ImageOut(BaseModel):
@@ -100,8 +147,19 @@ class ImageOut(BaseModel):
     url: Optional[str]
     tags: Optional[list]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class Storyboard(BaseModel):
+    """Scrubbing previews: frame `i` is tile `i % (columns * rows)` of sheet `i // (columns * rows)`,
+    shown from `i * interval` seconds."""
+    sheets: list[Optional[str]]
+    interval: float
+    frames: int
+    columns: int
+    rows: int
+    tile_width: int
+    tile_height: int
 
 
 class VideoOut(BaseModel):
@@ -123,9 +181,24 @@ class VideoOut(BaseModel):
     url_1080: Optional[str]
     url_720: Optional[str]
     url_480: Optional[str]
+    storyboard: Optional[Storyboard] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
 
-    class Config:
-        orm_mode = True
+class AudioMatch(BaseModel):
+    id: int
+    filename: str
+    score: int  # fingerprint hashes aligned at the same time offset
+    created_at: Optional[datetime]
+
+
+class AudioRenditionOut(BaseModel):
+    codec: str
+    bitrate: Optional[int]
+    mimetype: Optional[str]
+    size: Optional[int]
+    url: Optional[str]
 
 
 class AudioOut(BaseModel):
@@ -142,6 +215,9 @@ class AudioOut(BaseModel):
     tags: Optional[list]
     genero: Optional[str]
     url: Optional[str]
+    # presigned URL of the waveform peaks JSON (min/max pairs per zoom level)
+    waveform_url: Optional[str] = None
+    # loudness-normalized streaming versions, smallest bitrate first
+    renditions: list[AudioRenditionOut] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,150 @@
+"""Response builders shared by the user and media endpoints.
+
+Each builder reads the ORM row (and its type-specific metadata) once and
+returns a plain dict shaped like the matching schema in `schemas`. Handlers wrap
+the result in ``ORJSONResponse`` and return it directly, so FastAPI does not
+validate and re-serialize it against the route's ``response_model`` (which
+stays on the route for the OpenAPI docs).
+"""
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from . import s3_utils, schemas
+
+_MEDIA_FIELDS = ('id', 'description', 'filename', 'mimetype', 'size', 'created_at')
+_IMAGE_FIELDS = ('width', 'height', 'color_depth', 'dpi_x', 'dpi_y', 'exif')
+_VIDEO_FIELDS = ('duration_seconds', 'width', 'height', 'frame_rate', 'video_codec', 'audio_codec', 'bitrate', 'genero')
+_AUDIO_FIELDS = ('duration_seconds', 'bitrate', 'sample_rate', 'channels', 'genero')
+_RENDITIONS = ('url_1080', 'url_720', 'url_480')
+
+
+def presigned_url(key: Optional[str]) -> Optional[str]:
+    """Presigned GET URL for `key`, or None when there is no key or signing fails."""
+    if not key:
+        return None
+    try:
+        return s3_utils.generate_presigned_url(key)
+    except Exception:
+        return None
+
+
+def _detail(media, md, fields: Sequence[str]) -> Dict:
+    out = {name: getattr(media, name) for name in _MEDIA_FIELDS}
+    if md is None:
+        out.update(dict.fromkeys(fields))
+    else:
+        for name in fields:
+            value = getattr(md, name)
+            # Numeric columns come back as Decimal, which JSON encoders reject
+            out[name] = float(value) if isinstance(value, Decimal) else value
+    out['tags'] = [t.name for t in media.tags]
+    return out
+
+
+def image_detail(media) -> Dict:
+    out = _detail(media, media.image_metadata, _IMAGE_FIELDS)
+    out['url'] = presigned_url(media.s3_key)
+    return out
+
+
+def video_detail(media) -> Dict:
+    md = media.video_metadata
+    out = _detail(media, md, _VIDEO_FIELDS)
+    # the url_* columns hold S3 keys; expose presigned URLs
+    for name in _RENDITIONS:
+        out[name] = presigned_url(getattr(md, name)) if md is not None else None
+    out['storyboard'] = storyboard(md.storyboard) if md is not None and md.storyboard else None
+    return out
+
+
+def storyboard(index: Dict) -> Dict:
+    """Stored storyboard index with its sheet keys replaced by presigned URLs."""
+    return {**index, 'sheets': [presigned_url(key) for key in index['sheets']]}
+
+
+def _vtt_time(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    return f"{hours:02d}:{minutes:02d}:{millis // 1000:02d}.{millis % 1000:03d}"
+
+
+def storyboard_vtt(index: Dict) -> str:
+    """WebVTT thumbnail track: one cue per frame, `<sheet url>#xywh=x,y,w,h`."""
+    urls = [presigned_url(key) for key in index['sheets']]
+    per_sheet = index['columns'] * index['rows']
+    width, height, interval = index['tile_width'], index['tile_height'], index['interval']
+    lines = ['WEBVTT', '']
+    for i in range(index['frames']):
+        sheet, tile = divmod(i, per_sheet)
+        row, column = divmod(tile, index['columns'])
+        lines.append(f"{_vtt_time(i * interval)} --> {_vtt_time((i + 1) * interval)}")
+        lines.append(f"{urls[sheet]}#xywh={column * width},{row * height},{width},{height}")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def audio_detail(media) -> Dict:
+    md = media.audio_metadata
+    out = _detail(media, md, _AUDIO_FIELDS)
+    out['url'] = presigned_url(media.s3_key)
+    out['waveform_url'] = presigned_url(md.waveform_key) if md is not None else None
+    out['renditions'] = [
+        {'codec': r.codec, 'bitrate': r.bitrate, 'mimetype': r.mimetype, 'size': r.size, 'url': presigned_url(r.s3_key)}
+        for r in sorted(media.audio_renditions, key=lambda r: r.bitrate or 0)
+    ]
+    return out
+
+
+def media_summary(media) -> Dict:
+    return schemas.MediaOut.model_validate(media).model_dump()
+
+
+def media_list(medias: Iterable, thumb_keys: Dict[int, str]) -> List[Dict]:
+    return [
+        {
+            'id': m.id,
+            'filename': m.filename,
+            'size': m.size,
+            'mimetype': m.mimetype,
+            'thumbnail': presigned_url(thumb_keys.get(m.id)),
+            'created_at': m.created_at,
+        }
+        for m in medias
+    ]
+
+
+def similar_images(matches: Iterable, thumb_keys: Dict[int, str]) -> List[Dict]:
+    return [
+        {
+            'id': m.id,
+            'filename': m.filename,
+            'distance': distance,
+            'thumbnail': presigned_url(thumb_keys.get(m.id)),
+            'created_at': m.created_at,
+        }
+        for m, distance in matches
+    ]
+
+
+def audio_matches(matches: Iterable, medias: Dict[int, object]) -> List[Dict]:
+    return [
+        {'id': media_id, 'filename': medias[media_id].filename, 'score': score, 'created_at': medias[media_id].created_at}
+        for media_id, score in matches
+        if media_id in medias
+    ]
+
+
+def user_profile(user) -> Dict:
+    """`UserOut` for an ORM user or an `AuthenticatedUser` snapshot."""
+    out = schemas.UserOut.model_validate(user).model_dump()
+    out['avatar_url'] = presigned_url(user.avatar_s3_key)
+    return out
+
+
+def storage_usage(rows: Iterable, used: int, quota: Optional[int]) -> Dict:
+    return {
+        'used_bytes': used,
+        'quota_bytes': quota,
+        'by_type': {row.media_type: {'bytes': row.bytes, 'count': row.count} for row in rows},
+    }
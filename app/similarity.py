@@ -0,0 +1,52 @@
+"""Multi-index hashing over 64-bit perceptual hashes.
+
+Each hash is stored with its four 16-bit bands in indexed columns. Two hashes
+within Hamming distance `d` agree within `d // 4` bits on at least one band
+(pigeonhole), so a search looks up, per band, every value within that radius
+of the query's band: a few hundred indexed equality probes instead of a scan,
+followed by an exact distance check on the candidates.
+"""
+from itertools import combinations
+from typing import Dict, List
+
+BANDS = 4
+BAND_BITS = 16
+# Largest searchable distance: radius 2 per band, 137 probes per band
+MAX_DISTANCE = 11
+
+
+def to_signed(h: int) -> int:
+    """Unsigned 64-bit hash -> value for a signed BIGINT column."""
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def to_unsigned(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+def bands(h: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(h >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+def hash_columns(h: int) -> Dict[str, int]:
+    """Column values of `ImageMetadata` for hash `h` (phash and phash_b0..b3)."""
+    columns = {'phash': to_signed(h)}
+    columns.update({f'phash_b{i}': band for i, band in enumerate(bands(h))})
+    return columns
+
+
+def band_variants(band: int, radius: int) -> List[int]:
+    """Every 16-bit value within `radius` bit flips of `band`."""
+    variants = [band]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), r):
+            flipped = band
+            for p in positions:
+                flipped ^= 1 << p
+            variants.append(flipped)
+    return variants
+
+
+def hamming(a: int, b: int) -> int:
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
@@ -0,0 +1,159 @@
+"""Per-user storage usage and quotas.
+
+`user_usage` holds bytes and media counts per (user, media type). A media
+counts with ``size + derived_size`` (original plus thumbnails, renditions,
+storyboards and waveform). Counters move in the same transaction as the rows
+they describe:
+
+- media inserted or deleted through the ORM are picked up by a flush hook;
+- Core statements that bypass it (`crud.soft_delete_media`,
+  `crud.add_derived_size`) call `apply` themselves.
+
+Each change is an atomic ``bytes = bytes + delta`` upsert, so concurrent
+uploads never lose an update, and a quota check reads at most one row per
+media type. `crud.create_media` checks the quota and inserts the media while
+holding a lock on the owner's ``users`` row, so concurrent uploads of one user
+are checked one after the other and cannot overshoot together; derived files
+are counted afterwards and may take a user slightly past the quota. Soft-deleted media stop counting when they are marked, not when
+they are purged.
+
+``python -m app.usage`` recomputes the counters from the media table and fixes
+drift, in batches of users; run it periodically.
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import STORAGE_QUOTA_BYTES
+
+Deltas = Dict[Tuple[int, str], List[int]]
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, used: int, quota: int):
+        super().__init__(f"storage quota exceeded: {used} of {quota} bytes used")
+        self.used = used
+        self.quota = quota
+
+
+def effective_quota(quota_bytes: Optional[int]) -> Optional[int]:
+    """Quota in bytes for a user's `storage_quota_bytes`, or None when unlimited."""
+    quota = STORAGE_QUOTA_BYTES if quota_bytes is None else quota_bytes
+    return quota or None
+
+
+def footprint(size: Optional[int], derived_size: Optional[int]) -> int:
+    return (size or 0) + (derived_size or 0)
+
+
+def _upsert(conn, user_id: int, media_type: str, nbytes: int, count: int, absolute: bool = False) -> None:
+    table = models.UserUsage.__table__
+    values = dict(user_id=user_id, media_type=media_type, bytes=nbytes, count=count, updated_at=datetime.utcnow())
+    if conn.dialect.name in ('postgresql', 'sqlite'):
+        if conn.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(**values)
+        if absolute:
+            changes = {'bytes': stmt.excluded.bytes, 'count': stmt.excluded.count}
+        else:
+            changes = {'bytes': table.c.bytes + stmt.excluded.bytes, 'count': table.c.count + stmt.excluded.count}
+        conn.execute(stmt.on_conflict_do_update(index_elements=['user_id', 'media_type'],
+                                                set_={**changes, 'updated_at': stmt.excluded.updated_at}))
+        return
+    where = (table.c.user_id == user_id, table.c.media_type == media_type)
+    changes = {'bytes': nbytes, 'count': count} if absolute else {'bytes': table.c.bytes + nbytes, 'count': table.c.count + count}
+    if not conn.execute(update(table).where(*where).values(**changes, updated_at=values['updated_at'])).rowcount:
+        conn.execute(table.insert().values(**values))
+
+
+def apply(conn, deltas: Deltas) -> None:
+    """Add {(user_id, media_type): [bytes, count]} to the counters, in key order (no deadlocks)."""
+    for (user_id, media_type), (nbytes, count) in sorted(deltas.items()):
+        if user_id is not None and (nbytes or count):
+            _upsert(conn, user_id, media_type, nbytes, count)
+
+
+@event.listens_for(Session, "after_flush")
+def _count_media(session, flush_context):
+    deltas: Deltas = defaultdict(lambda: [0, 0])
+    for obj in session.new:
+        if isinstance(obj, models.Media) and obj.deleted_at is None:
+            entry = deltas[(obj.owner_id, obj.media_type)]
+            entry[0] += footprint(obj.size, obj.derived_size)
+            entry[1] += 1
+    for obj in session.deleted:
+        # soft-deleted media were already subtracted when they were marked
+        if isinstance(obj, models.Media) and obj.deleted_at is None:
+            entry = deltas[(obj.owner_id, obj.media_type)]
+            entry[0] -= footprint(obj.size, obj.derived_size)
+            entry[1] -= 1
+    if deltas:
+        apply(session.connection(), deltas)
+
+
+def repair(batch_size: int = 1000, dry_run: bool = False) -> int:
+    """Recompute every user's counters from the media table; returns how many rows drifted.
+
+    On Postgres each batch locks its usage rows first, so uploads and deletes
+    of those users wait for the batch instead of racing it.
+    """
+    from .database import SessionLocal
+
+    drifted = 0
+    after = 0
+    while True:
+        db = SessionLocal()
+        try:
+            user_ids = list(db.execute(
+                select(models.User.id).where(models.User.id > after).order_by(models.User.id).limit(batch_size)
+            ).scalars())
+            if not user_ids:
+                return drifted
+            after = user_ids[-1]
+            usage = models.UserUsage
+            stored = {
+                (row.user_id, row.media_type): (row.bytes, row.count)
+                for row in db.execute(select(usage).where(usage.user_id.in_(user_ids)).with_for_update()).scalars()
+            }
+            m = models.Media
+            actual = {
+                (owner_id, media_type): (int(nbytes or 0), count)
+                for owner_id, media_type, nbytes, count in db.execute(
+                    select(m.owner_id, m.media_type, func.sum(func.coalesce(m.size, 0) + m.derived_size), func.count())
+                    .where(m.owner_id.in_(user_ids), m.deleted_at.is_(None))
+                    .group_by(m.owner_id, m.media_type)
+                )
+            }
+            conn = db.connection()
+            for key in sorted(set(stored) | set(actual)):
+                expected = actual.get(key, (0, 0))
+                if stored.get(key, (0, 0)) != expected:
+                    drifted += 1
+                    print(f"user {key[0]} {key[1]}: stored {stored.get(key)} actual {expected}")
+                    if not dry_run:
+                        _upsert(conn, key[0], key[1], expected[0], expected[1], absolute=True)
+            db.commit()
+        finally:
+            db.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="users per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="report drift without fixing it")
+    args = parser.parse_args(argv)
+    drifted = repair(batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"{drifted} usage rows {'drifted' if args.dry_run else 'repaired'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
 import ffmpeg
+import glob
 import io
 import tempfile
 import os
+import numpy as np
 from typing import Dict, Optional, Tuple
 from PIL import Image
+from . import metrics
+from .config import VIDEO_THUMBNAIL_CANDIDATES, STORYBOARD_FRAMES, STORYBOARD_COLUMNS, STORYBOARD_ROWS, STORYBOARD_TILE_WIDTH
 
 
 def extract_video_metadata(video_bytes: bytes) -> Dict:
@@ -37,7 +41,8 @@ def extract_video_metadata(video_bytes: bytes) -> Dict:
         
         try:
             # Usar ffmpeg.probe para extrair metadados
-            probe = ffmpeg.probe(tmp_path)
+            with metrics.stage('video_probe', nbytes=len(video_bytes), ffmpeg=True):
+                probe = ffmpeg.probe(tmp_path)
             format_info = probe.get('format', {})
             streams = probe.get('streams', [])
             
@@ -82,56 +87,206 @@ def extract_video_metadata(video_bytes: bytes) -> Dict:
     return metadata
 
 
-def generate_video_thumbnail(video_bytes: bytes, timestamp: float = 1.0) -> Optional[io.BytesIO]:
-    """Gera uma thumbnail do vídeo no timestamp especificado.
-    
+def _score_frames(frames: np.ndarray) -> np.ndarray:
+    """Pontua quadros candidatos (array uint8 N x H x W em escala de cinza).
+
+    Combina nitidez (variância do Laplaciano), entropia do histograma e
+    contraste, normalizados entre os candidatos; quadros quase pretos ou quase
+    brancos (fades, telas de título) são descartados.
+    """
+    n = frames.shape[0]
+    gray = frames.astype(np.float32) / 255.0
+
+    brightness = gray.mean(axis=(1, 2))
+    contrast = gray.std(axis=(1, 2))
+
+    # Laplaciano 4-vizinhos sobre todos os quadros de uma vez
+    lap = (gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1] + gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:]
+           - 4.0 * gray[:, 1:-1, 1:-1])
+    sharpness = lap.var(axis=(1, 2))
+
+    # Histogramas de 256 níveis de todos os quadros num único bincount
+    offsets = (np.arange(n, dtype=np.int64) * 256)[:, None]
+    hist = np.bincount((frames.reshape(n, -1) + offsets).ravel(), minlength=n * 256).reshape(n, 256)
+    p = hist / hist.sum(axis=1, keepdims=True)
+    entropy = -(p * np.log2(np.where(p > 0, p, 1.0))).sum(axis=1)
+
+    def _norm(values: np.ndarray) -> np.ndarray:
+        top = values.max()
+        return values / top if top > 0 else np.zeros_like(values)
+
+    score = 0.5 * _norm(sharpness) + 0.3 * _norm(entropy) + 0.2 * _norm(contrast)
+    usable = (brightness > 0.08) & (brightness < 0.92)
+    # sem nenhum quadro utilizável, ainda assim escolhe o melhor disponível
+    return np.where(usable, score, score - 1.0)
+
+
+def generate_video_thumbnail(
+    video_bytes: bytes,
+    timestamp: Optional[float] = None,
+    candidates: int = VIDEO_THUMBNAIL_CANDIDATES,
+    duration_seconds: Optional[float] = None,
+) -> Optional[io.BytesIO]:
+    """Gera uma thumbnail representativa do vídeo.
+
+    Sem `timestamp`, decodifica apenas keyframes numa única passada do ffmpeg,
+    seleciona até `candidates` quadros espalhados pela duração e mantém o de
+    melhor pontuação (`_score_frames`). Com `timestamp`, captura o quadro
+    naquele segundo.
+
     Args:
         video_bytes: Bytes do vídeo
-        timestamp: Segundo do vídeo para capturar (padrão: 1.0)
-    
+        timestamp: Segundo do vídeo para capturar (opcional)
+        candidates: Número máximo de quadros candidatos
+        duration_seconds: Duração já conhecida; se None, é obtida com ffprobe
+
     Returns:
         BytesIO com a imagem JPEG da thumbnail, ou None em caso de erro
     """
+    tmp_dir = tempfile.mkdtemp(prefix='thumb_')
+    tmp_video_path = os.path.join(tmp_dir, 'input.mp4')
     try:
-        # Criar arquivo temporário para o vídeo
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_video:
-            tmp_video.write(video_bytes)
-            tmp_video_path = tmp_video.name
-        
-        # Criar arquivo temporário para a thumbnail
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_thumb:
-            tmp_thumb_path = tmp_thumb.name
-        
-        try:
-            # Usar ffmpeg para extrair frame e redimensionar
+        with open(tmp_video_path, 'wb') as f:
+            f.write(video_bytes)
+
+        with metrics.stage('video_thumbnail', nbytes=len(video_bytes), ffmpeg=True):
+            if timestamp is not None:
+                (
+                    ffmpeg
+                    .input(tmp_video_path, ss=timestamp)
+                    .filter('scale', 320, -1)
+                    .output(os.path.join(tmp_dir, 'cand_001.jpg'), vframes=1, loglevel="error")
+                    .overwrite_output()
+                    .run(capture_stdout=True, capture_stderr=True)
+                )
+            else:
+                if not duration_seconds:
+                    try:
+                        duration_seconds = float(ffmpeg.probe(tmp_video_path)['format']['duration'])
+                    except Exception:
+                        duration_seconds = 0.0
+                # Um keyframe a cada duração/candidatos segundos (o primeiro sempre),
+                # então clipes curtos ainda rendem ao menos um quadro
+                spacing = float(duration_seconds) / max(candidates, 1)
+                (
+                    ffmpeg
+                    .input(tmp_video_path, skip_frame='nokey')
+                    .filter('select', f'isnan(prev_selected_t)+gte(t-prev_selected_t,{spacing:.3f})')
+                    .filter('scale', 320, -1)
+                    .output(os.path.join(tmp_dir, 'cand_%03d.jpg'), vsync='vfr', vframes=candidates, **{'q:v': 2}, loglevel="error")
+                    .overwrite_output()
+                    .run(capture_stdout=True, capture_stderr=True)
+                )
+
+        paths = sorted(glob.glob(os.path.join(tmp_dir, 'cand_*.jpg')))
+        if not paths:
+            return None
+        best = paths[0]
+        if len(paths) > 1:
+            frames = np.stack([np.asarray(Image.open(path).convert('L')) for path in paths])
+            best = paths[int(np.argmax(_score_frames(frames)))]
+
+        with open(best, 'rb') as f:
+            thumb_io = io.BytesIO(f.read())
+        thumb_io.seek(0)
+        return thumb_io
+
+    except Exception as e:
+        print(f"Erro ao gerar thumbnail: {e}")
+        return None
+
+    finally:
+        # Remover arquivos temporários
+        for path in glob.glob(os.path.join(tmp_dir, '*')):
+            os.unlink(path)
+        os.rmdir(tmp_dir)
+
+
+def generate_storyboard(
+    video_bytes: bytes,
+    duration_seconds: Optional[float] = None,
+    frames: int = STORYBOARD_FRAMES,
+    columns: int = STORYBOARD_COLUMNS,
+    rows: int = STORYBOARD_ROWS,
+    tile_width: int = STORYBOARD_TILE_WIDTH,
+) -> Optional[Dict]:
+    """Gera o storyboard (sprite sheets) do vídeo para pré-visualização ao arrastar.
+
+    Extrai `frames` quadros igualmente espaçados numa única passada do ffmpeg
+    (filtros fps + scale + tile) e os organiza em folhas JPEG de
+    `columns` x `rows` miniaturas.
+
+    Args:
+        video_bytes: Bytes do vídeo
+        duration_seconds: Duração já conhecida; se None, é obtida com ffprobe
+
+    Returns:
+        Dict com as chaves:
+        - sheets: lista de BytesIO (JPEG), na ordem dos quadros
+        - interval: segundos entre quadros
+        - frames: número de quadros nas folhas
+        - columns, rows: grade de cada folha
+        - tile_width, tile_height: tamanho de cada miniatura em pixels
+        ou None em caso de erro
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='storyboard_')
+    tmp_video_path = os.path.join(tmp_dir, 'input.mp4')
+    try:
+        with open(tmp_video_path, 'wb') as f:
+            f.write(video_bytes)
+
+        with metrics.stage('video_storyboard', nbytes=len(video_bytes), ffmpeg=True):
+            if not duration_seconds:
+                duration_seconds = float(ffmpeg.probe(tmp_video_path)['format']['duration'])
+            duration_seconds = float(duration_seconds)
+            if duration_seconds <= 0 or frames <= 0:
+                return None
+            interval = duration_seconds / frames
+
+            # Um quadro a cada `interval` segundos, reduzido e montado em grade;
+            # cada folha completa (ou a última, parcial) vira um JPEG
             (
                 ffmpeg
-                .input(tmp_video_path, ss=timestamp)
-                .filter('scale', 320, -1)
-                .output(tmp_thumb_path, vframes=1, loglevel="error")
+                .input(tmp_video_path)
+                .filter('fps', fps=f'1/{interval:.6f}')
+                .filter('scale', tile_width, -2)
+                .filter('tile', f'{columns}x{rows}')
+                .output(os.path.join(tmp_dir, 'sheet_%03d.jpg'), vsync='vfr', **{'q:v': 5}, loglevel='error')
                 .overwrite_output()
                 .run(capture_stdout=True, capture_stderr=True)
             )
-            
-            # Ler a thumbnail gerada
-            with open(tmp_thumb_path, 'rb') as f:
-                thumb_bytes = f.read()
-            
-            thumb_io = io.BytesIO(thumb_bytes)
-            thumb_io.seek(0)
-            return thumb_io
-        
-        finally:
-            # Remover arquivos temporários
-            if os.path.exists(tmp_video_path):
-                os.unlink(tmp_video_path)
-            if os.path.exists(tmp_thumb_path):
-                os.unlink(tmp_thumb_path)
-    
+
+        sheet_paths = sorted(glob.glob(os.path.join(tmp_dir, 'sheet_*.jpg')))
+        if not sheet_paths:
+            return None
+
+        sheets = []
+        for path in sheet_paths:
+            with open(path, 'rb') as f:
+                sheets.append(io.BytesIO(f.read()))
+        sheet_width, sheet_height = Image.open(sheets[0]).size
+        sheets[0].seek(0)
+
+        return {
+            'sheets': sheets,
+            'interval': interval,
+            'frames': min(frames, len(sheets) * columns * rows),
+            'columns': columns,
+            'rows': rows,
+            'tile_width': sheet_width // columns,
+            'tile_height': sheet_height // rows,
+        }
+
     except Exception as e:
-        print(f"Erro ao gerar thumbnail: {e}")
+        print(f"Erro ao gerar storyboard: {e}")
         return None
 
+    finally:
+        # Remover arquivos temporários
+        for path in glob.glob(os.path.join(tmp_dir, '*')):
+            os.unlink(path)
+        os.rmdir(tmp_dir)
+
 
 def generate_video_rendition(video_bytes: bytes, target_height: int, bitrate: str = None) -> Optional[io.BytesIO]:
     """Gera uma versão do vídeo com a altura especificada.
@@ -164,47 +319,49 @@ def generate_video_rendition(video_bytes: bytes, target_height: int, bitrate: st
             tmp_output_path = tmp_output.name
         
         try:
-            # Verificar se o vídeo tem áudio usando ffmpeg.probe
-            probe = ffmpeg.probe(tmp_input_path)
-            has_audio = any(stream.get('codec_type') == 'audio' for stream in probe.get('streams', []))
+            with metrics.stage(f'rendition_{target_height}p', nbytes=len(video_bytes), ffmpeg=True):
+                # Verificar se o vídeo tem áudio usando ffmpeg.probe
+                probe = ffmpeg.probe(tmp_input_path)
+                has_audio = any(stream.get('codec_type') == 'audio' for stream in probe.get('streams', []))
             
-            # Usar ffmpeg para transcodificar
-            # Escala mantendo aspect ratio, ajusta bitrate e usa codec H.264
-            # Mapeia explicitamente os streams de vídeo e áudio para garantir que o áudio seja preservado
-            input_stream = ffmpeg.input(tmp_input_path)
+                # Usar ffmpeg para transcodificar
+                # Escala mantendo aspect ratio, ajusta bitrate e usa codec H.264
+                # Mapeia explicitamente os streams de vídeo e áudio para garantir que o áudio seja preservado
+                input_stream = ffmpeg.input(tmp_input_path)
             
-            # Aplicar filtro de escala apenas ao stream de vídeo
-            video_stream = input_stream['v'].filter('scale', -1, target_height)
+                # Aplicar filtro de escala apenas ao stream de vídeo
+                video_stream = input_stream['v'].filter('scale', -1, target_height)
             
-            # Configurar parâmetros de output
-            output_kwargs = {
-                'vcodec': 'libx264',
-                **{'b:v': bitrate},  # Bitrate de vídeo
-                'preset': 'medium',
-                'movflags': 'faststart',  # Otimiza para streaming
-                'loglevel': 'error'
-            }
+                # Configurar parâmetros de output
+                output_kwargs = {
+                    'vcodec': 'libx264',
+                    **{'b:v': bitrate},  # Bitrate de vídeo
+                    'preset': 'medium',
+                    'movflags': 'faststart',  # Otimiza para streaming
+                    'loglevel': 'error'
+                }
             
-            # Adicionar áudio apenas se existir no vídeo original
-            if has_audio:
-                audio_stream = input_stream['a']
-                output_kwargs['acodec'] = 'aac'
-                output_kwargs['b:a'] = '128k'
-                (
-                    ffmpeg
-                    .output(video_stream, audio_stream, tmp_output_path, **output_kwargs)
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
-            else:
-                # Vídeo sem áudio
-                (
-                    ffmpeg
-                    .output(video_stream, tmp_output_path, **output_kwargs)
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
+                # Adicionar áudio apenas se existir no vídeo original
+                if has_audio:
+                    audio_stream = input_stream['a']
+                    output_kwargs['acodec'] = 'aac'
+                    output_kwargs['b:a'] = '128k'
+                    (
+                        ffmpeg
+                        .output(video_stream, audio_stream, tmp_output_path, **output_kwargs)
+                        .overwrite_output()
+                        .run(capture_stdout=True, capture_stderr=True)
+                    )
+                else:
+                    # Vídeo sem áudio
+                    (
+                        ffmpeg
+                        .output(video_stream, tmp_output_path, **output_kwargs)
+                        .overwrite_output()
+                        .run(capture_stdout=True, capture_stderr=True)
+                    )
             
+
             # Ler o vídeo processado
             with open(tmp_output_path, 'rb') as f:
                 output_bytes = f.read()
@@ -0,0 +1,160 @@
+"""Incremental ZIP writer for archives streamed straight to the client.
+
+Entries are written with a data descriptor (general purpose flag bit 3): the
+local header goes out before the CRC is known, and CRC/sizes follow the data.
+ZIP64 records are used only where a size, offset or entry count overflows the
+classic 32/16-bit fields, so ordinary archives open everywhere. The writer
+keeps nothing but one small tuple per entry for the central directory.
+"""
+import struct
+import zlib
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+# Fields at or above these limits move to ZIP64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+_MAX32 = 0xFFFFFFFF
+_MAX16 = 0xFFFF
+
+STORED = 0
+DEFLATED = 8
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+# version made by / needed: 2.0 for deflate, 4.5 for ZIP64 (upper byte 3 = Unix)
+_VERSION_DEFAULT = 20
+_VERSION_ZIP64 = 45
+_VERSION_MADE_BY = (3 << 8) | _VERSION_ZIP64
+_FILE_MODE = (0o100644 << 16)
+
+
+class _Entry(NamedTuple):
+    name: bytes
+    method: int
+    dos_time: int
+    dos_date: int
+    crc: int
+    compressed_size: int
+    size: int
+    offset: int
+    zip64: bool
+
+
+def _dos_datetime(value: Optional[datetime]):
+    value = value or datetime(1980, 1, 1)
+    if value.year < 1980:
+        value = datetime(1980, 1, 1)
+    return (value.hour << 11) | (value.minute << 5) | (value.second // 2), ((value.year - 1980) << 9) | (value.month << 5) | value.day
+
+
+class ZipStream:
+    """Produces the bytes of a ZIP archive piece by piece::
+
+        zs = ZipStream()
+        yield zs.start_entry("a.jpg", size, mtime)
+        for chunk in data:
+            yield zs.write(chunk)
+        yield zs.end_entry()
+        yield zs.finish()
+
+    `size` is the exact uncompressed size; it only decides whether the entry
+    needs ZIP64 fields. Deflate only what cannot grow past 4 GiB compressed.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self._entries: List[_Entry] = []
+        self._current = None
+
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    def start_entry(self, name: str, size: int, modified: Optional[datetime] = None, method: int = STORED) -> bytes:
+        if self._current is not None:
+            raise RuntimeError("previous entry not finished")
+        encoded = name.encode("utf-8")
+        dos_time, dos_date = _dos_datetime(modified)
+        zip64 = size >= ZIP64_LIMIT or self.offset >= ZIP64_LIMIT
+        # sizes are zero here and come in the data descriptor; a ZIP64 entry
+        # announces itself with 0xFFFFFFFF and a zeroed ZIP64 extra field
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if zip64 else b""
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, _VERSION_ZIP64 if zip64 else _VERSION_DEFAULT,
+            _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8, method, dos_time, dos_date, 0,
+            _MAX32 if zip64 else 0, _MAX32 if zip64 else 0, len(encoded), len(extra),
+        )
+        self._current = {
+            "name": encoded, "method": method, "dos_time": dos_time, "dos_date": dos_date,
+            "offset": self.offset, "zip64": zip64, "crc": 0, "size": 0, "compressed_size": 0,
+            "compressor": zlib.compressobj(6, zlib.DEFLATED, -15) if method == DEFLATED else None,
+        }
+        return self._emit(header + encoded + extra)
+
+    def write(self, data: bytes) -> bytes:
+        entry = self._current
+        entry["crc"] = zlib.crc32(data, entry["crc"])
+        entry["size"] += len(data)
+        if entry["compressor"] is not None:
+            data = entry["compressor"].compress(data)
+        entry["compressed_size"] += len(data)
+        return self._emit(data)
+
+    def end_entry(self) -> bytes:
+        entry, self._current = self._current, None
+        tail = b""
+        if entry["compressor"] is not None:
+            tail = entry["compressor"].flush()
+            entry["compressed_size"] += len(tail)
+        if entry["zip64"]:
+            descriptor = struct.pack("<IIQQ", 0x08074B50, entry["crc"], entry["compressed_size"], entry["size"])
+        else:
+            if entry["size"] >= ZIP64_LIMIT or entry["compressed_size"] >= ZIP64_LIMIT:
+                raise ValueError("entry grew past its declared size")
+            descriptor = struct.pack("<IIII", 0x08074B50, entry["crc"], entry["compressed_size"], entry["size"])
+        self._entries.append(_Entry(
+            entry["name"], entry["method"], entry["dos_time"], entry["dos_date"], entry["crc"],
+            entry["compressed_size"], entry["size"], entry["offset"], entry["zip64"],
+        ))
+        return self._emit(tail + descriptor)
+
+    def finish(self) -> bytes:
+        """Central directory and end records."""
+        if self._current is not None:
+            raise RuntimeError("entry not finished")
+        start = self.offset
+        parts = []
+        for e in self._entries:
+            extra_values = []
+            size, compressed_size, offset = e.size, e.compressed_size, e.offset
+            if size >= ZIP64_LIMIT or e.zip64:
+                extra_values.append(size)
+                size = _MAX32
+            if compressed_size >= ZIP64_LIMIT or e.zip64:
+                extra_values.append(compressed_size)
+                compressed_size = _MAX32
+            if offset >= ZIP64_LIMIT:
+                extra_values.append(offset)
+                offset = _MAX32
+            extra = struct.pack(f"<HH{len(extra_values)}Q", 0x0001, 8 * len(extra_values), *extra_values) if extra_values else b""
+            parts.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, _VERSION_MADE_BY,
+                _VERSION_ZIP64 if extra_values else _VERSION_DEFAULT,
+                _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8, e.method, e.dos_time, e.dos_date, e.crc,
+                compressed_size, size, len(e.name), len(extra), 0, 0, 0, _FILE_MODE, offset,
+            ) + e.name + extra)
+        directory = b"".join(parts)
+        end = start + len(directory)
+        count = len(self._entries)
+        records = b""
+        zip64 = count >= ZIP64_COUNT_LIMIT or start >= ZIP64_LIMIT or len(directory) >= ZIP64_LIMIT
+        if zip64:
+            records += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, _VERSION_MADE_BY, _VERSION_ZIP64, 0, 0,
+                                   count, count, len(directory), start)
+            records += struct.pack("<IIQI", 0x07064B50, 0, end, 1)
+        records += struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, _MAX16 if zip64 else count, _MAX16 if zip64 else count,
+            _MAX32 if zip64 else len(directory), _MAX32 if zip64 else start, 0,
+        )
+        return self._emit(directory + records)
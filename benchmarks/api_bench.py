@@ -0,0 +1,309 @@
+"""End-to-end API benchmark.
+
+Drives the real FastAPI app in-process (starlette TestClient) through the
+upload, list, detail, update and delete endpoints and reports, per endpoint,
+p50/p95/p99 latency, throughput, SQL queries per request and allocations.
+
+Runs offline by default: S3 is replaced by moto and the database is a
+throwaway SQLite file. Point it at real services with --database-url and
+--s3-endpoint (e.g. a local Postgres and MinIO).
+
+    python -m benchmarks.api_bench run --iterations 50 --output base.json
+    python -m benchmarks.api_bench run --iterations 50 --output head.json
+    python -m benchmarks.api_bench compare base.json head.json
+"""
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from .stats import compare_results, load_results, print_table, run_metadata, save_results, summarize_latencies
+
+BENCH_BUCKET = "multimedia-bench"
+SECTION = "endpoints"
+
+
+def _prepare_environment(args) -> Optional[object]:
+    """Configure the app through its environment; must run before importing `app`."""
+    if not args.database_url:
+        workdir = tempfile.mkdtemp(prefix="api-bench-")
+        args.database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.setdefault("JWT_SECRET", "bench-secret")
+    os.environ["S3_BUCKET_NAME"] = args.bucket
+    # a cheap cost factor keeps register/login from dominating the run
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    if args.s3_endpoint:
+        os.environ["S3_ENDPOINT_URL"] = args.s3_endpoint
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "minioadmin")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "minioadmin")
+        return None
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ.pop("S3_ENDPOINT_URL", None)
+    try:
+        from moto import mock_aws
+    except ImportError:
+        sys.exit("moto is required for the offline S3 stand-in (pip install -r benchmarks/requirements.txt) or pass --s3-endpoint")
+    mock = mock_aws()
+    mock.start()
+    return mock
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.count += 1
+
+    def install(self, *engines) -> None:
+        from sqlalchemy import event
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self)
+
+
+# Synthetic payloads
+
+def _png_bytes(width: int, height: int) -> bytes:
+    import numpy as np
+    from PIL import Image
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    rgb = np.stack(np.broadcast_arrays(x[None, :], y[:, None], (x[None, :] // 2 + y[:, None] // 2)), axis=-1)
+    buf = io.BytesIO()
+    Image.fromarray(rgb.astype(np.uint8), "RGB").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _wav_bytes(seconds: float, sample_rate: int = 44100) -> bytes:
+    import numpy as np
+    import soundfile as sf
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    buf = io.BytesIO()
+    sf.write(buf, 0.3 * np.sin(2 * np.pi * 440 * t), sample_rate, format="WAV")
+    return buf.getvalue()
+
+
+def _mp4_bytes(seconds: float) -> bytes:
+    """Tiny test clip when ffmpeg is available; otherwise opaque bytes (processing then fails fast)."""
+    if shutil.which("ffmpeg"):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "clip.mp4")
+            subprocess.run(
+                ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc=duration={seconds}:size=640x360:rate=25",
+                 "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-shortest",
+                 "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-y", out],
+                check=True,
+            )
+            with open(out, "rb") as f:
+                return f.read()
+    return os.urandom(256 * 1024)
+
+
+# Benchmark
+
+class ApiBenchmark:
+    def __init__(self, client, counter: QueryCounter, trace_alloc: bool):
+        self.client = client
+        self.counter = counter
+        self.trace_alloc = trace_alloc
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, int] = defaultdict(int)
+        self.alloc_blocks: Dict[str, int] = defaultdict(int)
+        self.alloc_peak: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.headers: Dict[str, str] = {}
+
+    def measure(self, name: str, call: Callable):
+        queries_before = self.counter.count
+        blocks_before = sys.getallocatedblocks()
+        if self.trace_alloc:
+            tracemalloc.reset_peak()
+            traced_before, _ = tracemalloc.get_traced_memory()
+        started = time.perf_counter()
+        resp = call()
+        elapsed = time.perf_counter() - started
+        self.samples[name].append(elapsed)
+        self.queries[name] += self.counter.count - queries_before
+        self.alloc_blocks[name] += sys.getallocatedblocks() - blocks_before
+        if self.trace_alloc:
+            _, peak = tracemalloc.get_traced_memory()
+            self.alloc_peak[name] = max(self.alloc_peak[name], peak - traced_before)
+        if resp.status_code >= 400:
+            self.errors[name] += 1
+        return resp
+
+    def login(self) -> None:
+        creds = {"email": "bench@example.com", "password": "bench-password"}
+        self.client.post("/auth/register", json=creds)
+        resp = self.client.post("/auth/login", data={"username": creds["email"], "password": creds["password"]})
+        resp.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+    def upload(self, kind: str, filename: str, payload: bytes, mimetype: str) -> Optional[int]:
+        resp = self.measure(f"upload_{kind}", lambda: self.client.post(
+            f"/media/upload/{kind}",
+            headers=self.headers,
+            data={"description": f"bench {kind}", "tags": "bench,perf"},
+            files={"file": (filename, payload, mimetype)},
+        ))
+        return resp.json().get("id") if resp.status_code < 400 else None
+
+    def iteration(self, payloads: Dict[str, bytes], list_limit: int) -> None:
+        ids = {
+            "image": self.upload("image", "bench.png", payloads["image"], "image/png"),
+            "video": self.upload("video", "bench.mp4", payloads["video"], "video/mp4"),
+            "audio": self.upload("audio", "bench.wav", payloads["audio"], "audio/wav"),
+        }
+        self.measure("list", lambda: self.client.get(f"/media/?limit={list_limit}", headers=self.headers))
+        self.measure("list_search", lambda: self.client.get(f"/media/?q=bench&limit={list_limit}", headers=self.headers))
+        for kind, media_id in ids.items():
+            if media_id is None:
+                continue
+            self.measure("detail", lambda: self.client.get(f"/media/{media_id}", headers=self.headers))
+            self.measure(f"detail_{kind}", lambda: self.client.get(f"/media/{kind}/{media_id}", headers=self.headers))
+            self.measure(f"update_{kind}", lambda: self.client.put(
+                f"/media/{kind}/{media_id}", headers=self.headers,
+                json={"description": "updated", "tags": ["bench", "updated"]},
+            ))
+            self.measure("presigned_url", lambda: self.client.get(f"/media/{media_id}/url", headers=self.headers))
+        for media_id in ids.values():
+            if media_id is not None:
+                self.measure("delete", lambda: self.client.delete(f"/media/{media_id}", headers=self.headers))
+
+    def results(self) -> Dict[str, Dict]:
+        out = {}
+        for name, samples in self.samples.items():
+            n = len(samples)
+            entry = summarize_latencies(samples)
+            entry.update({
+                "errors": self.errors[name],
+                "throughput_rps": n / sum(samples) if sum(samples) else None,
+                "queries_per_req": self.queries[name] / n,
+                "alloc_blocks_per_req": self.alloc_blocks[name] / n,
+            })
+            if self.trace_alloc:
+                entry["alloc_peak_kib"] = self.alloc_peak[name] / 1024
+            out[name] = entry
+        return out
+
+
+def cmd_run(args) -> int:
+    mock = _prepare_environment(args)
+    try:
+        from fastapi.testclient import TestClient
+        from app import s3_utils
+        from app.database import engine, async_engine
+        from app.main import app
+
+        if mock is not None:
+            s3_utils.get_s3_client().create_bucket(Bucket=args.bucket)
+        counter = QueryCounter()
+        counter.install(engine, async_engine.sync_engine)
+        payloads = {
+            "image": _png_bytes(args.image_width, args.image_height),
+            "video": _mp4_bytes(args.video_seconds),
+            "audio": _wav_bytes(args.audio_seconds),
+        }
+        if args.trace_alloc:
+            tracemalloc.start()
+        with TestClient(app) as client:
+            bench = ApiBenchmark(client, counter, args.trace_alloc)
+            bench.login()
+            for _ in range(args.warmup):
+                bench.iteration(payloads, args.list_limit)
+            # discard warmup samples but keep the session
+            headers = bench.headers
+            bench = ApiBenchmark(client, counter, args.trace_alloc)
+            bench.headers = headers
+            started = time.perf_counter()
+            for _ in range(args.iterations):
+                bench.iteration(payloads, args.list_limit)
+            wall = time.perf_counter() - started
+        endpoints = bench.results()
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    total = sum(e["count"] for e in endpoints.values())
+    results = {
+        "meta": run_metadata(
+            benchmark="api",
+            iterations=args.iterations,
+            database_url=args.database_url.split("@")[-1],
+            s3="moto" if mock is not None else args.s3_endpoint,
+            ffmpeg=bool(shutil.which("ffmpeg")),
+            wall_seconds=wall,
+            overall_throughput_rps=total / wall if wall else None,
+        ),
+        SECTION: endpoints,
+    }
+    rows = [dict(name=name, **entry) for name, entry in sorted(endpoints.items())]
+    columns = ["name", "count", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_per_req", "alloc_blocks_per_req"]
+    if args.trace_alloc:
+        columns.append("alloc_peak_kib")
+    print_table(rows, columns)
+    print(f"\n{total} requests in {wall:.2f}s ({total / wall:.1f} req/s)")
+    if args.output:
+        save_results(args.output, results)
+        print(f"results written to {args.output}")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    base = load_results(args.base)
+    head = load_results(args.head)
+    regressions = compare_results(
+        base, head, SECTION,
+        ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_per_req"],
+        threshold=args.threshold,
+        higher_is_better=["throughput_rps"],
+    )
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmark")
+    run.add_argument("--iterations", type=int, default=20)
+    run.add_argument("--warmup", type=int, default=2)
+    run.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    run.add_argument("--s3-endpoint", help="S3-compatible endpoint (e.g. MinIO); defaults to moto in-process")
+    run.add_argument("--bucket", default=BENCH_BUCKET)
+    run.add_argument("--list-limit", type=int, default=50)
+    run.add_argument("--image-width", type=int, default=1920)
+    run.add_argument("--image-height", type=int, default=1080)
+    run.add_argument("--video-seconds", type=float, default=2.0)
+    run.add_argument("--audio-seconds", type=float, default=5.0)
+    run.add_argument("--trace-alloc", action="store_true", help="also report tracemalloc peak per request (slower)")
+    run.add_argument("--output", help="write results as JSON")
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("base")
+    cmp_.add_argument("head")
+    cmp_.add_argument("--threshold", type=float, default=0.10)
+    cmp_.add_argument("--fail-on-regression", action="store_true")
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Synthetic media corpus for the processing benchmarks.
+
+Videos and lossy audio come from ffmpeg test sources (testsrc2 / sine); images
+are rendered with NumPy + Pillow (gradient plus noise so they do not compress
+to nothing) and WAV/FLAC with soundfile. Every file is listed in
+``manifest.json`` with its kind, mimetype and generation parameters.
+
+    python -m benchmarks.corpus --out bench-corpus --preset small
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+from typing import Dict, List
+
+# (width, height, seconds, codec)
+VIDEO_PRESETS = {
+    "small": [(640, 360, 2, "h264"), (1280, 720, 5, "h264"), (1280, 720, 5, "vp9")],
+    "full": [(640, 360, 2, "h264"), (1280, 720, 5, "h264"), (1280, 720, 5, "vp9"), (1280, 720, 5, "mpeg4"),
+             (1920, 1080, 10, "h264"), (1920, 1080, 30, "h264"), (3840, 2160, 5, "h264")],
+}
+# (seconds, format)
+AUDIO_PRESETS = {
+    "small": [(5, "wav"), (30, "flac"), (30, "mp3"), (30, "aac")],
+    "full": [(5, "wav"), (30, "wav"), (30, "flac"), (30, "mp3"), (30, "aac"), (30, "opus"), (180, "flac"), (180, "mp3")],
+}
+# (width, height, format, mode)
+IMAGE_PRESETS = {
+    "small": [(640, 480, "JPEG", "RGB"), (1920, 1080, "JPEG", "RGB"), (1920, 1080, "PNG", "RGBA")],
+    "full": [(640, 480, "JPEG", "RGB"), (1920, 1080, "JPEG", "RGB"), (4000, 3000, "JPEG", "RGB"),
+             (1920, 1080, "PNG", "RGBA"), (1920, 1080, "WEBP", "RGB"), (1024, 768, "GIF", "P")],
+}
+
+VIDEO_CODECS = {
+    # codec: (ffmpeg encoder args, container extension, mimetype)
+    "h264": (["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-c:a", "aac"], "mp4", "video/mp4"),
+    "vp9": (["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-c:a", "libopus"], "webm", "video/webm"),
+    "mpeg4": (["-c:v", "mpeg4", "-q:v", "5", "-c:a", "mp3"], "avi", "video/x-msvideo"),
+}
+AUDIO_FORMATS = {
+    # format: (ffmpeg encoder args, extension, mimetype)
+    "wav": (["-c:a", "pcm_s16le"], "wav", "audio/wav"),
+    "flac": (["-c:a", "flac"], "flac", "audio/flac"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "192k"], "mp3", "audio/mpeg"),
+    "aac": (["-c:a", "aac", "-b:a", "160k"], "m4a", "audio/mp4"),
+    "opus": (["-c:a", "libopus", "-b:a", "96k"], "opus", "audio/ogg"),
+}
+IMAGE_FORMATS = {"JPEG": ("jpg", "image/jpeg"), "PNG": ("png", "image/png"), "WEBP": ("webp", "image/webp"), "GIF": ("gif", "image/gif")}
+
+
+def _ffmpeg(args: List[str]) -> None:
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + args, check=True)
+
+
+def make_video(out_dir: str, width: int, height: int, seconds: float, codec: str) -> Dict:
+    encoder, ext, mimetype = VIDEO_CODECS[codec]
+    name = f"video_{width}x{height}_{seconds}s_{codec}.{ext}"
+    path = os.path.join(out_dir, name)
+    _ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+             "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+             "-shortest"] + encoder + [path])
+    return {"name": name, "kind": "video", "mimetype": mimetype,
+            "params": {"width": width, "height": height, "seconds": seconds, "codec": codec}}
+
+
+def make_audio(out_dir: str, seconds: float, fmt: str, have_ffmpeg: bool) -> Dict:
+    encoder, ext, mimetype = AUDIO_FORMATS[fmt]
+    name = f"audio_{seconds}s_{fmt}.{ext}"
+    path = os.path.join(out_dir, name)
+    if have_ffmpeg:
+        # two tones on two channels so stereo handling is exercised
+        _ffmpeg(["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+                 "-f", "lavfi", "-i", f"sine=frequency=660:sample_rate=44100:duration={seconds}",
+                 "-filter_complex", "[0:a][1:a]amerge=inputs=2[a]", "-map", "[a]"] + encoder + [path])
+    else:
+        import numpy as np
+        import soundfile as sf
+        t = np.arange(int(seconds * 44100)) / 44100.0
+        stereo = np.stack([0.3 * np.sin(2 * np.pi * 440 * t), 0.3 * np.sin(2 * np.pi * 660 * t)], axis=1)
+        sf.write(path, stereo, 44100, format=fmt.upper())
+    return {"name": name, "kind": "audio", "mimetype": mimetype, "params": {"seconds": seconds, "format": fmt}}
+
+
+def make_image(out_dir: str, width: int, height: int, fmt: str, mode: str, seed: int = 0) -> Dict:
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    noise = rng.normal(0, 24, size=(height, width, 3)).astype(np.float32)
+    rgb = np.stack(np.broadcast_arrays(x, y, (x + y) / 2), axis=-1) + noise
+    img = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), "RGB")
+    if mode == "RGBA":
+        alpha = Image.fromarray(np.broadcast_to(np.linspace(64, 255, width, dtype=np.uint8)[None, :], (height, width)).copy(), "L")
+        img.putalpha(alpha)
+    elif mode == "P":
+        img = img.convert("P", palette=Image.Palette.ADAPTIVE)
+    ext, mimetype = IMAGE_FORMATS[fmt]
+    name = f"image_{width}x{height}_{mode.lower()}.{ext}"
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **({"quality": 90} if fmt in ("JPEG", "WEBP") else {}))
+    with open(os.path.join(out_dir, name), "wb") as f:
+        f.write(buf.getvalue())
+    return {"name": name, "kind": "image", "mimetype": mimetype,
+            "params": {"width": width, "height": height, "format": fmt, "mode": mode}}
+
+
+def generate(out_dir: str, preset: str) -> List[Dict]:
+    os.makedirs(out_dir, exist_ok=True)
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    entries = []
+    for width, height, fmt, mode in IMAGE_PRESETS[preset]:
+        entries.append(make_image(out_dir, width, height, fmt, mode))
+    for seconds, fmt in AUDIO_PRESETS[preset]:
+        if not have_ffmpeg and fmt not in ("wav", "flac"):
+            print(f"skipping {fmt} audio: ffmpeg not found", file=sys.stderr)
+            continue
+        entries.append(make_audio(out_dir, seconds, fmt, have_ffmpeg))
+    if have_ffmpeg:
+        for width, height, seconds, codec in VIDEO_PRESETS[preset]:
+            entries.append(make_video(out_dir, width, height, seconds, codec))
+    else:
+        print("skipping videos: ffmpeg not found", file=sys.stderr)
+    for entry in entries:
+        entry["size"] = os.path.getsize(os.path.join(out_dir, entry["name"]))
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump({"preset": preset, "files": entries}, f, indent=2)
+    return entries
+
+
+def load_manifest(corpus_dir: str) -> List[Dict]:
+    with open(os.path.join(corpus_dir, "manifest.json")) as f:
+        return json.load(f)["files"]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench-corpus")
+    parser.add_argument("--preset", choices=sorted(IMAGE_PRESETS), default="small")
+    args = parser.parse_args(argv)
+    entries = generate(args.out, args.preset)
+    total = sum(e["size"] for e in entries)
+    print(f"{len(entries)} files, {total / 1024 / 1024:.1f} MiB written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""Database scale benchmark: query latency and plan checks on a seeded database.
+
+Runs the real `crud` functions behind the listing, detail and tag endpoints
+against a database seeded with `benchmarks.db_seed`, records every SELECT they
+issue, reports latency percentiles per scenario and the plan of each
+statement (``EXPLAIN (ANALYZE, BUFFERS)`` on Postgres, ``EXPLAIN QUERY PLAN``
+on SQLite), and exits non-zero when a plan falls back to a sequential scan
+of a table with at least --min-rows rows.
+
+    python -m benchmarks.db_seed --database-url postgresql://... --media 10000000
+    python -m benchmarks.db_bench run --database-url postgresql://... --output base.json
+    python -m benchmarks.db_bench compare base.json head.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .stats import compare_results, load_results, print_table, run_metadata, save_results, summarize_latencies
+
+SECTION = "queries"
+
+
+class StatementCapture:
+    """Records the SELECT statements (with parameters) run on an engine while active."""
+
+    def __init__(self):
+        self.active = False
+        self.statements: List[Tuple[str, object]] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and not executemany and statement.lstrip().upper().startswith("SELECT"):
+            self.statements.append((statement, parameters))
+
+    def install(self, engine) -> None:
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", self)
+
+
+# Plans
+
+def _walk_pg_plan(node: Dict, out: List[Dict]) -> None:
+    out.append(node)
+    for child in node.get("Plans", ()):
+        _walk_pg_plan(child, out)
+
+
+def explain_postgres(conn, statement: str, parameters) -> Dict:
+    row = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters).scalar()
+    plan = (json.loads(row) if isinstance(row, str) else row)[0]
+    nodes: List[Dict] = []
+    _walk_pg_plan(plan["Plan"], nodes)
+    return {
+        "execution_ms": plan.get("Execution Time"),
+        "shared_hit_blocks": plan["Plan"].get("Shared Hit Blocks"),
+        "shared_read_blocks": plan["Plan"].get("Shared Read Blocks"),
+        "nodes": [
+            {k: n.get(k) for k in ("Node Type", "Relation Name", "Index Name", "Actual Rows", "Actual Loops") if n.get(k) is not None}
+            for n in nodes
+        ],
+        "seq_scans": sorted({n["Relation Name"] for n in nodes if n.get("Node Type") == "Seq Scan"}),
+    }
+
+
+def explain_sqlite(conn, statement: str, parameters) -> Dict:
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    details = [r[-1] for r in rows]
+    # "SCAN media" is a full table scan; "SCAN media USING INDEX ..." walks an index
+    seq = {d.split()[1] for d in details if d.startswith("SCAN ") and "USING" not in d and len(d.split()) > 1}
+    return {"nodes": details, "seq_scans": sorted(seq)}
+
+
+def table_rows(conn, dialect: str, table: str) -> int:
+    if dialect == "postgresql":
+        return int(conn.exec_driver_sql("SELECT reltuples::bigint FROM pg_class WHERE relname = %(t)s", {"t": table}).scalar() or 0)
+    return int(conn.exec_driver_sql(f'SELECT count(*) FROM "{table}"').scalar())
+
+
+# Scenarios
+
+class Context:
+    """Ids picked from the seeded data that the scenarios query."""
+
+    def __init__(self, db, seed: int):
+        from sqlalchemy import func
+        from app import models
+        self.rng = random.Random(seed)
+        ranked = (
+            db.query(models.Media.owner_id, func.count())
+            .group_by(models.Media.owner_id)
+            .order_by(func.count().desc())
+            .all()
+        )
+        if not ranked:
+            sys.exit("database has no media; seed it with benchmarks.db_seed first")
+        self.largest_owner = ranked[0][0]
+        self.largest_owner_media = ranked[0][1]
+        self.typical_owner = ranked[len(ranked) // 2][0]
+        self.max_media_id = db.query(func.max(models.Media.id)).scalar()
+        self.popular_tags = [name for (name,) in db.query(models.Tag.name).order_by(models.Tag.id).limit(5)]
+
+    def random_media_id(self) -> int:
+        return self.rng.randint(1, self.max_media_id)
+
+
+def _get_media_detail(db, ctx: Context):
+    from app import crud
+    media = crud.get_media(db, ctx.random_media_id())
+    if media is not None:
+        # the detail endpoints read tags and the type-specific metadata
+        list(media.tags)
+        media.image_metadata, media.video_metadata, media.audio_metadata
+    return media
+
+
+def _associate_tags(db, ctx: Context):
+    from app import crud
+    media = crud.get_media(db, ctx.random_media_id())
+    if media is not None:
+        crud.associate_tags_to_media(db, media, ctx.popular_tags[:2])
+
+
+def scenarios(list_limit: int, deep_offset: int) -> List[Tuple[str, Callable]]:
+    from app import crud
+    return [
+        ("list_media[largest_owner]", lambda db, ctx: crud.list_media(db, ctx.largest_owner, limit=list_limit)),
+        ("list_media[typical_owner]", lambda db, ctx: crud.list_media(db, ctx.typical_owner, limit=list_limit)),
+        (f"list_media[largest_owner,offset={deep_offset}]",
+         lambda db, ctx: crud.list_media(db, ctx.largest_owner, limit=list_limit, offset=deep_offset)),
+        ("list_media_search[largest_owner]",
+         lambda db, ctx: crud.list_media(db, ctx.largest_owner, q="praia", limit=list_limit)),
+        ("get_listing_thumbnail_key", lambda db, ctx: crud.get_listing_thumbnail_key(db, ctx.random_media_id())),
+        ("get_media[detail]", _get_media_detail),
+        ("get_or_create_tag[existing]", lambda db, ctx: crud.get_or_create_tag(db, ctx.popular_tags[0])),
+        ("associate_tags_to_media", _associate_tags),
+    ]
+
+
+def cmd_run(args) -> int:
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("JWT_SECRET", "bench-secret")
+    from app.database import SessionLocal, engine
+
+    dialect = engine.dialect.name
+    explain = explain_postgres if dialect == "postgresql" else explain_sqlite
+    capture = StatementCapture()
+    capture.install(engine)
+    allowed = set(args.allow_seq_scan or ())
+
+    with SessionLocal() as db:
+        ctx = Context(db, args.seed)
+    print(f"largest owner {ctx.largest_owner} ({ctx.largest_owner_media:,} media), typical owner {ctx.typical_owner}, "
+          f"max media id {ctx.max_media_id:,}")
+
+    results: Dict[str, Dict] = {}
+    violations: List[str] = []
+    row_counts: Dict[str, int] = {}
+    for name, fn in scenarios(args.list_limit, args.deep_offset):
+        if args.only and not any(s in name for s in args.only):
+            continue
+        for _ in range(args.warmup):
+            with SessionLocal() as db:
+                fn(db, ctx)
+        samples = []
+        for i in range(args.iterations):
+            with SessionLocal() as db:
+                if i == 0:
+                    # plans are taken from the first measured run
+                    capture.statements.clear()
+                    capture.active = True
+                started = time.perf_counter()
+                fn(db, ctx)
+                samples.append(time.perf_counter() - started)
+                capture.active = False
+        entry = summarize_latencies(samples)
+        plans = []
+        with engine.connect() as conn:
+            for statement, parameters in list(capture.statements):
+                plan = explain(conn, statement, parameters)
+                plan["sql"] = " ".join(statement.split())
+                bad = []
+                for table in plan["seq_scans"]:
+                    if table not in row_counts:
+                        row_counts[table] = table_rows(conn, dialect, table)
+                    if table not in allowed and row_counts[table] >= args.min_rows:
+                        bad.append(table)
+                plan["violations"] = bad
+                violations.extend(f"{name}: sequential scan on {t} ({row_counts[t]:,} rows)" for t in bad)
+                plans.append(plan)
+            conn.rollback()
+        entry["statements"] = len(plans)
+        entry["seq_scans"] = sum(len(p["violations"]) for p in plans)
+        entry["plans"] = plans
+        results[name] = entry
+
+    rows = [dict(name=name, **{k: v for k, v in entry.items() if k != "plans"}) for name, entry in results.items()]
+    print_table(rows, ["name", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "statements", "seq_scans"])
+    if args.show_plans:
+        for name, entry in results.items():
+            print(f"\n== {name}")
+            for plan in entry["plans"]:
+                print(plan["sql"])
+                for node in plan["nodes"]:
+                    print(f"  {node}")
+
+    out = {
+        "meta": run_metadata(
+            benchmark="db",
+            dialect=dialect,
+            database_url=args.database_url.split("@")[-1],
+            iterations=args.iterations,
+            largest_owner_media=ctx.largest_owner_media,
+            table_rows=row_counts,
+        ),
+        SECTION: results,
+    }
+    if args.output:
+        save_results(args.output, out)
+        print(f"results written to {args.output}")
+    if violations:
+        print("\nsequential scans:", file=sys.stderr)
+        for v in violations:
+            print(f"  {v}", file=sys.stderr)
+        return 0 if args.no_fail_on_seq_scan else 1
+    return 0
+
+
+def cmd_compare(args) -> int:
+    regressions = compare_results(
+        load_results(args.base), load_results(args.head), SECTION,
+        ["p50_ms", "p95_ms", "statements", "seq_scans"],
+        threshold=args.threshold,
+    )
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmark")
+    run.add_argument("--database-url", required=True)
+    run.add_argument("--iterations", type=int, default=50)
+    run.add_argument("--warmup", type=int, default=5)
+    run.add_argument("--list-limit", type=int, default=50)
+    run.add_argument("--deep-offset", type=int, default=5000)
+    run.add_argument("--min-rows", type=int, default=10_000, help="ignore sequential scans on smaller tables")
+    run.add_argument("--allow-seq-scan", action="append", metavar="TABLE", help="table allowed to be scanned (repeatable)")
+    run.add_argument("--no-fail-on-seq-scan", action="store_true", help="report sequential scans without failing")
+    run.add_argument("--only", action="append", help="only run scenarios whose name contains this (repeatable)")
+    run.add_argument("--show-plans", action="store_true")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--output", help="write results as JSON")
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("base")
+    cmp_.add_argument("head")
+    cmp_.add_argument("--threshold", type=float, default=0.10)
+    cmp_.add_argument("--fail-on-regression", action="store_true")
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
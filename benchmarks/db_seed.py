@@ -0,0 +1,327 @@
+"""Bulk-load a Postgres database with realistic multimedia rows using COPY.
+
+Generates users, media (skewed across tenants with a Zipf-like distribution so a
+few users own most of the rows), listing/video-frame thumbnails, per-type
+metadata (images with pHashes, a share of them near-duplicates of the owner's
+previous image), audio renditions and fingerprints, tags, media_tags and the
+per-user usage totals. Rows are streamed to ``COPY ... FROM STDIN`` in
+chunks, so memory stays flat regardless of --media.
+
+    python -m benchmarks.db_seed --database-url postgresql://... --users 50000 --media 10000000
+
+The schema is created from the models (``create_all``) when missing; run
+``alembic upgrade head`` instead to benchmark exactly what production has.
+"""
+import argparse
+import io
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Sequence
+
+import bcrypt
+import numpy as np
+
+from app import similarity
+
+CHUNK_ROWS = 200_000
+# every seeded user logs in with this password
+PASSWORD = "bench-password"
+WORDS = [
+    "praia", "show", "familia", "viagem", "podcast", "entrevista", "aula", "musica", "natal", "festa",
+    "trabalho", "projeto", "futebol", "receita", "paisagem", "cidade", "noite", "ensaio", "demo", "live",
+]
+MEDIA_TYPES = np.array(["image", "video", "audio"])
+MEDIA_TYPE_P = [0.6, 0.25, 0.15]
+EXT = {"image": ("jpg", "image/jpeg"), "video": ("mp4", "video/mp4"), "audio": ("mp3", "audio/mpeg")}
+FOLDER = {"image": "images", "video": "videos", "audio": "audios"}
+THUMBNAIL_BYTES = 12_000
+AUDIO_SECONDS = 180
+AUDIO_LADDER = [("opus", 64_000, "audio/ogg", "ogg"), ("opus", 128_000, "audio/ogg", "ogg"),
+                ("aac", 128_000, "audio/mp4", "m4a")]
+# thumbnails and renditions, as routes add them with crud.add_derived_size
+DERIVED_BYTES = {
+    "image": THUMBNAIL_BYTES,
+    "video": 2 * THUMBNAIL_BYTES,
+    "audio": sum(bitrate // 8 * AUDIO_SECONDS for _codec, bitrate, _mime, _ext in AUDIO_LADDER),
+}
+# share of images that are a near-duplicate (a few bits off) of the owner's previous image
+NEAR_DUPLICATE_P = 0.05
+FINGERPRINT_HASH_BITS = 25
+FINGERPRINT_FRAMES = 4_000
+
+
+def _copy(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> int:
+    """COPY rows into `table` in text format; None becomes NULL."""
+    buf = io.StringIO()
+    count = 0
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+
+    def flush():
+        buf.seek(0)
+        cursor.copy_expert(sql, buf)
+        buf.seek(0)
+        buf.truncate()
+
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v) for v in row))
+        buf.write("\n")
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            flush()
+    flush()
+    return count
+
+
+def _owner_weights(n_users: int, skew: float) -> np.ndarray:
+    weights = 1.0 / np.power(np.arange(1, n_users + 1, dtype=np.float64), skew)
+    return weights / weights.sum()
+
+
+class Seeder:
+    def __init__(self, cursor, users: int, media: int, tags: int, tags_per_media: int, skew: float, days: int, seed: int,
+                 fingerprints_per_audio: int = 200):
+        self.cursor = cursor
+        self.users = users
+        self.media = media
+        self.tags = tags
+        self.tags_per_media = tags_per_media
+        self.skew = skew
+        self.days = days
+        self.fingerprints_per_audio = fingerprints_per_audio
+        self.rng = np.random.default_rng(seed)
+        # every pass over the media rows must regenerate the same owners/types
+        self.media_seed = int(self.rng.integers(1 << 32))
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+
+    def _timed(self, label: str, fn: Callable[[], int]) -> None:
+        started = time.perf_counter()
+        n = fn()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<16} {n:>12,} rows  {elapsed:8.1f}s  ({n / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    def _media_chunks(self):
+        """Yield (ids, owner_ids, media_types, created_at seconds-ago) per chunk, deterministically."""
+        weights = _owner_weights(self.users, self.skew)
+        rng = np.random.default_rng(self.media_seed)
+        for start in range(1, self.media + 1, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, self.media + 1 - start)
+            ids = np.arange(start, start + n)
+            owners = rng.choice(self.users, size=n, p=weights) + 1
+            types = rng.choice(MEDIA_TYPES, size=n, p=MEDIA_TYPE_P)
+            ages = rng.integers(0, self.days * 86400, size=n)
+            yield ids, owners, types, ages
+
+    def seed_users(self) -> int:
+        def rows():
+            for i in range(1, self.users + 1):
+                created = self.now - timedelta(days=self.days + 1, seconds=i)
+                yield (i, f"user{i}@example.com", self.password_hash, f"User {i}", f"user{i}", None, "t", created, None, 0)
+        return _copy(self.cursor, "users",
+                     ["id", "email", "hashed_password", "full_name", "username", "bio", "is_active", "created_at",
+                      "avatar_s3_key", "token_version"], rows())
+
+    def seed_tags(self) -> int:
+        names = [f"{WORDS[i % len(WORDS)]}{'' if i < len(WORDS) else i}" for i in range(self.tags)]
+        return _copy(self.cursor, "tags", ["id", "name"], ((i + 1, name) for i, name in enumerate(names)))
+
+    def seed_media(self) -> int:
+        rng = np.random.default_rng(self.rng.integers(1 << 32))
+
+        def rows():
+            for ids, owners, types, ages in self._media_chunks():
+                words = rng.integers(0, len(WORDS), size=(len(ids), 3))
+                sizes = rng.integers(50_000, 200_000_000, size=len(ids))
+                for j in range(len(ids)):
+                    media_id, owner, kind = int(ids[j]), int(owners[j]), str(types[j])
+                    ext, mimetype = EXT[kind]
+                    created = self.now - timedelta(seconds=int(ages[j]))
+                    w = [WORDS[k] for k in words[j]]
+                    filename = f"{w[0]}_{media_id}.{ext}"
+                    key = f"{owner}/{FOLDER[kind]}/{created:%Y%m%d%H%M%S}_{media_id:032x}_{w[0]}_{media_id}.{ext}"
+                    yield (media_id, f"{w[1]} {w[2]} {w[0]}", filename, key, mimetype, int(sizes[j]),
+                           DERIVED_BYTES[kind], "f", owner, created, created, kind)
+        return _copy(self.cursor, "media",
+                     ["id", "description", "filename", "s3_key", "mimetype", "size", "derived_size", "is_public",
+                      "owner_id", "created_at", "upload_at", "media_type"], rows())
+
+    def seed_thumbnails(self) -> int:
+        # one listing thumbnail per image/video; videos also get an extra frame
+        def rows():
+            thumb_id = 0
+            for ids, owners, types, ages in self._media_chunks():
+                for media_id, owner, kind, age in zip(ids.tolist(), owners.tolist(), types.tolist(), ages.tolist()):
+                    if kind == "audio":
+                        continue
+                    created = self.now - timedelta(seconds=age)
+                    purposes = ["listing", "video-frame"] if kind == "video" else ["listing"]
+                    for purpose in purposes:
+                        thumb_id += 1
+                        key = f"{owner}/{FOLDER[kind]}/thumbnails/{media_id:032x}_{purpose}.jpg"
+                        yield (thumb_id, media_id, key, 320, 180, THUMBNAIL_BYTES, purpose, created)
+        return _copy(self.cursor, "thumbnails",
+                     ["id", "media_id", "s3_key", "width", "height", "size", "purpose", "created_at"], rows())
+
+    def seed_metadata(self) -> int:
+        rng = np.random.default_rng(self.rng.integers(1 << 32))
+        image_rows, video_rows, audio_rows = [], [], []
+        last_hash = {}  # owner -> pHash of their latest image
+
+        def flush(table, columns, buffer):
+            _copy(self.cursor, table, columns, buffer)
+            buffer.clear()
+
+        total = 0
+        for ids, owners, types, _ages in self._media_chunks():
+            hashes = rng.integers(0, 1 << 64, size=len(ids), dtype=np.uint64)
+            near = rng.random(len(ids)) < NEAR_DUPLICATE_P
+            flips = rng.integers(0, 64, size=(len(ids), 8))
+            for j, (media_id, owner, kind) in enumerate(zip(ids.tolist(), owners.tolist(), types.tolist())):
+                if kind == "image":
+                    h = int(hashes[j])
+                    if near[j] and owner in last_hash:
+                        h = last_hash[owner]
+                        for bit in set(flips[j].tolist()):
+                            h ^= 1 << bit
+                    last_hash[owner] = h
+                    c = similarity.hash_columns(h)
+                    image_rows.append((media_id, owner, 4000, 3000, 24, 72, 72, "{}", None, c["phash"],
+                                       c["phash_b0"], c["phash_b1"], c["phash_b2"], c["phash_b3"]))
+                elif kind == "video":
+                    video_rows.append((media_id, 120, 1920, 1080, 30, "h264", "aac", 6_000_000, None,
+                                       None, None, None, None))
+                else:
+                    audio_rows.append((media_id, AUDIO_SECONDS, 192_000, 44100, 2, None))
+            total += len(ids)
+            flush("image_metadata", ["media_id", "owner_id", "width", "height", "color_depth", "dpi_x", "dpi_y", "exif",
+                                     "main_thumbnail_id", "phash", "phash_b0", "phash_b1", "phash_b2", "phash_b3"],
+                  image_rows)
+            flush("video_metadata", ["media_id", "duration_seconds", "width", "height", "frame_rate", "video_codec",
+                                     "audio_codec", "bitrate", "main_thumbnail_id", "url_1080", "url_720", "url_480",
+                                     "genero"], video_rows)
+            flush("audio_metadata", ["media_id", "duration_seconds", "bitrate", "sample_rate", "channels", "genero"],
+                  audio_rows)
+        return total
+
+    def seed_audio_renditions(self) -> int:
+        def rows():
+            rendition_id = 0
+            for ids, owners, types, ages in self._media_chunks():
+                for media_id, owner, kind, age in zip(ids.tolist(), owners.tolist(), types.tolist(), ages.tolist()):
+                    if kind != "audio":
+                        continue
+                    created = self.now - timedelta(seconds=age)
+                    for codec, bitrate, mimetype, ext in AUDIO_LADDER:
+                        rendition_id += 1
+                        key = f"{owner}/audios/renditions/{media_id:032x}_{codec}_{bitrate // 1000}k.{ext}"
+                        yield (rendition_id, media_id, codec, bitrate, mimetype, bitrate // 8 * AUDIO_SECONDS, key,
+                               created)
+        return _copy(self.cursor, "audio_renditions",
+                     ["id", "media_id", "codec", "bitrate", "mimetype", "size", "s3_key", "created_at"], rows())
+
+    def seed_audio_fingerprints(self) -> int:
+        rng = np.random.default_rng(self.rng.integers(1 << 32))
+
+        def rows():
+            for ids, owners, types, _ages in self._media_chunks():
+                for media_id, owner, kind in zip(ids.tolist(), owners.tolist(), types.tolist()):
+                    if kind != "audio":
+                        continue
+                    hashes = rng.integers(0, 1 << FINGERPRINT_HASH_BITS, size=self.fingerprints_per_audio)
+                    offsets = rng.integers(0, FINGERPRINT_FRAMES, size=self.fingerprints_per_audio)
+                    # (hash, offset) is unique per media in the index
+                    for landmark in np.unique(hashes * FINGERPRINT_FRAMES + offsets).tolist():
+                        yield owner, landmark // FINGERPRINT_FRAMES, media_id, landmark % FINGERPRINT_FRAMES
+        return _copy(self.cursor, "audio_fingerprints", ["owner_id", "hash", "media_id", '"offset"'], rows())
+
+    def seed_usage(self) -> int:
+        # the same totals `python -m app.usage` (repair) would compute
+        self.cursor.execute(
+            "INSERT INTO user_usage (user_id, media_type, bytes, count, updated_at) "
+            "SELECT owner_id, media_type, SUM(COALESCE(size, 0) + derived_size), COUNT(*), now() "
+            "FROM media GROUP BY owner_id, media_type"
+        )
+        return self.cursor.rowcount
+
+    def seed_media_tags(self) -> int:
+        rng = np.random.default_rng(self.rng.integers(1 << 32))
+        # popular tags are much more common than the long tail
+        weights = _owner_weights(self.tags, 1.0)
+
+        def rows():
+            for ids, _owners, _types, _ages in self._media_chunks():
+                counts = rng.integers(0, self.tags_per_media + 1, size=len(ids))
+                picks = rng.choice(self.tags, size=(len(ids), self.tags_per_media), p=weights) + 1
+                for media_id, n, tags in zip(ids.tolist(), counts.tolist(), picks.tolist()):
+                    for tag in set(tags[:n]):
+                        yield media_id, tag
+        return _copy(self.cursor, "media_tags", ["media_id", "tag_id"], rows())
+
+    def run(self) -> None:
+        self._timed("users", self.seed_users)
+        self._timed("tags", self.seed_tags)
+        self._timed("media", self.seed_media)
+        self._timed("thumbnails", self.seed_thumbnails)
+        self._timed("metadata", self.seed_metadata)
+        self._timed("audio_renditions", self.seed_audio_renditions)
+        self._timed("fingerprints", self.seed_audio_fingerprints)
+        self._timed("usage", self.seed_usage)
+        self._timed("media_tags", self.seed_media_tags)
+
+
+TABLES = ["media_tags", "tags", "video_renditions", "audio_renditions", "audio_fingerprints", "image_metadata",
+          "video_metadata", "audio_metadata", "thumbnails", "media", "user_usage", "idempotency_keys", "users"]
+
+
+def reset_sequences(cursor) -> None:
+    for table in ["users", "media", "thumbnails", "tags", "video_renditions", "audio_renditions"]:
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)"
+        )
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="postgresql:// URL (COPY needs Postgres)")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--media", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=2_000)
+    parser.add_argument("--tags-per-media", type=int, default=4, help="maximum tags per media (uniform 0..N)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of media per owner")
+    parser.add_argument("--days", type=int, default=365, help="spread created_at over this many days")
+    parser.add_argument("--fingerprints-per-audio", type=int, default=200, help="landmarks indexed per audio")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="empty the tables first")
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine
+    from app.database import Base
+    from app import models  # noqa: F401  (registers the tables)
+
+    engine = create_engine(args.database_url)
+    if engine.dialect.name != "postgresql":
+        sys.exit("db_seed needs PostgreSQL (COPY FROM STDIN)")
+    Base.metadata.create_all(bind=engine)
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if args.truncate:
+            cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+        started = time.perf_counter()
+        Seeder(cursor, args.users, args.media, args.tags, args.tags_per_media, args.skew, args.days, args.seed,
+               fingerprints_per_audio=args.fingerprints_per_audio).run()
+        reset_sequences(cursor)
+        raw.commit()
+        # fresh statistics so the planner sees the real row counts
+        raw.set_isolation_level(0)
+        cursor.execute(f"VACUUM ANALYZE {', '.join(TABLES)}")
+        print(f"done in {time.perf_counter() - started:.1f}s")
+    finally:
+        raw.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
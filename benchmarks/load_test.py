@@ -0,0 +1,389 @@
+"""Open-loop load generator replaying a mixed traffic profile against a running API.
+
+Requests arrive as a Poisson process at each target rate (so a slow server
+builds a queue instead of slowing the client down), each one drawn from the
+--mix weights. Every stage runs for --stage-seconds; stepping through several
+rates shows where latency and errors bend upwards. Per stage and per report
+interval it reports achieved throughput, p50/p95/p99 latency, error rate,
+requests the client had to drop because --max-in-flight was reached, and,
+when the server exposes /metrics, its in-flight requests and threadpool
+occupancy.
+
+    uvicorn app.main:app --workers 2 &
+    python -m benchmarks.load_test run --base-url http://localhost:8000 \\
+        --mix list=70,detail=20,upload_image=8,upload_video=2 --rates 5,10,20,40 --output run.json
+    python -m benchmarks.load_test compare base.json head.json
+
+The saturation point is the last rate before the first unhealthy stage. A
+stage is healthy when p99 stays under --slo-ms, the error rate under
+--max-error-rate, nothing is dropped and at least 90% of the offered requests
+complete within the stage.
+Rerun with different THREADPOOL_SIZE / WEB_CONCURRENCY to compare knees.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from .stats import compare_results, load_results, print_table, run_metadata, save_results, summarize_latencies
+
+SECTION = "stages"
+DEFAULT_MIX = "list=70,detail=20,upload_image=8,upload_video=2"
+OPERATIONS = ("list", "search", "detail", "url", "upload_image", "upload_video", "upload_audio")
+SERVER_GAUGES = ("http_requests_in_flight", "threadpool_threads_busy", "threadpool_tasks_waiting", "ffmpeg_processes_active")
+UPLOAD_FILES = {
+    "image": ("load.png", "image/png"),
+    "video": ("load.mp4", "video/mp4"),
+    "audio": ("load.wav", "audio/wav"),
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("mix needs at least one positive weight")
+    return mix
+
+
+def parse_gauges(text: str) -> Dict[str, float]:
+    values = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, _, value = line.partition(" ")
+        if name in SERVER_GAUGES:
+            try:
+                values[name] = float(value)
+            except ValueError:
+                pass
+    return values
+
+
+class LoadGenerator:
+    def __init__(self, client, args, payloads: Dict[str, bytes]):
+        self.client = client
+        self.args = args
+        self.payloads = payloads
+        self.tokens: List[str] = []
+        # (owner's token, media id): media are only readable by their owner
+        self.media: List[Tuple[str, int]] = []
+        self.created: List[Tuple[str, int]] = []
+        self.ops, self.weights = zip(*parse_mix(args.mix).items())
+        self.rng = random.Random(args.seed)
+        self.in_flight = 0
+        # (started_at, op, latency seconds, status; 0 for transport errors)
+        self.records: List[Tuple[float, str, float, int]] = []
+        self.dropped = 0
+        self.server: List[Tuple[float, Dict[str, float]]] = []
+
+    def _headers(self, token: Optional[str] = None) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token or self.rng.choice(self.tokens)}"}
+
+    async def setup(self) -> None:
+        for i in range(self.args.users):
+            creds = {"email": f"load{i}@example.com", "password": "load-password"}
+            await self.client.post("/auth/register", json=creds)
+            resp = await self.client.post("/auth/login", data={"username": creds["email"], "password": creds["password"]})
+            resp.raise_for_status()
+            self.tokens.append(resp.json()["access_token"])
+        for token in self.tokens:
+            resp = await self.client.get("/media/?limit=50", headers=self._headers(token))
+            resp.raise_for_status()
+            self.media.extend((token, item["id"]) for item in resp.json())
+        # make sure detail requests have something to hit
+        missing = self.args.seed_uploads - len(self.media)
+        for _ in range(2 * max(0, missing)):
+            if len(self.media) >= self.args.seed_uploads:
+                break
+            resp = await self._upload("image")
+        if len(self.media) < self.args.seed_uploads:
+            raise RuntimeError(f"seeding stopped with {len(self.media)} of {self.args.seed_uploads} media; "
+                               f"last upload: {resp.status_code} {resp.text[:200]}")
+
+    async def _upload(self, kind: str):
+        filename, mimetype = UPLOAD_FILES[kind]
+        token = self.rng.choice(self.tokens)
+        resp = await self.client.post(
+            f"/media/upload/{kind}",
+            headers=self._headers(token),
+            data={"description": f"load {kind}", "tags": "load"},
+            files={"file": (filename, self.payloads[kind], mimetype)},
+        )
+        if resp.status_code < 400:
+            media_id = resp.json().get("id")
+            if media_id is not None:
+                self.media.append((token, media_id))
+                self.created.append((token, media_id))
+        return resp
+
+    async def _call(self, op: str):
+        if op == "list":
+            return await self.client.get("/media/?limit=50", headers=self._headers())
+        if op == "search":
+            return await self.client.get("/media/?q=load&limit=50", headers=self._headers())
+        if op in ("detail", "url") and self.media:
+            token, media_id = self.rng.choice(self.media)
+            path = f"/media/{media_id}" if op == "detail" else f"/media/{media_id}/url"
+            return await self.client.get(path, headers=self._headers(token))
+        if op.startswith("upload_"):
+            return await self._upload(op.split("_", 1)[1])
+        # detail/url before any media exists
+        return await self.client.get("/media/?limit=50", headers=self._headers())
+
+    async def _one(self, op: str) -> None:
+        started = time.perf_counter()
+        try:
+            resp = await self._call(op)
+            status = resp.status_code
+        except Exception:
+            status = 0
+        finally:
+            self.in_flight -= 1
+        self.records.append((started, op, time.perf_counter() - started, status))
+
+    async def _scrape(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            try:
+                resp = await self.client.get("/metrics", timeout=5)
+                if resp.status_code == 200:
+                    self.server.append((time.perf_counter(), parse_gauges(resp.text)))
+            except Exception:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.args.report_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stage(self, rate: float, seconds: float) -> Tuple[float, float]:
+        """Fire requests at `rate`/s for `seconds`; returns (start, end) of the arrival window."""
+        tasks = set()
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_at = started
+        while True:
+            next_at += self.rng.expovariate(rate)
+            if next_at >= deadline:
+                break
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.in_flight >= self.args.max_in_flight:
+                self.dropped += 1
+                continue
+            op = self.rng.choices(self.ops, weights=self.weights)[0]
+            # counted before the task starts so a burst cannot overshoot the cap
+            self.in_flight += 1
+            task = asyncio.ensure_future(self._one(op))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        end = time.perf_counter()
+        # let the stage's requests finish so they are not billed to the next one
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.drain_seconds)
+        return started, end
+
+    async def cleanup(self) -> None:
+        for token, media_id in self.created:
+            try:
+                await self.client.delete(f"/media/{media_id}", headers=self._headers(token))
+            except Exception:
+                pass
+
+
+def summarize(records, start: float, end: float, target_rate: Optional[float] = None) -> Dict:
+    window = [r for r in records if start <= r[0] < end]
+    # throughput counts completions inside the window, not arrivals
+    completed = sum(1 for r in records if start <= r[0] + r[2] < end)
+    ok = [r[2] for r in window if 0 < r[3] < 400]
+    errors = [r for r in window if not 0 < r[3] < 400]
+    entry = summarize_latencies(ok)
+    elapsed = end - start
+    entry.update({
+        "requests": len(window),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(window) if window else 0.0,
+        "offered_rps": len(window) / elapsed if elapsed > 0 else 0.0,
+        "achieved_rps": completed / elapsed if elapsed > 0 else 0.0,
+    })
+    if target_rate is not None:
+        entry["target_rps"] = target_rate
+    status_counts = defaultdict(int)
+    for r in errors:
+        status_counts[str(r[3])] += 1
+    if status_counts:
+        entry["error_status"] = dict(status_counts)
+    return entry
+
+
+def server_peaks(samples, start: float, end: float) -> Dict[str, float]:
+    peaks: Dict[str, float] = {}
+    for at, values in samples:
+        if start <= at <= end:
+            for name, value in values.items():
+                peaks[f"max_{name}"] = max(peaks.get(f"max_{name}", 0.0), value)
+    return peaks
+
+
+def healthy(entry: Dict, args) -> bool:
+    return (
+        entry.get("p99_ms", float("inf")) <= args.slo_ms
+        and entry["error_rate"] <= args.max_error_rate
+        # Poisson arrivals wander around the target; judge against what was actually sent
+        and entry["achieved_rps"] >= 0.9 * entry["offered_rps"]
+        and entry.get("dropped", 0) == 0
+    )
+
+
+async def run(args) -> Dict:
+    import httpx
+    from .api_bench import _mp4_bytes, _png_bytes, _wav_bytes
+
+    mix = parse_mix(args.mix)
+    payloads = {
+        "image": _png_bytes(args.image_width, args.image_height) if "upload_image" in mix or args.seed_uploads else b"",
+        "video": _mp4_bytes(args.video_seconds) if "upload_video" in mix else b"",
+        "audio": _wav_bytes(args.audio_seconds) if "upload_audio" in mix else b"",
+    }
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        gen = LoadGenerator(client, args, payloads)
+        await gen.setup()
+        stop = asyncio.Event()
+        scraper = asyncio.ensure_future(gen._scrape(stop)) if args.scrape_metrics else None
+        stages: Dict[str, Dict] = {}
+        timeline: List[Dict] = []
+        origin = time.perf_counter()
+        saturation = None
+        knee_found = False
+        try:
+            for rate in args.rates:
+                dropped_before = gen.dropped
+                start, end = await gen.stage(rate, args.stage_seconds)
+                entry = summarize(gen.records, start, end, rate)
+                entry["dropped"] = gen.dropped - dropped_before
+                entry.update(server_peaks(gen.server, start, end))
+                entry["ops"] = {
+                    op: summarize([r for r in gen.records if r[1] == op], start, end)
+                    for op in sorted({r[1] for r in gen.records if start <= r[0] < end})
+                }
+                stages[f"rate={rate:g}"] = entry
+                t = start
+                while t < end:
+                    bucket = summarize(gen.records, t, min(t + args.report_interval, end))
+                    bucket.update({"t": round(t - origin, 3), "target_rps": rate})
+                    bucket.update(server_peaks(gen.server, t, t + args.report_interval))
+                    timeline.append(bucket)
+                    t += args.report_interval
+                print(f"rate {rate:>7g}/s  achieved {entry['achieved_rps']:7.1f}/s  "
+                      f"p50 {entry.get('p50_ms', float('nan')):8.1f}ms  p99 {entry.get('p99_ms', float('nan')):8.1f}ms  "
+                      f"errors {entry['error_rate']:6.1%}  dropped {entry['dropped']}", flush=True)
+                if not healthy(entry, args):
+                    knee_found = True
+                    if args.stop_after_knee:
+                        break
+                elif not knee_found:
+                    saturation = rate
+        finally:
+            stop.set()
+            if scraper is not None:
+                await scraper
+            if args.cleanup:
+                await gen.cleanup()
+    return {"stages": stages, "timeline": timeline, "saturation_rps": saturation}
+
+
+def cmd_run(args) -> int:
+    result = asyncio.run(run(args))
+    stages = result["stages"]
+    rows = [dict(name=name, **{k: v for k, v in entry.items() if k != "ops"}) for name, entry in stages.items()]
+    columns = ["name", "achieved_rps", "requests", "errors", "dropped", "p50_ms", "p95_ms", "p99_ms"]
+    if args.scrape_metrics:
+        columns += [f"max_{g}" for g in SERVER_GAUGES]
+    print()
+    print_table(rows, columns)
+    saturation = result["saturation_rps"]
+    print(f"\nhighest healthy rate: {saturation if saturation is not None else 'none'} req/s "
+          f"(p99 <= {args.slo_ms:g}ms, errors <= {args.max_error_rate:.1%})")
+    if args.output:
+        out = {
+            "meta": run_metadata(benchmark="load", base_url=args.base_url, mix=args.mix, users=args.users,
+                                 stage_seconds=args.stage_seconds, saturation_rps=saturation),
+            SECTION: stages,
+            "timeline": result["timeline"],
+        }
+        save_results(args.output, out)
+        print(f"results written to {args.output}")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    base, head = load_results(args.base), load_results(args.head)
+    regressions = compare_results(
+        base, head, SECTION,
+        ["achieved_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"],
+        threshold=args.threshold,
+        higher_is_better=["achieved_rps"],
+    )
+    b, h = base["meta"].get("saturation_rps"), head["meta"].get("saturation_rps")
+    print(f"\nsaturation: {b} -> {h} req/s")
+    if b is not None and (h is None or h < b):
+        regressions += 1
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def _rates(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_ = sub.add_parser("run", help="generate load")
+    run_.add_argument("--base-url", default="http://localhost:8000")
+    run_.add_argument("--mix", default=DEFAULT_MIX, help=f"op=weight,... from {', '.join(OPERATIONS)}")
+    run_.add_argument("--rates", type=_rates, default=[10.0], help="comma-separated target rates (req/s), one stage each")
+    run_.add_argument("--stage-seconds", type=float, default=30.0)
+    run_.add_argument("--report-interval", type=float, default=5.0)
+    run_.add_argument("--users", type=int, default=5, help="accounts to spread requests over")
+    run_.add_argument("--seed-uploads", type=int, default=20, help="minimum media to exist before the run")
+    run_.add_argument("--max-in-flight", type=int, default=256, help="client-side concurrency cap; arrivals beyond it are dropped")
+    run_.add_argument("--timeout", type=float, default=60.0)
+    run_.add_argument("--drain-seconds", type=float, default=60.0)
+    run_.add_argument("--slo-ms", type=float, default=1000.0, help="p99 bound for a healthy stage")
+    run_.add_argument("--max-error-rate", type=float, default=0.01)
+    run_.add_argument("--stop-after-knee", action="store_true", help="stop at the first unhealthy stage")
+    run_.add_argument("--no-scrape-metrics", dest="scrape_metrics", action="store_false",
+                      help="do not poll the server's /metrics")
+    run_.add_argument("--cleanup", action="store_true", help="delete media uploaded during the run")
+    run_.add_argument("--image-width", type=int, default=1920)
+    run_.add_argument("--image-height", type=int, default=1080)
+    run_.add_argument("--video-seconds", type=float, default=2.0)
+    run_.add_argument("--audio-seconds", type=float, default=5.0)
+    run_.add_argument("--seed", type=int, default=42)
+    run_.add_argument("--output", help="write results as JSON")
+    run_.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("base")
+    cmp_.add_argument("head")
+    cmp_.add_argument("--threshold", type=float, default=0.10)
+    cmp_.add_argument("--fail-on-regression", action="store_true")
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
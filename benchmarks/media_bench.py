@@ -0,0 +1,232 @@
+"""Media-processing micro-benchmarks.
+
+Runs every processing step of `app.video_processing`, `app.audio_processing`
+and `app.image_processing` over a synthetic corpus (see `benchmarks.corpus`)
+and reports, per step and sample:
+
+- wall time (median over --repeat runs)
+- CPU time of the Python process plus its ffmpeg/ffprobe children
+- peak RSS of the Python process and of the largest child
+- bytes written to temporary files
+
+Each measurement runs in a freshly forked process so peak RSS and child
+rusage belong to that step alone. Temp bytes are counted by pointing
+`tempfile` at a private directory and recording file sizes as the step
+unlinks them (plus anything it leaves behind).
+
+    python -m benchmarks.corpus --out bench-corpus
+    python -m benchmarks.media_bench run --corpus bench-corpus --output base.json
+    python -m benchmarks.media_bench compare base.json head.json
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+from .corpus import load_manifest
+from .stats import compare_results, load_results, print_table, run_metadata, save_results
+
+SECTION = "steps"
+METRICS = ["wall_ms", "cpu_ms", "peak_rss_mib", "child_peak_rss_mib", "temp_bytes"]
+
+
+# Steps: (name, kind, needs_ffmpeg, fn(payload bytes) -> result); a None/empty result counts as a failure
+
+def _video_steps() -> List[Tuple[str, str, bool, Callable]]:
+    from app import video_processing
+    steps = [
+        ("extract_video_metadata", "video", True, video_processing.extract_video_metadata),
+        ("generate_video_thumbnail", "video", True, video_processing.generate_video_thumbnail),
+        ("generate_storyboard", "video", True, video_processing.generate_storyboard),
+    ]
+    for height in (480, 720, 1080):
+        steps.append((f"generate_video_rendition_{height}p", "video", True,
+                      lambda data, h=height: video_processing.generate_video_rendition(data, h)))
+    return steps
+
+
+def _audio_steps() -> List[Tuple[str, str, bool, Callable]]:
+    from app import audio_processing
+    # soundfile reads WAV/FLAC natively; other formats fall back to ffprobe
+    return [
+        ("extract_audio_metadata", "audio", False, audio_processing.extract_audio_metadata),
+        ("compute_waveform_peaks", "audio", False, audio_processing.compute_waveform_peaks),
+        ("compute_fingerprint", "audio", False, audio_processing.compute_fingerprint),
+        ("generate_audio_renditions", "audio", True, audio_processing.generate_audio_renditions),
+    ]
+
+
+def _image_steps() -> List[Tuple[str, str, bool, Callable]]:
+    from app import image_processing
+    return [
+        ("extract_image_metadata", "image", False,
+         lambda data: image_processing.extract_image_metadata(image_processing.open_image(data))),
+        ("generate_image_thumbnail", "image", False,
+         lambda data: image_processing.generate_image_thumbnail(image_processing.open_image(data), nbytes=len(data))),
+    ]
+
+
+def all_steps() -> List[Tuple[str, str, bool, Callable]]:
+    return _video_steps() + _audio_steps() + _image_steps()
+
+
+def _measure(fn: Callable, data: bytes, tmpdir: str) -> Dict:
+    """Run one step in the current (forked) process and return its measurements."""
+    removed = [0]
+    real_unlink = os.unlink
+
+    def counting_unlink(path, *args, **kwargs):
+        try:
+            if str(path).startswith(tmpdir):
+                removed[0] += os.path.getsize(path)
+        except OSError:
+            pass
+        return real_unlink(path, *args, **kwargs)
+
+    tempfile.tempdir = tmpdir
+    os.unlink = counting_unlink
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    ok = False
+    try:
+        result = fn(data)
+        ok = bool(result) and not (isinstance(result, dict) and result.get("error"))
+    finally:
+        wall = time.perf_counter() - started
+        os.unlink = real_unlink
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    leftover = sum(os.path.getsize(os.path.join(tmpdir, f)) for f in os.listdir(tmpdir))
+    cpu = (
+        (self_after.ru_utime - self_before.ru_utime) + (self_after.ru_stime - self_before.ru_stime)
+        + (children_after.ru_utime - children_before.ru_utime) + (children_after.ru_stime - children_before.ru_stime)
+    )
+    return {
+        "ok": ok,
+        "wall_ms": wall * 1000,
+        "cpu_ms": cpu * 1000,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": self_after.ru_maxrss / 1024,
+        "child_peak_rss_mib": children_after.ru_maxrss / 1024,
+        "temp_bytes": removed[0] + leftover,
+    }
+
+
+def _child(step_index: int, path: str, conn) -> None:
+    try:
+        _name, _kind, _ffmpeg, fn = all_steps()[step_index]
+        with open(path, "rb") as f:
+            data = f.read()
+        tmpdir = tempfile.mkdtemp(prefix="media-bench-")
+        try:
+            conn.send(_measure(fn, data, tmpdir))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    except Exception as e:
+        conn.send({"ok": False, "error": repr(e)})
+    finally:
+        conn.close()
+
+
+def run_isolated(step_index: int, path: str, timeout: float) -> Dict:
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(step_index, path, child))
+    proc.start()
+    child.close()
+    try:
+        if not parent.poll(timeout):
+            proc.kill()
+            return {"ok": False, "error": f"timeout after {timeout}s"}
+        return parent.recv()
+    except EOFError:
+        return {"ok": False, "error": f"worker exited with code {proc.exitcode}"}
+    finally:
+        proc.join()
+        parent.close()
+
+
+def cmd_run(args) -> int:
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    files = load_manifest(args.corpus)
+    steps = all_steps()
+    results: Dict[str, Dict] = {}
+    for index, (name, kind, needs_ffmpeg, _fn) in enumerate(steps):
+        if args.step and not any(s in name for s in args.step):
+            continue
+        if needs_ffmpeg and not have_ffmpeg:
+            print(f"skipping {name}: ffmpeg not found", file=sys.stderr)
+            continue
+        for entry in files:
+            if entry["kind"] != kind:
+                continue
+            path = os.path.join(args.corpus, entry["name"])
+            runs = [run_isolated(index, path, args.timeout) for _ in range(args.repeat)]
+            failed = [r for r in runs if not r.get("ok")]
+            good = [r for r in runs if r.get("ok")]
+            summary: Dict = {"runs": len(runs), "failures": len(failed), "input_bytes": entry["size"]}
+            if failed and "error" in failed[0]:
+                summary["error"] = failed[0]["error"]
+            for metric in METRICS:
+                values = [r[metric] for r in good]
+                if values:
+                    summary[metric] = statistics.median(values)
+            if good:
+                summary["mib_per_s"] = entry["size"] / 1024 / 1024 / (summary["wall_ms"] / 1000) if summary["wall_ms"] else None
+            results[f"{name}[{entry['name']}]"] = summary
+
+    rows = [dict(name=name, **entry) for name, entry in sorted(results.items())]
+    print_table(rows, ["name", "runs", "failures"] + METRICS + ["mib_per_s"])
+    out = {
+        "meta": run_metadata(benchmark="media", corpus=args.corpus, repeat=args.repeat, ffmpeg=have_ffmpeg),
+        SECTION: results,
+    }
+    if args.output:
+        save_results(args.output, out)
+        print(f"results written to {args.output}")
+    return 1 if any(e["failures"] for e in results.values()) and args.fail_on_error else 0
+
+
+def cmd_compare(args) -> int:
+    regressions = compare_results(
+        load_results(args.base), load_results(args.head), SECTION,
+        ["wall_ms", "cpu_ms", "peak_rss_mib", "child_peak_rss_mib", "temp_bytes"],
+        threshold=args.threshold,
+    )
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmark")
+    run.add_argument("--corpus", default="bench-corpus", help="directory written by benchmarks.corpus")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--step", action="append", help="only run steps whose name contains this (repeatable)")
+    run.add_argument("--timeout", type=float, default=600.0, help="per-run timeout in seconds")
+    run.add_argument("--fail-on-error", action="store_true")
+    run.add_argument("--output", help="write results as JSON")
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("base")
+    cmp_.add_argument("head")
+    cmp_.add_argument("--threshold", type=float, default=0.10)
+    cmp_.add_argument("--fail-on-regression", action="store_true")
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
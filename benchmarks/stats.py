@@ -0,0 +1,116 @@
+"""Shared helpers for the benchmark scripts: percentiles, result files and run comparison."""
+import json
+import math
+import os
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """Linear-interpolated percentile (p in 0..100) of an already sorted sequence."""
+    if not sorted_values:
+        return float("nan")
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = math.floor(k)
+    hi = math.ceil(k)
+    if lo == hi:
+        return sorted_values[int(k)]
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize_latencies(seconds: Iterable[float]) -> Dict[str, float]:
+    values = sorted(seconds)
+    if not values:
+        return {"count": 0}
+    total = sum(values)
+    return {
+        "count": len(values),
+        "mean_ms": total / len(values) * 1000,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def run_metadata(**extra) -> Dict:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        rev = None
+    meta = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "git_rev": rev,
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+    }
+    meta.update(extra)
+    return meta
+
+
+def save_results(path: str, results: Dict) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_table(rows: List[Dict], columns: Sequence[str], file=None) -> None:
+    file = file or sys.stdout
+
+    def fmt(value) -> str:
+        if isinstance(value, float):
+            return f"{value:.2f}"
+        return "" if value is None else str(value)
+
+    rendered = [[fmt(row.get(c)) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in rendered]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)), file=file)
+    print("  ".join("-" * w for w in widths), file=file)
+    for r in rendered:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)), file=file)
+
+
+def compare_results(base: Dict, head: Dict, section: str, metrics: Sequence[str], threshold: float = 0.10,
+                    higher_is_better: Sequence[str] = (), file=None) -> int:
+    """Print base vs head for every entry of `section`; return the number of regressions.
+
+    A metric regresses when it gets worse by more than `threshold` (relative).
+    Metrics listed in `higher_is_better` (e.g. throughput) regress when they drop.
+    """
+    file = file or sys.stdout
+    regressions = 0
+    rows = []
+    base_entries = base.get(section, {})
+    head_entries = head.get(section, {})
+    for name in sorted(set(base_entries) | set(head_entries)):
+        b = base_entries.get(name, {})
+        h = head_entries.get(name, {})
+        for metric in metrics:
+            bv: Optional[float] = b.get(metric)
+            hv: Optional[float] = h.get(metric)
+            delta = None
+            flag = ""
+            if isinstance(bv, (int, float)) and isinstance(hv, (int, float)) and bv:
+                delta = (hv - bv) / abs(bv)
+                worse = -delta if metric in higher_is_better else delta
+                if worse > threshold:
+                    flag = "REGRESSION"
+                    regressions += 1
+                elif worse < -threshold:
+                    flag = "improved"
+            rows.append({
+                "name": name,
+                "metric": metric,
+                "base": bv,
+                "head": hv,
+                "delta_%": None if delta is None else delta * 100,
+                "": flag,
+            })
+    print_table(rows, ["name", "metric", "base", "head", "delta_%", ""], file=file)
+    return regressions
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.content_proxy import _if_range_matches, content_etag, parse_range
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    # whole body: other units, several ranges, garbage
+    ("items=0-10", None),
+    ("bytes=0-10,20-30", None),
+    ("bytes=abc-", None),
+    ("bytes=10", None),
+    ("bytes=--5", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=50-10", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(HTTPException) as exc:
+        parse_range(header, SIZE)
+    assert exc.value.status_code == 416
+    assert exc.value.headers == {"Content-Range": f"bytes */{SIZE}"}
+
+
+def test_parse_range_empty_object():
+    with pytest.raises(HTTPException):
+        parse_range("bytes=0-", 0)
+
+
+def _request(if_range=None):
+    headers = [(b"if-range", if_range.encode())] if if_range is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+ETAG = content_etag("1/images/a.jpg")
+MODIFIED = datetime(2024, 5, 17, 13, 45, 30, 123456)
+
+
+@pytest.mark.parametrize("if_range, matches", [
+    (None, True),
+    (ETAG, True),
+    (content_etag("1/images/b.jpg"), False),
+    ("W/" + ETAG, False),
+    ("Fri, 17 May 2024 13:45:30 GMT", True),
+    ("Fri, 17 May 2024 13:45:31 GMT", False),
+    ("not a date", False),
+])
+def test_if_range(if_range, matches):
+    assert _if_range_matches(_request(if_range), ETAG, MODIFIED) is matches
+
+
+def test_if_range_date_without_last_modified():
+    assert _if_range_matches(_request("Fri, 17 May 2024 13:45:30 GMT"), ETAG, None) is False
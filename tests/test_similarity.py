@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from app import similarity
+from app.similarity import BANDS, MAX_DISTANCE
+
+
+def _flip(h, count, rng):
+    for bit in rng.sample(range(64), count):
+        h ^= 1 << bit
+    return h
+
+
+def test_bands_split_the_hash():
+    h = 0x0123_4567_89AB_CDEF
+    assert similarity.bands(h) == [0xCDEF, 0x89AB, 0x4567, 0x0123]
+
+
+def test_hash_columns_fit_signed_columns():
+    h = 0xFFFF_0000_8000_7FFF
+    columns = similarity.hash_columns(h)
+    assert columns["phash"] == h - (1 << 64)
+    assert similarity.to_unsigned(columns["phash"]) == h
+    assert [columns[f"phash_b{i}"] for i in range(BANDS)] == similarity.bands(h)
+
+
+@pytest.mark.parametrize("radius, count", [(0, 1), (1, 17), (2, 137)])
+def test_band_variants(radius, count):
+    variants = similarity.band_variants(0xBEEF, radius)
+    assert len(variants) == len(set(variants)) == count
+    assert all(bin(v ^ 0xBEEF).count("1") <= radius for v in variants)
+
+
+def test_hamming_ignores_sign():
+    a = 0xFFFF_FFFF_FFFF_FFFF
+    assert similarity.hamming(a, 0) == 64
+    assert similarity.hamming(similarity.to_signed(a), 0) == 64
+    assert similarity.hamming(similarity.to_signed(a), similarity.to_signed(a ^ 0b101)) == 2
+
+
+@pytest.mark.parametrize("distance", range(MAX_DISTANCE + 1))
+def test_search_radius_finds_every_hash_within_distance(distance):
+    # what crud_async.find_similar_images relies on: some band is within d // BANDS
+    rng = random.Random(distance)
+    radius = distance // BANDS
+    for _ in range(200):
+        a = rng.getrandbits(64)
+        b = _flip(a, distance, rng)
+        assert similarity.hamming(a, b) == distance
+        assert any(
+            band_b in similarity.band_variants(band_a, radius)
+            for band_a, band_b in zip(similarity.bands(a), similarity.bands(b))
+        )
+
+
+def test_distance_spread_evenly_escapes_a_smaller_radius():
+    # 3 bits in every band: no band within radius 2, so distance 12 is out of reach
+    a = 0
+    b = sum(0b111 << (16 * i) for i in range(BANDS))
+    assert similarity.hamming(a, b) == 12 > MAX_DISTANCE
+    assert not any(
+        band_b in similarity.band_variants(band_a, MAX_DISTANCE // BANDS)
+        for band_a, band_b in zip(similarity.bands(a), similarity.bands(b))
+    )
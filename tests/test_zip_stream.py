@@ -0,0 +1,115 @@
+import io
+import struct
+import zipfile
+import zlib
+from datetime import datetime
+
+import pytest
+
+from app import zip_stream
+from app.zip_stream import DEFLATED, STORED, ZipStream
+
+MODIFIED = datetime(2024, 5, 17, 13, 45, 30)
+
+
+def _archive(entries, chunk=7):
+    """Bytes of an archive of (name, data, method) entries, written in small chunks."""
+    zs = ZipStream()
+    out = []
+    for name, data, method in entries:
+        out.append(zs.start_entry(name, len(data), MODIFIED, method))
+        for i in range(0, len(data), chunk):
+            out.append(zs.write(data[i:i + chunk]))
+        out.append(zs.end_entry())
+    out.append(zs.finish())
+    body = b"".join(out)
+    assert zs.offset == len(body)
+    return body
+
+
+def _read_all(body):
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert zf.testzip() is None
+        return {info.filename: (info, zf.read(info)) for info in zf.infolist()}
+
+
+def test_round_trip_stored_and_deflated():
+    entries = [
+        ("a.jpg", bytes(range(256)) * 40, STORED),
+        ("notes/ção.txt", b"texto " * 500, DEFLATED),
+        ("empty.bin", b"", STORED),
+    ]
+    files = _read_all(_archive(entries))
+    assert list(files) == [name for name, _data, _method in entries]
+    for name, data, method in entries:
+        info, content = files[name]
+        assert content == data
+        assert info.compress_type == method
+        assert info.date_time == (2024, 5, 17, 13, 45, 30)
+    assert files["notes/ção.txt"][0].compress_size < len(entries[1][1])
+
+
+def test_entries_use_data_descriptors():
+    data = b"hello world" * 10
+    body = _archive([("a.txt", data, STORED)])
+    signature, _version, flags, _method, _time, _date, crc, csize, size, name_len, extra_len = struct.unpack_from(
+        "<IHHHHHIIIHH", body, 0)
+    assert signature == 0x04034B50
+    assert flags & 0x08
+    # CRC and sizes are unknown when the local header goes out
+    assert (crc, csize, size) == (0, 0, 0)
+    descriptor_at = 30 + name_len + extra_len + len(data)
+    assert struct.unpack_from("<IIII", body, descriptor_at) == (0x08074B50, zlib.crc32(data), len(data), len(data))
+
+
+def test_small_archive_has_no_zip64_records():
+    body = _archive([("a.txt", b"x" * 100, STORED)])
+    assert b"PK\x06\x06" not in body
+    assert b"PK\x06\x07" not in body
+
+
+def test_zip64_sizes_and_offsets(monkeypatch):
+    # a tiny limit exercises the ZIP64 paths without writing 4 GiB
+    monkeypatch.setattr(zip_stream, "ZIP64_LIMIT", 1000)
+    entries = [
+        ("small.txt", b"s" * 10, STORED),
+        ("big.bin", bytes(range(256)) * 8, STORED),
+        ("big.txt", b"compressible " * 200, DEFLATED),
+        ("after.txt", b"late entry past the offset limit", STORED),
+    ]
+    body = _archive(entries)
+    assert b"PK\x06\x06" in body and b"PK\x06\x07" in body
+    files = _read_all(body)
+    for name, data, _method in entries:
+        assert files[name][1] == data
+    # entries declared past the limit carry 64-bit sizes in their descriptor
+    big_header = body.index(b"big.bin") - 30
+    _sig, version, *_rest, extra_len = struct.unpack_from("<IHHHHHIIIHH", body, big_header)
+    assert version == 45 and extra_len == 20
+    assert files["after.txt"][0].header_offset >= 1000
+
+
+def test_zip64_entry_count(monkeypatch):
+    monkeypatch.setattr(zip_stream, "ZIP64_COUNT_LIMIT", 3)
+    entries = [(f"{i}.txt", str(i).encode(), STORED) for i in range(5)]
+    body = _archive(entries)
+    assert b"PK\x06\x06" in body
+    assert [name for name in _read_all(body)] == [name for name, _data, _method in entries]
+
+
+def test_entry_larger_than_declared_is_rejected(monkeypatch):
+    monkeypatch.setattr(zip_stream, "ZIP64_LIMIT", 100)
+    zs = ZipStream()
+    zs.start_entry("a.bin", 10)
+    zs.write(b"x" * 200)
+    with pytest.raises(ValueError):
+        zs.end_entry()
+
+
+def test_unfinished_entry():
+    zs = ZipStream()
+    zs.start_entry("a.bin", 1)
+    with pytest.raises(RuntimeError):
+        zs.start_entry("b.bin", 1)
+    with pytest.raises(RuntimeError):
+        zs.finish()